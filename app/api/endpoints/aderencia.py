@@ -4,72 +4,710 @@ Module that handles the /aderencia endpoint call.
 The endpoint reads the adherence statistics Kolmogorov-Smirnov (KS) test and
 Jensen-Shannon (JS)divergence for the dataset located in
 the path passed in the request body and the test dataset.
+The input file is scored once and the statistics are calculated from that score
+vector and the precomputed reference profile of the model (see `api.endpoints.adherence`).
+Other statistics, such as the Population Stability Index (PSI), can be requested
+with the optional `statistics` list of the request body, and large files can be
+read in chunks of `chunk_size` rows to keep the memory use bounded.
+Results are cached by model and input file identity (see `api.endpoints.cache`), so
+repeated requests on an unchanged file don't parse and score it again; the optional
+`cache` flag of the request body set to false recalculates and refreshes the result.
+The optional `confidence_intervals` flag adds bootstrap confidence intervals of the
+statistics to the result (see `api.endpoints.bootstrap`).
+The model version can be selected with the `model_version` query parameter.
+The statistics are calculated in the compute executor, outside the event loop.
+
+Large files can also be evaluated as asynchronous jobs: `POST /aderencia/jobs` takes
+the same body and query parameters and returns a job id right away, the status of
+the job is read from `GET /aderencia/jobs/{job_id}` and its result, once finished,
+from `GET /aderencia/jobs/{job_id}/result` (see `api.endpoints.jobs`).
+
+Several files can be evaluated in one request with `POST /aderencia/batch`, whose
+body holds a list of `paths` or a `glob` pattern, of at most ADHERENCE_BATCH_MAX_PATHS
+files. The pattern is expanded to its regular files in the compute executor, and the
+request is rejected when it matches too many of them. The files are scored in parallel
+in the compute executor, with the models and reference profiles loaded once, and the
+result of each file is streamed back as an NDJSON line as soon as it is calculated,
+with its error inline when it fails.
+
+The drift of every input of the model, rather than of its scores, is read from
+`POST /aderencia/features`, which takes the path and the `chunk_size` and `cache`
+options (see `api.endpoints.features`).
 '''
 
 
+import asyncio
+import glob
+import os
 from http import HTTPStatus
+from typing import AsyncIterator, Callable, Dict, List, Optional, Sequence, Tuple
+import orjson
 from fastapi import APIRouter, Request
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from jsonschema import exceptions
 
 
-from api.endpoints.utils import calculate_ks, calculate_js
-from api.endpoints.validators import validate_adherence_body
-from api.endpoints.exceptions import InvalidRequestError, InternalServerError, InvalidPathError
+from api.endpoints.adherence import calculate_adherence, DEFAULT_STATISTICS
+from api.settings import ADHERENCE_CHUNK_SIZE, ADHERENCE_BATCH_MAX_PATHS
+from api.endpoints.registry import MODEL_REGISTRY, ModelEntry
+from api.endpoints.reference import REFERENCE_STORE
+from api.endpoints.features import FEATURE_PROFILE_STORE, calculate_feature_drift
+from api.endpoints.cache import ADHERENCE_CACHE
+from api.endpoints.executor import COMPUTE_EXECUTOR
+from api.endpoints.metrics import stage
+from api.endpoints.jobs import JOB_QUEUE, JOB_FAILED, JOB_SUCCEEDED, Job
+from api.endpoints.validators import (
+    validate_adherence_body, validate_adherence_batch_body, validate_feature_drift_body)
+from api.endpoints.exceptions import (
+    InvalidRequestError, InternalServerError, InvalidPathError, RequestTimeoutError)
 
 
 router = APIRouter(prefix='/aderencia')
 
+# Status code of each error returned by `adherence_error`.
+ADHERENCE_ERROR_STATUS = {
+    InvalidPathError: HTTPStatus.NOT_FOUND,
+    RequestTimeoutError: HTTPStatus.GATEWAY_TIMEOUT,
+    InternalServerError: HTTPStatus.INTERNAL_SERVER_ERROR
+}
+
+# Statistics under which the feature drift results are cached, apart from the adherence ones.
+FEATURE_DRIFT_STATISTICS = ('features',)
+
+# Statistics added to the cache key of the results with confidence intervals.
+CONFIDENCE_INTERVAL_STATISTICS = ('confidence_intervals',)
+
+
+def evaluate_adherence(path: str, model_version: Optional[str], statistics: Sequence[str],
+                       chunk_size: int = ADHERENCE_CHUNK_SIZE, use_cache: bool = True,
+                       confidence_intervals: bool = False) -> Dict[str, object]:
+    '''
+    Calculates the adherence statistics of the dataset in the path against the
+    reference profile of the model, or returns them from the result cache.
+    Runs in the compute executor.
+
+    Parameters
+    ----------
+    path : str
+        The path to the data file.
+    model_version : str, optional
+        The version of the model used to score the datasets.
+    statistics : Sequence[str]
+        The keys of the statistics to calculate.
+    chunk_size : int
+        The number of rows read and scored at a time. 0 reads the whole file at once.
+    use_cache : bool
+        Whether a cached result may be returned. The calculated result is cached either way.
+    confidence_intervals : bool
+        Whether to add the bootstrap confidence intervals of the statistics.
+
+    Raises
+    ----------
+    FileNotFoundError
+        If the data file doesn't exist.
+
+    Returns
+    ----------
+    Dict[str, object]
+        The value of each statistic by its key.
+    '''
+    model_entry = MODEL_REGISTRY.get(model_version)
+
+    def calculate() -> Dict[str, object]:
+        with stage('reference'):
+            reference = REFERENCE_STORE.get(model_entry)
+
+        return calculate_adherence(path, model_entry.scorer, reference, statistics, chunk_size,
+                                   confidence_intervals)
+
+    # The results with intervals are cached apart from the results without them.
+    cached_statistics = (*statistics, *CONFIDENCE_INTERVAL_STATISTICS) \
+        if confidence_intervals else statistics
+
+    return cached_result(calculate, path, model_entry, cached_statistics, chunk_size, use_cache)
+
+
+def evaluate_feature_drift(path: str, model_version: Optional[str],
+                           chunk_size: int = ADHERENCE_CHUNK_SIZE,
+                           use_cache: bool = True) -> Dict[str, object]:
+    '''
+    Calculates the drift of every input of the model in the dataset in the path
+    against the feature profile of the model, or returns it from the result cache.
+    Runs in the compute executor.
+
+    Parameters
+    ----------
+    path : str
+        The path to the data file.
+    model_version : str, optional
+        The version of the model whose inputs are compared.
+    chunk_size : int
+        The number of rows read at a time. 0 reads the whole file at once.
+    use_cache : bool
+        Whether a cached result may be returned. The calculated result is cached either way.
+
+    Raises
+    ----------
+    FileNotFoundError
+        If the data file doesn't exist.
+
+    Returns
+    ----------
+    Dict[str, object]
+        The drift statistics of each input under the `features` key.
+    '''
+    model_entry = MODEL_REGISTRY.get(model_version)
+
+    def calculate() -> Dict[str, object]:
+        with stage('reference'):
+            profile = FEATURE_PROFILE_STORE.get(model_entry)
+
+        return {'features': calculate_feature_drift(path, profile, chunk_size)}
+
+    return cached_result(calculate, path, model_entry, FEATURE_DRIFT_STATISTICS,
+                         chunk_size, use_cache)
+
+
+def expand_glob(pattern: str, max_paths: int = ADHERENCE_BATCH_MAX_PATHS) -> List[str]:
+    '''
+    Expands a glob pattern to the regular files it matches, stopping as soon as it
+    matches more than `max_paths` of them. Runs in the compute executor.
+
+    Parameters
+    ----------
+    pattern : str
+        The glob pattern, where `**` matches any number of directories.
+    max_paths : int
+        The maximum number of matched files.
+
+    Raises
+    ----------
+    InvalidRequestError
+        If the pattern matches more than `max_paths` files.
+
+    Returns
+    ----------
+    List[str]
+        The matched files, sorted.
+    '''
+    paths = []
+
+    for path in glob.iglob(pattern, recursive=True):
+        if not os.path.isfile(path):
+            continue
+        if len(paths) == max_paths:
+            raise InvalidRequestError(
+                f'The glob pattern matches more than {max_paths} files.')
+        paths.append(path)
+
+    return sorted(paths)
+
+
+def cached_result(calculate: Callable[[], Dict[str, object]], path: str,
+                  model_entry: ModelEntry, statistics: Sequence[str], chunk_size: int,
+                  use_cache: bool) -> Dict[str, object]:
+    '''
+    Returns the result of a calculation on the dataset in the path from the result
+    cache, or calculates and caches it.
+
+    Parameters
+    ----------
+    calculate : Callable[[], Dict[str, object]]
+        The calculation.
+    path : str
+        The path to the data file.
+    model_entry : ModelEntry
+        The model registry entry.
+    statistics : Sequence[str]
+        The keys of the calculated statistics.
+    chunk_size : int
+        The number of rows read at a time.
+    use_cache : bool
+        Whether a cached result may be returned.
+
+    Returns
+    ----------
+    Dict[str, object]
+        The result of the calculation.
+    '''
+    if not ADHERENCE_CACHE.enabled:
+        return calculate()
+
+    with stage('cache'):
+        key = ADHERENCE_CACHE.key(path, model_entry, statistics, chunk_size)
+        result = ADHERENCE_CACHE.get(key) if use_cache else None
+
+    if result is None:
+        result = calculate()
+        ADHERENCE_CACHE.put(key, result)
+
+    return result
+
+
+async def read_adherence_body(request: Request, model_version: Optional[str],
+                              validate: Callable[[dict], None] = validate_adherence_body) -> dict:
+    '''
+    Reads and validates the body of an adherence request and checks its model version.
+
+    Parameters
+    ----------
+    request : Request
+        The request.
+    model_version : str, optional
+        The version of the model used to score the datasets.
+    validate : Callable[[dict], None]
+        The validator of the body.
+
+    Raises
+    ----------
+    InvalidRequestError
+        If the request body is not a valid JSON object or the model version is unknown.
+
+    Returns
+    ----------
+    dict
+        The request body.
+    '''
+    try:
+        with stage('read_body'):
+            body = await request.json()
+
+        with stage('validate'):
+            validate(body)
+    except ValueError as exception:
+        raise InvalidRequestError(
+            'Invalid request body. Must be a valid JSON object.') from exception
+    except exceptions.ValidationError as exception:
+        raise InvalidRequestError(
+            f'Body schema is invalid: {exception.message}.') from exception
+
+    if not MODEL_REGISTRY.has_version(model_version):
+        raise InvalidRequestError(f'Unknown model version: {model_version}.')
+
+    return body
+
+
+def adherence_options(body: dict) -> Tuple[Sequence[str], int, bool, bool]:
+    '''
+    Returns the options of an adherence request body, with their defaults.
+
+    Parameters
+    ----------
+    body : dict
+        The validated request body.
+
+    Returns
+    ----------
+    Tuple[Sequence[str], int, bool, bool]
+        The statistics, chunk size, cache flag and confidence intervals flag of the request.
+    '''
+    return (body.get('statistics', DEFAULT_STATISTICS),
+            body.get('chunk_size', ADHERENCE_CHUNK_SIZE), body.get('cache', True),
+            body.get('confidence_intervals', False))
+
+
+async def read_adherence_arguments(request: Request,
+                                   model_version: Optional[str]) -> Tuple[object, ...]:
+    '''
+    Reads and validates an adherence request and returns the arguments of
+    `evaluate_adherence`.
+
+    Parameters
+    ----------
+    request : Request
+        The request.
+    model_version : str, optional
+        The version of the model used to score the datasets.
+
+    Raises
+    ----------
+    InvalidRequestError
+        If the request body is not a valid JSON object or the model version is unknown.
+
+    Returns
+    ----------
+    Tuple[object, ...]
+        The path, model version, statistics, chunk size, cache flag and confidence
+        intervals flag of the request.
+    '''
+    body = await read_adherence_body(request, model_version)
+
+    return (body['path'], model_version, *adherence_options(body))
+
+
+def adherence_error(exception: Exception) -> Exception:
+    '''
+    Maps an exception raised by `evaluate_adherence` to the API exception returned
+    to the client.
+
+    Parameters
+    ----------
+    exception : Exception
+        The exception raised by the calculation.
+
+    Returns
+    ----------
+    Exception
+        An InvalidPathError if the file doesn't exist, a RequestTimeoutError if the
+        calculation timed out and an InternalServerError otherwise.
+    '''
+    if isinstance(exception, FileNotFoundError):
+        return InvalidPathError('No such file or directory in the provide path.')
+    if isinstance(exception, asyncio.TimeoutError):
+        return RequestTimeoutError('The request took too long to be processed.')
+
+    return InternalServerError(str(exception))
+
 
 @router.post('')
-async def read_adherence(request: Request):
+async def read_adherence(request: Request, model_version: Optional[str] = None):
     '''
     Endpoint to read the adherence statistics Kolmogorov-Smirnov (KS) test and
     Jensen-Shannon (JS) divergence for the dataset located in the path
     passed in the request body and the test dataset.
 
+    Parameters
+    ----------
+    model_version : str, optional
+        The version of the model used to score the datasets.
+        Defaults to the default model version.
+
     Raises
     ----------
     InvalidRequestError
-        If the request body is not a valid JSON object.
+        If the request body is not a valid JSON object or the model version is unknown.
     InvalidPathError
         If the provided path does not exist.
+    RequestTimeoutError
+        If the calculation takes longer than the executor timeout.
     InternalServerError
         If an unexpected error occurs during the execution.
 
     Returns
     ----------
     JSONResponse
-        A JSON object containing the KS and JS statistical tests.
+        A JSON object containing the KS and JS statistical tests,
+        or the statistics requested in the body.
     '''
+    arguments = await read_adherence_arguments(request, model_version)
 
     try:
-        body = await request.json()
+        adherence = await COMPUTE_EXECUTOR.run(evaluate_adherence, *arguments)
+    except Exception as exception:
+        raise adherence_error(exception) from exception
 
-        validate_adherence_body(body)
-    except ValueError as exception:
-        raise InvalidRequestError(
-            'Invalid request body. Must be a valid JSON object.') from exception
-    except exceptions.ValidationError as exception:
-        raise InvalidRequestError(
-            f'Body schema is invalid: {exception.message}.') from exception
+    return JSONResponse(
+        content=adherence,
+        status_code=HTTPStatus.OK
+    )
+
+
+@router.post('/batch')
+async def read_adherence_batch(request: Request, model_version: Optional[str] = None):
+    '''
+    Endpoint to read the adherence statistics of several datasets, given as a list
+    of paths or as a glob pattern. The datasets are scored in parallel in the compute
+    executor and the result of each one is streamed as a line of newline-delimited
+    JSON as soon as it is calculated.
+
+    Parameters
+    ----------
+    model_version : str, optional
+        The version of the model used to score the datasets.
+        Defaults to the default model version.
+
+    Raises
+    ----------
+    InvalidRequestError
+        If the request body is not a valid JSON object, lists too many paths or has a
+        glob pattern that matches too many files, or the model version is unknown.
+    InvalidPathError
+        If the glob pattern doesn't match any file.
+    RequestTimeoutError
+        If the glob pattern takes longer than the executor timeout to expand.
+
+    Returns
+    ----------
+    StreamingResponse
+        One JSON object per dataset, in completion order, with its `path` and either
+        its `result` or the `status` and `error` message the /aderencia endpoint
+        would have returned for it.
+    '''
+    body = await read_adherence_body(request, model_version, validate_adherence_batch_body)
+
+    if 'paths' in body:
+        paths = body['paths']
+    else:
+        try:
+            paths = await COMPUTE_EXECUTOR.run(expand_glob, body['glob'])
+        except InvalidRequestError:
+            raise
+        except Exception as exception:
+            raise adherence_error(exception) from exception
+
+    if not paths:
+        raise InvalidPathError('No such file or directory in the provide path.')
+
+    return StreamingResponse(
+        stream_adherence_batch(paths, model_version, *adherence_options(body)),
+        media_type='application/x-ndjson'
+    )
+
+
+async def stream_adherence_batch(paths: Sequence[str], model_version: Optional[str],
+                                 *options) -> AsyncIterator[bytes]:
+    '''
+    Calculates the adherence statistics of every path concurrently and yields each
+    result as an NDJSON line as soon as it is calculated. The calculations left are
+    cancelled when the client disconnects.
+
+    Parameters
+    ----------
+    paths : Sequence[str]
+        The paths to the data files.
+    model_version : str, optional
+        The version of the model used to score the datasets.
+    *options
+        The statistics, chunk size, cache flag and confidence intervals flag of the request.
+
+    Returns
+    ----------
+    AsyncIterator[bytes]
+        The NDJSON line of each path.
+    '''
+    tasks = [
+        asyncio.ensure_future(evaluate_batch_path(path, model_version, *options))
+        for path in paths
+    ]
+
+    try:
+        for task in asyncio.as_completed(tasks):
+            yield orjson.dumps(await task) + b'\n'
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def evaluate_batch_path(path: str, model_version: Optional[str],
+                              *options) -> Dict[str, object]:
+    '''
+    Calculates the adherence statistics of one path of a batch, reporting its
+    error instead of raising it.
+
+    Parameters
+    ----------
+    path : str
+        The path to the data file.
+    model_version : str, optional
+        The version of the model used to score the dataset.
+    *options
+        The statistics, chunk size, cache flag and confidence intervals flag of the request.
+
+    Returns
+    ----------
+    Dict[str, object]
+        The path with its result, or with the status code and message of its error.
+    '''
+    try:
+        result = await COMPUTE_EXECUTOR.run(evaluate_adherence, path, model_version, *options)
+    except Exception as exception:  # pylint: disable=broad-except
+        error = adherence_error(exception)
+        return {'path': path, 'status': ADHERENCE_ERROR_STATUS[type(error)], 'error': error.message}
+
+    return {'path': path, 'result': result}
+
+
+@router.post('/features')
+async def read_feature_drift(request: Request, model_version: Optional[str] = None):
+    '''
+    Endpoint to read the drift of every input of the model for the dataset located in
+    the path passed in the request body and the test dataset: the Population Stability
+    Index (PSI) and Jensen-Shannon (JS) distance of every input and the Kolmogorov-Smirnov
+    (KS) test of the numeric ones.
+
+    Parameters
+    ----------
+    model_version : str, optional
+        The version of the model whose inputs are compared.
+        Defaults to the default model version.
+
+    Raises
+    ----------
+    InvalidRequestError
+        If the request body is not a valid JSON object or the model version is unknown.
+    InvalidPathError
+        If the provided path does not exist.
+    RequestTimeoutError
+        If the calculation takes longer than the executor timeout.
+    InternalServerError
+        If an unexpected error occurs during the execution, such as an input of the
+        model missing from the file.
+
+    Returns
+    ----------
+    JSONResponse
+        A JSON object with the drift statistics of each input under the `features` key.
+    '''
+    body = await read_adherence_body(request, model_version, validate_feature_drift_body)
 
     try:
-        ks_statistic, p_value = calculate_ks(body['path'])
-        js_distance = calculate_js(body['path'])
-    except FileNotFoundError as exception:
-        raise InvalidPathError(
-            'No such file or directory in the provide path.') from exception
+        drift = await COMPUTE_EXECUTOR.run(
+            evaluate_feature_drift, body['path'], model_version,
+            body.get('chunk_size', ADHERENCE_CHUNK_SIZE), body.get('cache', True))
     except Exception as exception:
-        raise InternalServerError(str(exception)) from exception
+        raise adherence_error(exception) from exception
+
+    return JSONResponse(
+        content=drift,
+        status_code=HTTPStatus.OK
+    )
+
+
+@router.get('/cache')
+async def read_adherence_cache():
+    '''
+    Endpoint to read the hit and miss counts of the adherence result cache.
+
+    Returns
+    ----------
+    JSONResponse
+        The hits, disk hits, misses, entries and maximum entries of the cache.
+    '''
+    return JSONResponse(
+        content=ADHERENCE_CACHE.statistics()._asdict(),
+        status_code=HTTPStatus.OK
+    )
+
+
+@router.post('/jobs')
+async def submit_adherence_job(request: Request, model_version: Optional[str] = None):
+    '''
+    Endpoint to submit the calculation of the adherence statistics as an asynchronous job.
+    It takes the same body and query parameters as the /aderencia endpoint.
+
+    Parameters
+    ----------
+    model_version : str, optional
+        The version of the model used to score the datasets.
+        Defaults to the default model version.
+
+    Raises
+    ----------
+    InvalidRequestError
+        If the request body is not a valid JSON object or the model version is unknown.
+
+    Returns
+    ----------
+    JSONResponse
+        The status of the queued job, with its URL in the Location header.
+    '''
+    arguments = await read_adherence_arguments(request, model_version)
+    job = JOB_QUEUE.submit(evaluate_adherence, *arguments)
+
+    return JSONResponse(
+        content=job.describe(JOB_QUEUE.result_ttl),
+        status_code=HTTPStatus.ACCEPTED,
+        headers={'Location': f'{request.url.path}/{job.job_id}'}
+    )
+
+
+@router.get('/jobs/{job_id}')
+async def read_adherence_job(job_id: str):
+    '''
+    Endpoint to read the status of an adherence job.
+
+    Parameters
+    ----------
+    job_id : str
+        The id of the job.
+
+    Raises
+    ----------
+    InvalidPathError
+        If the job doesn't exist or has expired.
+
+    Returns
+    ----------
+    JSONResponse
+        The status of the job, with the error message when it failed.
+    '''
+    job = get_adherence_job(job_id)
+    status = job.describe(JOB_QUEUE.result_ttl)
+
+    if job.status == JOB_FAILED:
+        status['error'] = adherence_error(job.error).message
+
+    return JSONResponse(
+        content=status,
+        status_code=HTTPStatus.OK
+    )
+
+
+@router.get('/jobs/{job_id}/result')
+async def read_adherence_job_result(job_id: str):
+    '''
+    Endpoint to read the result of an adherence job.
+
+    Parameters
+    ----------
+    job_id : str
+        The id of the job.
+
+    Raises
+    ----------
+    InvalidPathError
+        If the job doesn't exist or has expired, or if the provided path of the job
+        does not exist.
+    RequestTimeoutError
+        If the job took longer than the job timeout.
+    InternalServerError
+        If an unexpected error occurred during the execution of the job.
+
+    Returns
+    ----------
+    JSONResponse
+        The adherence statistics once the job succeeded, or the status of the job
+        with a 202 status code while it is queued or running.
+    '''
+    job = get_adherence_job(job_id)
+
+    if job.status == JOB_FAILED:
+        raise adherence_error(job.error) from job.error
+
+    if job.status != JOB_SUCCEEDED:
+        return JSONResponse(
+            content=job.describe(JOB_QUEUE.result_ttl),
+            status_code=HTTPStatus.ACCEPTED
+        )
 
     return JSONResponse(
-        content={
-            'ks_test': {
-                'ks_statistic': ks_statistic,
-                'p_value': p_value
-            },
-            'js_divergence': js_distance
-        },
+        content=job.result,
         status_code=HTTPStatus.OK
     )
+
+
+def get_adherence_job(job_id: str) -> Job:
+    '''
+    Returns an adherence job by its id.
+
+    Parameters
+    ----------
+    job_id : str
+        The id of the job.
+
+    Raises
+    ----------
+    InvalidPathError
+        If the job doesn't exist or has expired.
+
+    Returns
+    ----------
+    Job
+        The job.
+    '''
+    job = JOB_QUEUE.get(job_id)
+
+    if job is None:
+        raise InvalidPathError(f'No such job: {job_id}. It may have expired.')
+
+    return job
@@ -0,0 +1,409 @@
+'''
+Module that computes the adherence statistics of a dataset against the test dataset.
+
+The input file is parsed and scored once and its scores are folded into a
+`ScoreSummary`, which is handed to every requested statistic together with the
+reference profile of the model. Statistics are registered in `ADHERENCE_STATISTICS`
+under the key they take in the response, so a new statistic only needs a function
+with the `AdherenceStatistic` signature and an entry.
+
+Files larger than memory can be read in chunks of rows. Each chunk is scored and
+merged into the summary, so the memory used doesn't grow with the file size:
+
+- The JS divergence and the PSI only need the fixed-bin score histogram, which is
+    merged exactly.
+- The KS test needs the distribution of the scores. The summary keeps the exact count
+    of each distinct score, and the chunked result is the same as the in-memory one,
+    as long as there are at most `max_distinct` distinct scores (tree-based models
+    only have a handful). Beyond that, the scores are collapsed onto a grid of
+    SKETCH_GRID_BINS equal-width cells over [0, 1], and the KS statistic may differ from
+    the in-memory one by at most the largest share of either sample in one grid cell.
+
+With `confidence_intervals`, the KS statistic, the JS distance and the PSI are
+returned with bootstrap confidence intervals calculated from the same summary, which
+resample the input records against the fixed reference profile (see
+`api.endpoints.bootstrap`).
+
+Classes:
+----------
+- DistinctCounts:
+    Mergeable counts of records by distinct value, collapsed onto a grid when too many.
+
+- ScoreSummary:
+    Mergeable summary of predicted scores.
+
+Functions:
+----------
+- ks_test(summary: ScoreSummary, reference: ReferenceProfile) -> Dict[str, float]:
+    Kolmogorov-Smirnov (KS) test between the input and the reference scores.
+
+- js_divergence(summary: ScoreSummary, reference: ReferenceProfile) -> float:
+    Jensen-Shannon (JS) distance between the input and the reference score histograms.
+
+- population_stability_index(summary: ScoreSummary, reference: ReferenceProfile) -> float:
+    Population Stability Index (PSI) between the input and the reference score histograms.
+
+- statistic_intervals(summary: ScoreSummary, reference: ReferenceProfile,
+                      statistics: Sequence[str]) -> Dict[str, object]:
+    Bootstrap confidence intervals of the requested statistics.
+
+- calculate_adherence(path: str, model: object, reference: ReferenceProfile,
+                      statistics: Sequence[str], chunk_size: int,
+                      confidence_intervals: bool) -> Dict[str, object]:
+    Scores the dataset in the path once and calculates the requested statistics.
+'''
+
+from typing import Callable, Dict, Optional, Sequence
+
+import numpy as np
+
+from api.settings import (
+    ADHERENCE_MAX_DISTINCT_SCORES, BOOTSTRAP_RESAMPLES, BOOTSTRAP_CONFIDENCE)
+from api.endpoints.bootstrap import ks_interval, js_interval, psi_interval
+from api.endpoints.reference import ReferenceProfile
+from api.endpoints.metrics import count_records, stage
+from api.endpoints.utils import (
+    score_data, score_data_chunks, ks_2samp_counts, HISTOGRAM_BINS)
+
+
+# Floor applied to the bin proportions so empty bins don't make the PSI infinite.
+PSI_EPSILON = 1e-6
+
+# Number of grid cells the KS summary collapses to when there are too many distinct scores.
+SKETCH_GRID_BINS = 2 ** 16
+
+
+class DistinctCounts:
+    '''
+    Mergeable counts of records by distinct value, with one column of counts per kind
+    of record (such as positive and negative records). When there are more than
+    `max_distinct` distinct values, they are collapsed onto a grid of SKETCH_GRID_BINS
+    equal-width cells over [0, 1]: each value moves to the right edge of its cell.
+
+    Parameters
+    ----------
+    columns : int
+        The number of columns of counts.
+    max_distinct : int, optional
+        The number of distinct values above which they are collapsed onto the grid.
+        None keeps every distinct value.
+
+    Attributes:
+        values (np.ndarray): The distinct values in ascending order.
+        value_counts (np.ndarray): The counts of each distinct value, one row per value.
+        exact (bool): Whether the values are exact rather than collapsed onto the grid.
+    '''
+
+    def __init__(self, columns: int, max_distinct: Optional[int] = None):
+        self.max_distinct = max_distinct
+        self.values = np.empty(0, dtype=np.float64)
+        self.value_counts = np.zeros((0, columns), dtype=np.int64)
+        self.exact = True
+
+    def merge(self, other: 'DistinctCounts'):
+        '''
+        Folds the counts of another summary into this one.
+
+        Parameters
+        ----------
+        other : DistinctCounts
+            The summary to merge, with the same columns.
+        '''
+        values = other.values
+        if self.exact and not other.exact:
+            self._collapse()
+        elif other.exact and not self.exact:
+            values = self._to_grid(values)
+
+        self._merge_values(values, other.value_counts)
+
+    def _add_values(self, values: np.ndarray, value_counts: np.ndarray):
+        '''Adds values with their counts, moving them to the grid if it is in use.'''
+        if not self.exact:
+            values = self._to_grid(values)
+
+        self._merge_values(values, value_counts)
+
+    def _merge_values(self, values: np.ndarray, value_counts: np.ndarray):
+        '''Adds values with their counts, collapsing them when too many.'''
+        all_values, inverse = np.unique(
+            np.concatenate([self.values, values]), return_inverse=True)
+        self.value_counts = self._sum_counts(
+            inverse, np.concatenate([self.value_counts, value_counts]), all_values.shape[0])
+        self.values = all_values
+
+        if self.exact and self.max_distinct is not None \
+                and self.values.shape[0] > self.max_distinct:
+            self._collapse()
+
+    def _collapse(self):
+        '''Moves every distinct value to the right edge of its grid cell.'''
+        self.exact = False
+        grid_values, inverse = np.unique(self._to_grid(self.values), return_inverse=True)
+        self.value_counts = self._sum_counts(inverse, self.value_counts, grid_values.shape[0])
+        self.values = grid_values
+
+    @staticmethod
+    def _sum_counts(inverse: np.ndarray, value_counts: np.ndarray, size: int) -> np.ndarray:
+        '''Sums the rows of counts that map to the same distinct value.'''
+        return np.stack([
+            np.bincount(inverse, weights=column, minlength=size) for column in value_counts.T
+        ], axis=1).astype(np.int64).reshape(size, value_counts.shape[1])
+
+    @staticmethod
+    def _to_grid(values: np.ndarray) -> np.ndarray:
+        '''Maps values to the right edge of their grid cell.'''
+        return np.clip(np.ceil(values * SKETCH_GRID_BINS), 0, SKETCH_GRID_BINS) / SKETCH_GRID_BINS
+
+
+class ScoreSummary(DistinctCounts):
+    '''
+    Mergeable summary of predicted scores: the counts of the fixed score histogram
+    and the count of each distinct score.
+
+    Parameters
+    ----------
+    max_distinct : int, optional
+        The number of distinct scores above which they are collapsed onto the grid.
+        None keeps every distinct score.
+    '''
+
+    def __init__(self, max_distinct: Optional[int] = None):
+        super().__init__(1, max_distinct)
+        self.histogram_counts = np.zeros(HISTOGRAM_BINS, dtype=np.int64)
+
+    @classmethod
+    def from_scores(cls, scores: np.ndarray, max_distinct: Optional[int] = None) -> 'ScoreSummary':
+        '''
+        Summarizes a score vector.
+
+        Parameters
+        ----------
+        scores : np.ndarray
+            The predicted scores.
+        max_distinct : int, optional
+            The number of distinct scores above which they are collapsed onto the grid.
+
+        Returns
+        ----------
+        ScoreSummary
+            The summary of the scores.
+        '''
+        summary = cls(max_distinct)
+        summary.update(scores)
+
+        return summary
+
+    @property
+    def counts(self) -> np.ndarray:
+        '''The number of scores equal to each distinct score.'''
+        return self.value_counts[:, 0]
+
+    @property
+    def size(self) -> int:
+        '''The number of summarized scores.'''
+        return int(self.counts.sum())
+
+    def update(self, scores: np.ndarray):
+        '''
+        Folds a score vector into the summary.
+
+        Parameters
+        ----------
+        scores : np.ndarray
+            The predicted scores.
+        '''
+        counts, _ = np.histogram(scores, bins=HISTOGRAM_BINS, range=(0, 1))
+        self.histogram_counts += counts
+
+        values, value_counts = np.unique(scores, return_counts=True)
+        self._add_values(values, value_counts[:, None])
+
+    def merge(self, other: 'ScoreSummary'):
+        '''
+        Folds another summary into this one.
+
+        Parameters
+        ----------
+        other : ScoreSummary
+            The summary to merge.
+        '''
+        self.histogram_counts += other.histogram_counts
+        super().merge(other)
+
+    def histogram(self) -> np.ndarray:
+        '''
+        Returns the density histogram of the scores, equal to `score_histogram`
+        over the summarized scores.
+
+        Returns
+        ----------
+        np.ndarray
+            The density of each bin.
+        '''
+        bin_widths = np.diff(np.linspace(0, 1, HISTOGRAM_BINS + 1))
+
+        return self.histogram_counts / bin_widths / self.histogram_counts.sum()
+
+
+AdherenceStatistic = Callable[[ScoreSummary, ReferenceProfile], object]
+
+
+def ks_test(summary: ScoreSummary, reference: ReferenceProfile) -> Dict[str, float]:
+    '''
+    Kolmogorov-Smirnov (KS) test between the input and the reference scores.
+
+    Parameters
+    ----------
+    summary : ScoreSummary
+        The summary of the predicted scores of the input data.
+    reference : ReferenceProfile
+        The reference profile of the model.
+
+    Returns
+    ----------
+    Dict[str, float]
+        The KS statistic and p-value.
+    '''
+    ks_statistic, p_value = ks_2samp_counts(
+        summary.values, summary.counts, reference.sorted_scores)
+
+    return {'ks_statistic': float(ks_statistic), 'p_value': float(p_value)}
+
+
+def js_divergence(summary: ScoreSummary, reference: ReferenceProfile) -> float:
+    '''
+    Jensen-Shannon (JS) distance between the input and the reference score histograms.
+
+    Parameters
+    ----------
+    summary : ScoreSummary
+        The summary of the predicted scores of the input data.
+    reference : ReferenceProfile
+        The reference profile of the model.
+
+    Returns
+    ----------
+    float
+        The JS distance.
+    '''
+    from scipy.spatial.distance import jensenshannon  # pylint: disable=import-outside-toplevel
+
+    return float(jensenshannon(summary.histogram(), reference.histogram))
+
+
+def population_stability_index(summary: ScoreSummary, reference: ReferenceProfile) -> float:
+    '''
+    Population Stability Index (PSI) between the input and the reference score
+    histograms, with the bin proportions floored at PSI_EPSILON.
+
+    Parameters
+    ----------
+    summary : ScoreSummary
+        The summary of the predicted scores of the input data.
+    reference : ReferenceProfile
+        The reference profile of the model.
+
+    Returns
+    ----------
+    float
+        The PSI value.
+    '''
+    actual = summary.histogram()
+    actual = np.maximum(actual / actual.sum(), PSI_EPSILON)
+    expected = np.maximum(reference.histogram / reference.histogram.sum(), PSI_EPSILON)
+
+    return float(np.sum((actual - expected) * np.log(actual / expected)))
+
+
+ADHERENCE_STATISTICS: Dict[str, AdherenceStatistic] = {
+    'ks_test': ks_test,
+    'js_divergence': js_divergence,
+    'psi': population_stability_index
+}
+
+DEFAULT_STATISTICS = ('ks_test', 'js_divergence')
+
+
+def statistic_intervals(summary: ScoreSummary, reference: ReferenceProfile,
+                        statistics: Sequence[str]) -> Dict[str, object]:
+    '''
+    Bootstrap confidence intervals of the requested statistics: the KS statistic of
+    the KS test, the JS distance and the PSI.
+
+    Parameters
+    ----------
+    summary : ScoreSummary
+        The summary of the predicted scores of the input data.
+    reference : ReferenceProfile
+        The reference profile of the model.
+    statistics : Sequence[str]
+        The keys in ADHERENCE_STATISTICS of the requested statistics.
+
+    Returns
+    ----------
+    Dict[str, object]
+        The confidence level, the number of resamples and the lower and upper bounds
+        of the interval of each statistic.
+    '''
+    intervals: Dict[str, object] = {
+        'confidence': BOOTSTRAP_CONFIDENCE, 'resamples': BOOTSTRAP_RESAMPLES}
+
+    if 'ks_test' in statistics:
+        intervals['ks_statistic'] = ks_interval(
+            summary.values, summary.counts, reference.sorted_scores)
+    if 'js_divergence' in statistics:
+        intervals['js_divergence'] = js_interval(summary.histogram_counts, reference.histogram)
+    if 'psi' in statistics:
+        intervals['psi'] = psi_interval(
+            summary.histogram_counts, reference.histogram, PSI_EPSILON)
+
+    return intervals
+
+
+def calculate_adherence(path: str, model: object, reference: ReferenceProfile,
+                        statistics: Sequence[str] = DEFAULT_STATISTICS,
+                        chunk_size: Optional[int] = None,
+                        confidence_intervals: bool = False) -> Dict[str, object]:
+    '''
+    Scores the dataset in the path once and calculates the requested statistics
+    against the reference profile, optionally with their confidence intervals.
+
+    Parameters
+    ----------
+    path : str
+        The path to the data file.
+    model : object
+        The pre-trained model.
+    reference : ReferenceProfile
+        The reference profile of the model.
+    statistics : Sequence[str]
+        The keys in ADHERENCE_STATISTICS of the statistics to calculate.
+    chunk_size : int, optional
+        The number of rows read and scored at a time. None reads the whole file at once.
+    confidence_intervals : bool
+        Whether to add the bootstrap confidence intervals of the statistics under the
+        `confidence_intervals` key.
+
+    Returns
+    ----------
+    Dict[str, object]
+        The value of each statistic by its key.
+    '''
+    if chunk_size:
+        summary = ScoreSummary(ADHERENCE_MAX_DISTINCT_SCORES)
+        for scores in score_data_chunks(path, model, chunk_size):
+            summary.update(scores)
+    else:
+        summary = ScoreSummary.from_scores(score_data(path, model))
+
+    count_records(summary.size)
+
+    with stage('statistics'):
+        result = {name: ADHERENCE_STATISTICS[name](summary, reference) for name in statistics}
+
+    if confidence_intervals:
+        with stage('bootstrap'):
+            result['confidence_intervals'] = statistic_intervals(summary, reference, statistics)
+
+    return result
@@ -0,0 +1,270 @@
+'''
+Module that computes the AUC-ROC incrementally from mergeable summaries.
+
+`roc_auc_score` needs every labelled score at once. The AUC-ROC only depends on how
+many positive and negative records got each score, so an `AucSummary` keeps those
+counts by distinct score: summaries of separate batches merge by adding their counts,
+and the AUC-ROC of the merged summary is the AUC-ROC of all the batches together.
+Folding a batch into a summary only costs work proportional to the batch and to the
+number of distinct scores.
+
+The AUC-ROC is calculated as the Mann-Whitney statistic with ties counted as half,
+which is the area `roc_auc_score` returns. It is exact as long as there are at most
+`max_distinct` distinct scores (tree-based models only have a handful). Beyond that,
+the scores are collapsed onto a grid of SKETCH_GRID_BINS equal-width cells over [0, 1]
+and the pairs of records within one cell count as ties. The counts are kept by the
+`DistinctCounts` base class, with one column of positives and one of negatives.
+
+The AUC-ROC of several groups of records, such as the periods of their reference
+dates, is calculated by `grouped_auc` with the same statistic over a single sort of the
+records by group and score, instead of one `roc_auc_score` call per group.
+
+Classes:
+----------
+- AucSummary:
+    Mergeable counts of positive and negative records by distinct score.
+
+Functions:
+----------
+- grouped_auc(scores: np.ndarray, labels: np.ndarray, groups: np.ndarray,
+              group_count: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    Calculates the AUC-ROC of every group of labelled scores at once.
+'''
+
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from api.settings import AUC_MAX_DISTINCT_SCORES
+from api.endpoints.adherence import DistinctCounts
+
+
+class AucSummary(DistinctCounts):
+    '''
+    Mergeable counts of positive and negative records by distinct score.
+
+    Parameters
+    ----------
+    max_distinct : int, optional
+        The number of distinct scores above which they are collapsed onto the grid.
+        None keeps every distinct score.
+    '''
+
+    def __init__(self, max_distinct: Optional[int] = AUC_MAX_DISTINCT_SCORES):
+        super().__init__(2, max_distinct)
+
+    @classmethod
+    def from_scores(cls, scores: np.ndarray, labels: np.ndarray,
+                    max_distinct: Optional[int] = AUC_MAX_DISTINCT_SCORES) -> 'AucSummary':
+        '''
+        Summarizes labelled scores.
+
+        Parameters
+        ----------
+        scores : np.ndarray
+            The predicted scores.
+        labels : np.ndarray
+            The labels of the records, 1 for positive and 0 for negative.
+        max_distinct : int, optional
+            The number of distinct scores above which they are collapsed onto the grid.
+
+        Raises
+        ----------
+        ValueError
+            If a label is neither 0 nor 1.
+
+        Returns
+        ----------
+        AucSummary
+            The summary of the scores.
+        '''
+        summary = cls(max_distinct)
+        summary.update(scores, labels)
+
+        return summary
+
+    @property
+    def positives(self) -> np.ndarray:
+        '''The number of positive records with each distinct score.'''
+        return self.value_counts[:, 0]
+
+    @property
+    def negatives(self) -> np.ndarray:
+        '''The number of negative records with each distinct score.'''
+        return self.value_counts[:, 1]
+
+    @property
+    def positive_count(self) -> int:
+        '''The number of positive records.'''
+        return int(self.positives.sum())
+
+    @property
+    def negative_count(self) -> int:
+        '''The number of negative records.'''
+        return int(self.negatives.sum())
+
+    def update(self, scores: np.ndarray, labels: np.ndarray):
+        '''
+        Folds labelled scores into the summary.
+
+        Parameters
+        ----------
+        scores : np.ndarray
+            The predicted scores.
+        labels : np.ndarray
+            The labels of the records, 1 for positive and 0 for negative.
+
+        Raises
+        ----------
+        ValueError
+            If a label is neither 0 nor 1.
+        '''
+        scores = np.asarray(scores, dtype=np.float64)
+        labels = np.asarray(labels)
+
+        positive = labels == 1
+        if not np.all(positive | (labels == 0)):
+            raise ValueError(f'The labels must be 0 or 1, got: {np.unique(labels).tolist()}.')
+
+        values, inverse = np.unique(scores, return_inverse=True)
+        positives = np.bincount(
+            inverse, weights=positive, minlength=values.shape[0]).astype(np.int64)
+        negatives = np.bincount(inverse, minlength=values.shape[0]) - positives
+
+        self._add_values(values, np.column_stack([positives, negatives]))
+
+    def auc(self) -> Optional[float]:
+        '''
+        Calculates the AUC-ROC of the summarized records.
+
+        Returns
+        ----------
+        float, optional
+            The AUC-ROC, or None until there are both positive and negative records.
+        '''
+        positive_count, negative_count = self.positive_count, self.negative_count
+        if positive_count == 0 or negative_count == 0:
+            return None
+
+        negatives_below = np.cumsum(self.negatives) - self.negatives
+        doubled_wins = int(np.sum(self.positives * (2 * negatives_below + self.negatives)))
+
+        return doubled_wins / (2 * positive_count * negative_count)
+
+    def to_dict(self) -> Dict[str, object]:
+        '''
+        Converts the summary to a JSON serializable dictionary.
+
+        Returns
+        ----------
+        Dict[str, object]
+            The distinct scores with their counts and whether they are exact.
+        '''
+        return {
+            'values': self.values.tolist(),
+            'positives': self.positives.tolist(),
+            'negatives': self.negatives.tolist(),
+            'exact': self.exact
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, List],
+                  max_distinct: Optional[int] = AUC_MAX_DISTINCT_SCORES) -> 'AucSummary':
+        '''
+        Restores a summary converted by `to_dict`.
+
+        Parameters
+        ----------
+        data : Dict[str, List]
+            The dictionary returned by `to_dict`.
+        max_distinct : int, optional
+            The number of distinct scores above which they are collapsed onto the grid.
+
+        Returns
+        ----------
+        AucSummary
+            The restored summary.
+        '''
+        summary = cls(max_distinct)
+        summary.values = np.asarray(data['values'], dtype=np.float64)
+        summary.value_counts = np.column_stack([
+            np.asarray(data['positives'], dtype=np.int64),
+            np.asarray(data['negatives'], dtype=np.int64)
+        ]).reshape(-1, 2)
+        summary.exact = bool(data['exact'])
+
+        return summary
+
+
+def grouped_auc(scores: np.ndarray, labels: np.ndarray, groups: np.ndarray,
+                group_count: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    '''
+    Calculates the AUC-ROC of every group of labelled scores at once. The records are
+    sorted by group and score, and the Mann-Whitney statistic of each group is summed
+    over the runs of records with the same group and score.
+
+    Parameters
+    ----------
+    scores : np.ndarray
+        The predicted scores.
+    labels : np.ndarray
+        The labels of the records, 1 for positive and 0 for negative.
+    groups : np.ndarray
+        The group of each record, between 0 and `group_count` - 1, or -1 for records
+        left out of every group.
+    group_count : int
+        The number of groups.
+
+    Raises
+    ----------
+    ValueError
+        If a label is neither 0 nor 1.
+
+    Returns
+    ----------
+    A tuple with three elements:
+        - auc: the AUC-ROC of each group, NaN when it doesn't have both positive and
+            negative records.
+        - positives: the number of positive records of each group.
+        - negatives: the number of negative records of each group.
+    '''
+    labels = np.asarray(labels)
+    positive = labels == 1
+    if not np.all(positive | (labels == 0)):
+        raise ValueError(f'The labels must be 0 or 1, got: {np.unique(labels).tolist()}.')
+
+    grouped = np.asarray(groups) >= 0
+    scores = np.asarray(scores, dtype=np.float64)[grouped]
+    positive = positive[grouped]
+    groups = np.asarray(groups, dtype=np.int64)[grouped]
+
+    positives = np.bincount(groups, weights=positive, minlength=group_count).astype(np.int64)
+    negatives = np.bincount(groups, minlength=group_count) - positives
+    doubled_wins = np.zeros(group_count, dtype=np.int64)
+
+    if groups.shape[0]:
+        order = np.lexsort((scores, groups))
+        groups, scores, positive = groups[order], scores[order], positive[order]
+
+        run_starts = np.flatnonzero(np.concatenate(
+            [[True], (groups[1:] != groups[:-1]) | (scores[1:] != scores[:-1])]))
+        run_groups = groups[run_starts]
+        run_positives = np.add.reduceat(positive.astype(np.int64), run_starts)
+        run_negatives = np.diff(np.append(run_starts, groups.shape[0])) - run_positives
+
+        # Negatives with a lower score in the same group: all the negatives before the
+        # run, minus the ones before the first run of its group.
+        negatives_before = np.cumsum(run_negatives) - run_negatives
+        group_starts = np.flatnonzero(np.concatenate(
+            [[True], run_groups[1:] != run_groups[:-1]]))
+        negatives_below = negatives_before - np.repeat(
+            negatives_before[group_starts], np.diff(np.append(group_starts, run_groups.shape[0])))
+
+        doubled_wins[run_groups[group_starts]] = np.add.reduceat(
+            run_positives * (2 * negatives_below + run_negatives), group_starts)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        auc = np.where((positives > 0) & (negatives > 0),
+                       doubled_wins / (2 * positives * negatives), np.nan)
+
+    return auc, positives, negatives
@@ -0,0 +1,358 @@
+'''
+Module that computes bootstrap confidence intervals of the monitoring statistics.
+
+A bootstrap resample draws n records with replacement from the n records of a sample.
+The statistics of this API only depend on how many records fall in each cell of a
+summary (the distinct scores of `AucSummary` and `ScoreSummary`, or the bins of the
+score histogram), so a resample is fully described by its counts by cell, which follow
+a multinomial distribution with the cell shares as probabilities. The resamples are
+drawn as a matrix of counts with one row per resample, either:
+
+- by a multinomial draw per row, when there are few cells for the number of records
+    (the usual case with tree-based models, whose scores only take a handful of values);
+- or from a matrix of resampled record indices, whose cells are counted by a single
+    `np.bincount` over the indices offset by the row, when there are many cells.
+
+Each statistic is then calculated for every row at once by array operations: the
+rank-based (Mann-Whitney) AUC-ROC, the KS statistic against the fixed reference scores,
+the JS distance and the PSI against the fixed reference histogram. The interval is the
+percentile interval of the resampled statistics at BOOTSTRAP_CONFIDENCE.
+
+The resamples are drawn in blocks of about BOOTSTRAP_BLOCK_ELEMENTS counts or indices,
+so the memory used doesn't grow with the number of resamples. Each block has its own
+random generator spawned from BOOTSTRAP_SEED, so the intervals are reproducible and
+don't depend on BOOTSTRAP_WORKERS, the number of threads the blocks are computed by.
+
+Functions:
+----------
+- resample_counts(counts: np.ndarray, size: int, rng: np.random.Generator) -> np.ndarray:
+    Draws the counts by cell of bootstrap resamples of the records.
+
+- bootstrap_replicates(counts: np.ndarray, statistic: Callable[[np.ndarray], np.ndarray],
+                       resamples: int, workers: int, seed: int) -> np.ndarray:
+    Calculates a statistic on bootstrap resamples of the records.
+
+- percentile_interval(replicates: np.ndarray, confidence: float) -> Dict[str, Optional[float]]:
+    Returns the percentile confidence interval of resampled statistics.
+
+- auc_interval(positives: np.ndarray, negatives: np.ndarray) -> Dict[str, Optional[float]]:
+    Bootstrap confidence interval of the AUC-ROC.
+
+- ks_interval(values: np.ndarray, counts: np.ndarray,
+              sorted_reference: np.ndarray) -> Dict[str, Optional[float]]:
+    Bootstrap confidence interval of the KS statistic against the reference scores.
+
+- js_interval(histogram_counts: np.ndarray,
+              reference_histogram: np.ndarray) -> Dict[str, Optional[float]]:
+    Bootstrap confidence interval of the JS distance against the reference histogram.
+
+- psi_interval(histogram_counts: np.ndarray, reference_histogram: np.ndarray,
+               epsilon: float) -> Dict[str, Optional[float]]:
+    Bootstrap confidence interval of the PSI against the reference histogram.
+'''
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Callable, Dict, Optional
+
+import numpy as np
+
+from api.settings import BOOTSTRAP_RESAMPLES, BOOTSTRAP_CONFIDENCE, BOOTSTRAP_WORKERS
+
+
+# Seed of the random generators of the resamples.
+BOOTSTRAP_SEED = 0
+
+# Number of resampled counts or record indices drawn at a time.
+BOOTSTRAP_BLOCK_ELEMENTS = 2 ** 20
+
+# Measured cost of a multinomial draw per cell, in resampled record indices.
+MULTINOMIAL_CELL_COST = 5
+
+_POOL: Optional[ThreadPoolExecutor] = None
+_POOL_LOCK = threading.Lock()
+
+
+def resample_counts(counts: np.ndarray, size: int, rng: np.random.Generator) -> np.ndarray:
+    '''
+    Draws the counts by cell of bootstrap resamples of the records.
+
+    Parameters
+    ----------
+    counts : np.ndarray
+        The number of records in each cell.
+    size : int
+        The number of resamples.
+    rng : np.random.Generator
+        The random generator.
+
+    Returns
+    ----------
+    np.ndarray
+        The counts by cell of each resample, with one row per resample.
+    '''
+    cell_count = counts.shape[0]
+    record_count = int(counts.sum())
+
+    if cell_count * MULTINOMIAL_CELL_COST <= record_count:
+        return rng.multinomial(record_count, counts / record_count, size=size)
+
+    record_cells = np.repeat(np.arange(cell_count), counts)
+    indices = rng.integers(0, record_count, size=(size, record_count))
+    cells = record_cells[indices] + (np.arange(size) * cell_count)[:, None]
+
+    return np.bincount(cells.ravel(), minlength=size * cell_count).reshape(size, cell_count)
+
+
+def _get_pool(workers: int) -> ThreadPoolExecutor:
+    '''Returns the thread pool of the resample blocks, created on first use.'''
+    global _POOL  # pylint: disable=global-statement
+    with _POOL_LOCK:
+        if _POOL is None:
+            _POOL = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='bootstrap')
+
+    return _POOL
+
+
+def bootstrap_replicates(counts: np.ndarray, statistic: Callable[[np.ndarray], np.ndarray],
+                         resamples: int = BOOTSTRAP_RESAMPLES, workers: int = BOOTSTRAP_WORKERS,
+                         seed: int = BOOTSTRAP_SEED) -> np.ndarray:
+    '''
+    Calculates a statistic on bootstrap resamples of the records, drawn and
+    calculated in blocks of resamples.
+
+    Parameters
+    ----------
+    counts : np.ndarray
+        The number of records in each cell.
+    statistic : Callable[[np.ndarray], np.ndarray]
+        Calculates the statistic of each row of a matrix of counts by cell.
+    resamples : int
+        The number of resamples.
+    workers : int
+        The number of threads the blocks are computed by. 1 computes them in the
+        calling thread.
+    seed : int
+        The seed of the random generators.
+
+    Returns
+    ----------
+    np.ndarray
+        The statistic of each resample, NaN for all of them when there are no records.
+    '''
+    counts = np.asarray(counts, dtype=np.int64)
+    cell_count, record_count = counts.shape[0], int(counts.sum())
+    if record_count == 0:
+        return np.full(resamples, np.nan)
+
+    # The elements drawn by each resample: counts by cell or record indices.
+    elements = cell_count if cell_count * MULTINOMIAL_CELL_COST <= record_count else record_count
+    block_size = max(1, min(resamples, BOOTSTRAP_BLOCK_ELEMENTS // elements))
+    sizes = [min(block_size, resamples - start) for start in range(0, resamples, block_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+
+    def calculate_block(block_seed: np.random.SeedSequence, size: int) -> np.ndarray:
+        return statistic(resample_counts(counts, size, np.random.default_rng(block_seed)))
+
+    if workers > 1 and len(sizes) > 1:
+        blocks = list(_get_pool(workers).map(calculate_block, seeds, sizes))
+    else:
+        blocks = [calculate_block(block_seed, size) for block_seed, size in zip(seeds, sizes)]
+
+    return np.concatenate(blocks)
+
+
+def percentile_interval(replicates: np.ndarray,
+                        confidence: float = BOOTSTRAP_CONFIDENCE) -> Dict[str, Optional[float]]:
+    '''
+    Returns the percentile confidence interval of resampled statistics. The resamples
+    where the statistic is undefined (NaN) are left out.
+
+    Parameters
+    ----------
+    replicates : np.ndarray
+        The statistic of each resample.
+    confidence : float
+        The confidence level of the interval.
+
+    Returns
+    ----------
+    Dict[str, Optional[float]]
+        The lower and upper bounds of the interval, None when the statistic is
+        undefined in every resample.
+    '''
+    replicates = replicates[~np.isnan(replicates)]
+    if not replicates.shape[0]:
+        return {'lower': None, 'upper': None}
+
+    lower, upper = np.quantile(replicates, [(1 - confidence) / 2, (1 + confidence) / 2])
+
+    return {'lower': float(lower), 'upper': float(upper)}
+
+
+def _auc_statistic(resampled: np.ndarray) -> np.ndarray:
+    '''The AUC-ROC of each row of positives followed by negatives by ascending score.'''
+    positives, negatives = np.split(resampled, 2, axis=1)
+    negatives_below = np.cumsum(negatives, axis=1) - negatives
+    doubled_wins = np.sum(positives * (2 * negatives_below + negatives), axis=1)
+    positive_count, negative_count = positives.sum(axis=1), negatives.sum(axis=1)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where((positive_count > 0) & (negative_count > 0),
+                        doubled_wins / (2.0 * positive_count * negative_count), np.nan)
+
+
+def _ks_statistic(cdf_reference: np.ndarray, cdf_reference_before: np.ndarray,
+                  resampled: np.ndarray) -> np.ndarray:
+    '''The KS statistic of each row of counts by ascending distinct score.'''
+    cumulative = np.cumsum(resampled, axis=1) / resampled.sum(axis=1, keepdims=True)
+    cumulative_before = cumulative - resampled / resampled.sum(axis=1, keepdims=True)
+
+    # Between two distinct scores the input CDF is flat and the reference CDF grows,
+    # so the largest gap is at a distinct score or just below it.
+    return np.maximum(np.abs(cumulative - cdf_reference),
+                      np.abs(cumulative_before - cdf_reference_before)).max(axis=1)
+
+
+def _js_statistic(reference_shares: np.ndarray, resampled: np.ndarray) -> np.ndarray:
+    '''The JS distance of each row of histogram counts, as `jensenshannon` computes it.'''
+    from scipy.special import rel_entr  # pylint: disable=import-outside-toplevel
+
+    shares = resampled / resampled.sum(axis=1, keepdims=True)
+    middle = (shares + reference_shares) / 2
+    divergence = (rel_entr(shares, middle).sum(axis=1)
+                  + rel_entr(reference_shares, middle).sum(axis=1))
+
+    return np.sqrt(divergence / 2)
+
+
+def _psi_statistic(reference_shares: np.ndarray, epsilon: float,
+                   resampled: np.ndarray) -> np.ndarray:
+    '''The PSI of each row of histogram counts, with the shares floored at epsilon.'''
+    shares = np.maximum(resampled / resampled.sum(axis=1, keepdims=True), epsilon)
+    expected = np.maximum(reference_shares, epsilon)
+
+    return np.sum((shares - expected) * np.log(shares / expected), axis=1)
+
+
+def auc_interval(positives: np.ndarray, negatives: np.ndarray,
+                 resamples: int = BOOTSTRAP_RESAMPLES,
+                 confidence: float = BOOTSTRAP_CONFIDENCE) -> Dict[str, Optional[float]]:
+    '''
+    Bootstrap confidence interval of the AUC-ROC, resampling the labelled records.
+
+    Parameters
+    ----------
+    positives : np.ndarray
+        The number of positive records with each distinct score, by ascending score.
+    negatives : np.ndarray
+        The number of negative records with each distinct score, by ascending score.
+    resamples : int
+        The number of resamples.
+    confidence : float
+        The confidence level of the interval.
+
+    Returns
+    ----------
+    Dict[str, Optional[float]]
+        The lower and upper bounds of the interval.
+    '''
+    replicates = bootstrap_replicates(np.concatenate([positives, negatives]), _auc_statistic,
+                                      resamples)
+
+    return percentile_interval(replicates, confidence)
+
+
+def ks_interval(values: np.ndarray, counts: np.ndarray, sorted_reference: np.ndarray,
+                resamples: int = BOOTSTRAP_RESAMPLES,
+                confidence: float = BOOTSTRAP_CONFIDENCE) -> Dict[str, Optional[float]]:
+    '''
+    Bootstrap confidence interval of the KS statistic between the input scores and
+    the reference scores, resampling the input records only.
+
+    Parameters
+    ----------
+    values : np.ndarray
+        The distinct predicted scores of the input data in ascending order.
+    counts : np.ndarray
+        The number of input records with each score.
+    sorted_reference : np.ndarray
+        The predicted scores of the reference data in ascending order.
+    resamples : int
+        The number of resamples.
+    confidence : float
+        The confidence level of the interval.
+
+    Returns
+    ----------
+    Dict[str, Optional[float]]
+        The lower and upper bounds of the interval.
+    '''
+    reference_count = sorted_reference.shape[0]
+    statistic = partial(
+        _ks_statistic,
+        np.searchsorted(sorted_reference, values, side='right') / reference_count,
+        np.searchsorted(sorted_reference, values, side='left') / reference_count)
+
+    return percentile_interval(bootstrap_replicates(counts, statistic, resamples), confidence)
+
+
+def js_interval(histogram_counts: np.ndarray, reference_histogram: np.ndarray,
+                resamples: int = BOOTSTRAP_RESAMPLES,
+                confidence: float = BOOTSTRAP_CONFIDENCE) -> Dict[str, Optional[float]]:
+    '''
+    Bootstrap confidence interval of the JS distance between the input and the
+    reference score histograms, resampling the input records only.
+
+    Parameters
+    ----------
+    histogram_counts : np.ndarray
+        The number of input records in each bin of the score histogram.
+    reference_histogram : np.ndarray
+        The density histogram of the reference scores, with the same bins.
+    resamples : int
+        The number of resamples.
+    confidence : float
+        The confidence level of the interval.
+
+    Returns
+    ----------
+    Dict[str, Optional[float]]
+        The lower and upper bounds of the interval.
+    '''
+    statistic = partial(_js_statistic, reference_histogram / reference_histogram.sum())
+
+    return percentile_interval(
+        bootstrap_replicates(histogram_counts, statistic, resamples), confidence)
+
+
+def psi_interval(histogram_counts: np.ndarray, reference_histogram: np.ndarray,
+                 epsilon: float, resamples: int = BOOTSTRAP_RESAMPLES,
+                 confidence: float = BOOTSTRAP_CONFIDENCE) -> Dict[str, Optional[float]]:
+    '''
+    Bootstrap confidence interval of the PSI between the input and the reference
+    score histograms, resampling the input records only.
+
+    Parameters
+    ----------
+    histogram_counts : np.ndarray
+        The number of input records in each bin of the score histogram.
+    reference_histogram : np.ndarray
+        The density histogram of the reference scores, with the same bins.
+    epsilon : float
+        The floor applied to the bin proportions.
+    resamples : int
+        The number of resamples.
+    confidence : float
+        The confidence level of the interval.
+
+    Returns
+    ----------
+    Dict[str, Optional[float]]
+        The lower and upper bounds of the interval.
+    '''
+    statistic = partial(_psi_statistic, reference_histogram / reference_histogram.sum(), epsilon)
+
+    return percentile_interval(
+        bootstrap_replicates(histogram_counts, statistic, resamples), confidence)
@@ -0,0 +1,275 @@
+'''
+Module that caches the results of the /aderencia endpoint.
+
+An adherence result only depends on the model file, the input file and the request
+options, so it is cached under a key derived from the SHA-256 digest of the model
+file, the real path, size and modification time of the input file (and optionally
+the SHA-256 digest of its contents) and the requested statistics and chunk size.
+Any change to the model or to the input file gives a new key, so cached results
+never go stale; unused keys are evicted in least recently used order.
+
+The results are kept in memory and, when a cache directory is set, persisted as
+JSON files that survive restarts and are shared by the worker processes.
+
+Classes:
+----------
+- CacheStatistics:
+    The hit and miss counts of a result cache.
+
+- AdherenceResultCache:
+    Thread-safe LRU cache of adherence results with an optional on-disk store.
+
+Functions:
+----------
+- file_digest(path: str) -> str:
+    Computes the SHA-256 hex digest of a file's contents.
+
+Attributes:
+----------
+- ADHERENCE_CACHE: AdherenceResultCache
+    The adherence result cache shared by the whole application.
+'''
+
+import glob
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, NamedTuple, Optional, Sequence
+
+from api.settings import ADHERENCE_CACHE_SIZE, ADHERENCE_CACHE_DIR, ADHERENCE_CACHE_HASH
+from api.endpoints.registry import ModelEntry
+
+
+logger = logging.getLogger(__name__)
+
+# Size of the blocks a file is read in to compute its digest.
+DIGEST_BLOCK_SIZE = 1 << 20
+
+
+class CacheStatistics(NamedTuple):
+    '''
+    The hit and miss counts of a result cache.
+
+    Attributes:
+        hits (int): The lookups answered from memory or from the disk store.
+        disk_hits (int): The lookups answered from the disk store.
+        misses (int): The lookups that found no result.
+        entries (int): The number of results in memory.
+        max_entries (int): The maximum number of results in memory.
+    '''
+    hits: int
+    disk_hits: int
+    misses: int
+    entries: int
+    max_entries: int
+
+
+def file_digest(path: str) -> str:
+    '''
+    Computes the SHA-256 hex digest of a file's contents.
+
+    Parameters
+    ----------
+    path : str
+        The path to the file.
+
+    Returns
+    ----------
+    str
+        The hex digest.
+    '''
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(DIGEST_BLOCK_SIZE), b''):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+
+class AdherenceResultCache:
+    '''
+    Thread-safe LRU cache of adherence results with an optional on-disk store.
+
+    Parameters
+    ----------
+    max_entries : int
+        The maximum number of results kept in memory and on disk. 0 disables the cache.
+    cache_dir : str
+        The directory of the on-disk store. An empty string keeps the results in memory only.
+    hash_content : bool
+        Whether the key includes the digest of the input file contents, on top of its
+        path, size and modification time.
+    '''
+
+    def __init__(self, max_entries: int = ADHERENCE_CACHE_SIZE,
+                 cache_dir: str = ADHERENCE_CACHE_DIR, hash_content: bool = ADHERENCE_CACHE_HASH):
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self.hash_content = hash_content
+        self._results: 'OrderedDict[str, Dict[str, object]]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._disk_hits = 0
+        self._misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        '''Whether the cache keeps any result.'''
+        return self.max_entries > 0
+
+    def key(self, path: str, model_entry: ModelEntry, statistics: Sequence[str],
+            chunk_size: int) -> str:
+        '''
+        Computes the cache key of an adherence request.
+
+        Parameters
+        ----------
+        path : str
+            The path to the input file.
+        model_entry : ModelEntry
+            The model registry entry.
+        statistics : Sequence[str]
+            The requested statistics.
+        chunk_size : int
+            The requested chunk size.
+
+        Raises
+        ----------
+        FileNotFoundError
+            If the input file doesn't exist.
+
+        Returns
+        ----------
+        str
+            The SHA-256 hex digest of the request identity.
+        '''
+        real_path = os.path.realpath(path)
+        stat = os.stat(real_path)
+        identity = {
+            'model_digest': model_entry.digest,
+            'path': real_path,
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'content_digest': file_digest(real_path) if self.hash_content else None,
+            'statistics': list(statistics),
+            'chunk_size': chunk_size
+        }
+
+        return hashlib.sha256(json.dumps(identity, sort_keys=True).encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, object]]:
+        '''
+        Returns the cached result of a key, from memory or from the disk store.
+
+        Parameters
+        ----------
+        key : str
+            The cache key.
+
+        Returns
+        ----------
+        Dict[str, object], optional
+            The cached result, or None when there is none.
+        '''
+        with self._lock:
+            result = self._results.get(key)
+            if result is not None:
+                self._results.move_to_end(key)
+                self._hits += 1
+                return result
+
+        result = self._read(key)
+
+        with self._lock:
+            if result is None:
+                self._misses += 1
+                return None
+
+            self._hits += 1
+            self._disk_hits += 1
+            self._remember(key, result)
+
+        return result
+
+    def put(self, key: str, result: Dict[str, object]):
+        '''
+        Caches the result of a key, in memory and in the disk store.
+
+        Parameters
+        ----------
+        key : str
+            The cache key.
+        result : Dict[str, object]
+            The adherence result, which must be JSON serializable.
+        '''
+        if not self.enabled:
+            return
+
+        with self._lock:
+            self._remember(key, result)
+
+        self._write(key, result)
+
+    def statistics(self) -> CacheStatistics:
+        '''
+        Returns the hit and miss counts of the cache.
+
+        Returns
+        ----------
+        CacheStatistics
+            The counts since the cache was created.
+        '''
+        with self._lock:
+            return CacheStatistics(
+                self._hits, self._disk_hits, self._misses, len(self._results), self.max_entries)
+
+    def _remember(self, key: str, result: Dict[str, object]):
+        '''Keeps a result in memory, evicting the least recently used ones. Holds the lock.'''
+        self._results[key] = result
+        self._results.move_to_end(key)
+
+        while len(self._results) > self.max_entries:
+            self._results.popitem(last=False)
+
+    def _path(self, key: str) -> str:
+        '''Returns the path of a result in the disk store.'''
+        return os.path.join(self.cache_dir, f'{key}.json')
+
+    def _read(self, key: str) -> Optional[Dict[str, object]]:
+        '''Reads a result from the disk store, if any.'''
+        if not self.enabled or not self.cache_dir:
+            return None
+
+        try:
+            with open(self._path(key), 'r', encoding='utf-8') as file:
+                result = json.load(file)
+            os.utime(self._path(key))
+        except (OSError, ValueError):
+            return None
+
+        return result
+
+    def _write(self, key: str, result: Dict[str, object]):
+        '''Writes a result to the disk store, evicting the least recently used files.'''
+        if not self.cache_dir:
+            return
+
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            path = self._path(key)
+            temporary_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            with open(temporary_path, 'w', encoding='utf-8') as file:
+                json.dump(result, file)
+            os.replace(temporary_path, path)
+
+            paths = sorted(glob.glob(os.path.join(self.cache_dir, '*.json')), key=os.path.getmtime)
+            for stale_path in paths[:-self.max_entries]:
+                os.remove(stale_path)
+        except OSError as exception:
+            logger.warning('Could not persist the adherence result %s: %s', key, exception)
+
+
+ADHERENCE_CACHE = AdherenceResultCache()
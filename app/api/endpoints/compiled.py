@@ -0,0 +1,395 @@
+'''
+Module that compiles the pre-trained models into plain NumPy scorers.
+
+The `predict_proba` of a scikit-learn pipeline validates its input, converts the
+DataFrame column transformer by column transformer and builds the one-hot encoded
+matrix of every categorical input before the estimator sees it, which dominates the
+scoring of small and medium batches. `compile_scorer` exports a supported model into a
+`CompiledScorer`: the imputation and one-hot encoding of its inputs, over the fixed
+column order of the model, and a vectorized traversal of the decision tree that only
+computes the encoded features the tree splits on. The supported models are:
+
+- a Pipeline of a ColumnTransformer, whose transformers are SimpleImputer, OneHotEncoder,
+    'passthrough' or Pipelines of them, followed by a binary DecisionTreeClassifier;
+- a binary DecisionTreeClassifier fitted on a DataFrame.
+
+When the model is loaded, the compiled scorer must give the scores of `predict_proba`
+on the sample body `./datasets/batch_records.json`; when it doesn't, when the sample body
+can't be read or when the model is of another type, the model itself is used. Inputs the
+compiled scorer doesn't reproduce exactly (missing columns, unknown categories, infinite
+or missing values the model doesn't impute) are scored by the model, which raises the
+same errors as before.
+
+Classes:
+----------
+- UnsupportedModelError:
+    Raised when a model can't be compiled.
+
+- CompiledScorer:
+    NumPy scorer compiled from a pre-trained model.
+
+Functions:
+----------
+- compile_scorer(model: object, version: str) -> object:
+    Compiles a model into a NumPy scorer checked against `predict_proba`, or returns the
+    model itself.
+
+Attributes:
+----------
+- PARITY_RECORDS_PATH: str
+    The records a compiled scorer is checked against.
+'''
+
+import logging
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from api.settings import COMPILED_SCORER
+
+
+logger = logging.getLogger(__name__)
+
+PARITY_RECORDS_PATH = './datasets/batch_records.json'
+
+# Largest difference between a compiled score and the `predict_proba` score.
+PARITY_TOLERANCE = 1e-12
+
+
+class UnsupportedModelError(Exception):
+    '''
+    Raised when a model can't be compiled.
+    '''
+
+
+class ModelInput(NamedTuple):
+    '''
+    An input column of a compiled model and how it is encoded.
+
+    Attributes:
+        name (str): The column name.
+        fill_value (object): The value of the missing values, None when they aren't imputed.
+        categories (Dict[object, int], optional): The index of each one-hot encoded
+            category, None for a numeric input.
+        ignore_unknown (bool): Whether unknown categories are encoded as zeros.
+        outputs (List[Tuple[int, int]]): The column of each encoded feature the tree
+            splits on, with its category index (0 for a numeric input).
+    '''
+    name: str
+    fill_value: object
+    categories: Optional[Dict[object, int]]
+    ignore_unknown: bool
+    outputs: List[Tuple[int, int]]
+
+
+def _is_nan(value: object) -> bool:
+    '''Returns whether a value is a float NaN.'''
+    return isinstance(value, float) and np.isnan(value)
+
+
+def _compile_steps(steps: Sequence[object], columns: Sequence[str]) -> List[ModelInput]:
+    '''
+    Compiles the transformer steps applied to columns into model inputs.
+
+    Parameters
+    ----------
+    steps : Sequence[object]
+        The fitted transformers, in the order they are applied.
+    columns : Sequence[str]
+        The column names.
+
+    Raises
+    ----------
+    UnsupportedModelError
+        If a step is not supported.
+
+    Returns
+    ----------
+    List[ModelInput]
+        The inputs, without outputs.
+    '''
+    # pylint: disable=import-outside-toplevel
+    from sklearn.impute import SimpleImputer
+    from sklearn.pipeline import Pipeline
+    from sklearn.preprocessing import OneHotEncoder
+
+    fill_values: List[object] = [None] * len(columns)
+    categories: Optional[List[np.ndarray]] = None
+    ignore_unknown = False
+
+    flat_steps = list(steps)
+    while any(isinstance(step, Pipeline) for step in flat_steps):
+        flat_steps = [inner for step in flat_steps for inner in (
+            [inner_step for _, inner_step in step.steps] if isinstance(step, Pipeline) else [step])]
+
+    for step in flat_steps:
+        if step is None or step == 'passthrough':
+            continue
+
+        if isinstance(step, SimpleImputer):
+            if categories is not None or any(value is not None for value in fill_values):
+                raise UnsupportedModelError('SimpleImputer after another transformer.')
+            if step.add_indicator or not _is_nan(step.missing_values):
+                raise UnsupportedModelError('SimpleImputer with indicators or missing values '
+                                            'other than NaN.')
+            if any(_is_nan(value) for value in step.statistics_):
+                raise UnsupportedModelError('SimpleImputer dropping empty columns.')
+            fill_values = list(step.statistics_)
+        elif isinstance(step, OneHotEncoder):
+            if categories is not None or step.drop_idx_ is not None:
+                raise UnsupportedModelError('OneHotEncoder with dropped categories.')
+            if any(column_categories.dtype != object for column_categories in step.categories_):
+                raise UnsupportedModelError('OneHotEncoder of non-string categories.')
+            categories = list(step.categories_)
+            ignore_unknown = step.handle_unknown == 'ignore'
+        else:
+            raise UnsupportedModelError(f'Unsupported transformer {type(step).__name__}.')
+
+    return [
+        ModelInput(name, fill_value, None if categories is None else {
+            category: category_index for category_index, category in enumerate(categories[index])
+        }, ignore_unknown, [])
+        for index, (name, fill_value) in enumerate(zip(columns, fill_values))
+    ]
+
+
+def _compile_inputs(model: object) -> Tuple[List[ModelInput], object]:
+    '''
+    Compiles the preprocessing of a model into model inputs, in the order of the
+    features of its estimator.
+
+    Parameters
+    ----------
+    model : object
+        The pre-trained model.
+
+    Raises
+    ----------
+    UnsupportedModelError
+        If the model is not supported.
+
+    Returns
+    ----------
+    Tuple[List[ModelInput], object]
+        The inputs and the decision tree estimator.
+    '''
+    # pylint: disable=import-outside-toplevel
+    from sklearn.compose import ColumnTransformer
+    from sklearn.pipeline import Pipeline
+    from sklearn.tree import DecisionTreeClassifier
+
+    steps = [step for _, step in model.steps] if isinstance(model, Pipeline) else [model]
+    estimator = steps[-1]
+
+    if not isinstance(estimator, DecisionTreeClassifier) or estimator.n_outputs_ != 1 \
+            or estimator.n_classes_ != 2:
+        raise UnsupportedModelError(f'Unsupported estimator {type(estimator).__name__}.')
+
+    if len(steps) == 1:
+        if not hasattr(estimator, 'feature_names_in_'):
+            raise UnsupportedModelError('Estimator not fitted on a DataFrame.')
+        return _compile_steps([], list(estimator.feature_names_in_)), estimator
+
+    if len(steps) != 2 or not isinstance(steps[0], ColumnTransformer):
+        raise UnsupportedModelError('Pipeline other than a ColumnTransformer and an estimator.')
+
+    inputs = []
+    for _, transformer, columns in steps[0].transformers_:
+        if transformer == 'drop' or len(columns) == 0:
+            continue
+        if isinstance(columns, str) or not all(isinstance(column, str) for column in columns):
+            raise UnsupportedModelError('ColumnTransformer columns selected by position.')
+        inputs.extend(_compile_steps([transformer], columns))
+
+    return inputs, estimator
+
+
+class CompiledScorer:
+    '''
+    NumPy scorer compiled from a pre-trained model. Scores records like the
+    `predict_proba` of the model.
+
+    Parameters
+    ----------
+    model : object
+        The pre-trained model.
+
+    Raises
+    ----------
+    UnsupportedModelError
+        If the model is not supported.
+
+    Attributes:
+        model (object): The pre-trained model, which scores the inputs the compiled
+            scorer doesn't reproduce.
+    '''
+
+    def __init__(self, model: object):
+        self.model = model
+        inputs, estimator = _compile_inputs(model)
+        tree = estimator.tree_
+
+        # The encoded features, in the order of the estimator, and the used ones.
+        features = [(index, category) for index, model_input in enumerate(inputs)
+                    for category in range(1 if model_input.categories is None
+                                          else len(model_input.categories))]
+        if len(features) != estimator.n_features_in_:
+            raise UnsupportedModelError(
+                f'{len(features)} encoded features for an estimator of '
+                f'{estimator.n_features_in_}.')
+
+        is_leaf = tree.children_left < 0
+        used = sorted(set(tree.feature[~is_leaf].tolist()))
+        columns = {feature: column for column, feature in enumerate(used)}
+        for feature in used:
+            index, category = features[feature]
+            inputs[index].outputs.append((columns[feature], category))
+
+        if hasattr(model, 'feature_names_in_'):
+            self.feature_names_in_ = model.feature_names_in_
+        self.inputs = inputs
+        self.n_used = len(used)
+        self.depth = tree.max_depth
+        # Leaves loop on themselves, so every record can take `depth` steps.
+        nodes = np.arange(tree.node_count)
+        self.left = np.where(is_leaf, nodes, tree.children_left)
+        self.right = np.where(is_leaf, nodes, tree.children_right)
+        self.feature = np.where(is_leaf, 0, [columns.get(feature, 0) for feature in tree.feature])
+        self.threshold = np.where(is_leaf, np.inf, tree.threshold)
+        # The same arithmetic as DecisionTreeClassifier.predict_proba.
+        value = tree.value[:, 0, :estimator.n_classes_]
+        normalizer = value.sum(axis=1)[:, np.newaxis]
+        normalizer[normalizer == 0.0] = 1.0
+        self.proba = value / normalizer
+
+    def compiled_proba(self, data_frame: pd.DataFrame) -> Optional[np.ndarray]:
+        '''
+        Scores records with the compiled scorer only.
+
+        Parameters
+        ----------
+        data_frame : pd.DataFrame
+            The input records.
+
+        Returns
+        ----------
+        np.ndarray, optional
+            The probability of each class for each record, or None when the compiled
+            scorer doesn't reproduce the model on these records.
+        '''
+        size = len(data_frame)
+        matrix = np.empty((size, self.n_used), dtype=np.float32)
+
+        for model_input in self.inputs:
+            if model_input.name not in data_frame.columns:
+                return None
+            column = data_frame[model_input.name]
+
+            if model_input.categories is None:
+                if column.dtype.kind not in 'biuf':
+                    return None
+                values = column.to_numpy(dtype=np.float64)
+                if model_input.fill_value is not None:
+                    values = np.where(np.isnan(values), model_input.fill_value, values)
+                values = values.astype(np.float32)
+                if not np.isfinite(values).all():
+                    return None
+                for output, _ in model_input.outputs:
+                    matrix[:, output] = values
+                continue
+
+            values = column.array
+            if not isinstance(values, pd.Categorical):
+                objects = column.to_numpy()
+                # The imputers of the model take None for a category, not a missing value.
+                if column.dtype != object or np.equal(objects, None).any():
+                    return None
+                values = pd.Categorical(objects)
+
+            # The missing values have the code -1, so they take the last index.
+            indexer = np.array([model_input.categories.get(category, -1)
+                                for category in values.categories.tolist()]
+                               + [model_input.categories.get(model_input.fill_value, -1)],
+                               dtype=np.intp)
+            codes = indexer[values.codes]
+            if not model_input.ignore_unknown and (codes < 0).any():
+                return None
+            for output, category in model_input.outputs:
+                matrix[:, output] = codes == category
+
+        node = np.zeros(size, dtype=np.intp)
+        if self.n_used:
+            rows = np.arange(size)
+            for _ in range(self.depth):
+                go_left = matrix[rows, self.feature[node]] <= self.threshold[node]
+                node = np.where(go_left, self.left[node], self.right[node])
+
+        return self.proba[node]
+
+    def predict_proba(self, data_frame: pd.DataFrame) -> np.ndarray:
+        '''
+        Scores records, with the model when the compiled scorer doesn't reproduce it.
+
+        Parameters
+        ----------
+        data_frame : pd.DataFrame
+            The input records.
+
+        Returns
+        ----------
+        np.ndarray
+            The probability of each class for each record.
+        '''
+        proba = self.compiled_proba(data_frame)
+
+        return self.model.predict_proba(data_frame) if proba is None else proba
+
+
+def compile_scorer(model: object, version: str = '') -> object:
+    '''
+    Compiles a model into a NumPy scorer and checks it against the `predict_proba` of
+    the model on the records of PARITY_RECORDS_PATH. Returns the model itself when
+    COMPILED_SCORER is disabled, the model is not supported or the check fails.
+
+    Parameters
+    ----------
+    model : object
+        The pre-trained model.
+    version : str
+        The model version, for the logs.
+
+    Returns
+    ----------
+    object
+        The compiled scorer or the model, both with a `predict_proba` method.
+    '''
+    if not COMPILED_SCORER:
+        return model
+
+    try:
+        scorer = CompiledScorer(model)
+    except (UnsupportedModelError, AttributeError) as exception:
+        logger.info('Model version %s is scored by scikit-learn: %s', version, exception)
+        return model
+
+    # The utils module imports the model registry, which compiles the models.
+    from api.endpoints.utils import load_batch_records  # pylint: disable=import-outside-toplevel
+
+    try:
+        x_input = load_batch_records(PARITY_RECORDS_PATH).drop(['TARGET'], axis=1)
+        expected = model.predict_proba(x_input)
+        actual = scorer.compiled_proba(x_input)
+    except (OSError, ValueError) as exception:
+        logger.warning('Could not check the compiled scorer of model version %s, it is '
+                       'scored by scikit-learn: %s', version, exception)
+        return model
+
+    if actual is None or not np.allclose(actual, expected, rtol=0, atol=PARITY_TOLERANCE):
+        logger.warning('The compiled scorer of model version %s does not match predict_proba, '
+                       'it is scored by scikit-learn.', version)
+        return model
+
+    logger.info('Model version %s is scored by its compiled scorer.', version)
+
+    return scorer
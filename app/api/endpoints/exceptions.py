@@ -5,6 +5,8 @@ Exceptions:
         comply with the expected schema.
     - `InternalServerError`: Raised when an unexpected error occurs while processing a request.
     - `InvalidPathError`: Raised when a request path is invalid or not found.
+    - `RequestTimeoutError`: Raised when processing a request takes longer than allowed.
+    - `UnsupportedMediaTypeError`: Raised when the format of a request body is not supported.
 '''
 
 
@@ -45,3 +47,29 @@ class InvalidPathError(Exception):
     def __init__(self, message):
         self.message = message
         super().__init__(self.message)
+
+
+class RequestTimeoutError(Exception):
+    '''
+    Exception raised when processing a request takes longer than allowed.
+
+    Attributes:
+        message (str): The explanation of the error.
+    '''
+
+    def __init__(self, message):
+        self.message = message
+        super().__init__(self.message)
+
+
+class UnsupportedMediaTypeError(Exception):
+    '''
+    Exception raised when the format of a request body is not supported.
+
+    Attributes:
+        message (str): The explanation of the error.
+    '''
+
+    def __init__(self, message):
+        self.message = message
+        super().__init__(self.message)
@@ -0,0 +1,132 @@
+'''
+Module that runs the CPU-bound work of the endpoints outside the event loop.
+
+The pandas, scikit-learn and scipy computations of the endpoints would block the
+event loop, stalling every other request while they run. The compute executor runs
+them in a thread pool or a process pool instead, with a bounded number of concurrent
+computations and a per-computation timeout, and the endpoints await the result.
+
+With the process pool, the function and its arguments are pickled to the worker
+processes, so the function must be defined at module level and should receive model
+versions rather than model instances. Each worker keeps its own model registry.
+
+The stages the function measures (see `api.endpoints.metrics`) are returned with its
+result and merged into the metrics of the calling request, along with the time the
+call waited for a free slot.
+
+Classes:
+----------
+- ComputeExecutor:
+    Bounded asynchronous front end to a thread or process pool.
+
+Attributes:
+----------
+- COMPUTE_EXECUTOR: ComputeExecutor
+    The compute executor shared by the whole application.
+'''
+
+import asyncio
+import functools
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Optional, TypeVar
+
+from api.settings import EXECUTOR_KIND, EXECUTOR_MAX_WORKERS, EXECUTOR_TIMEOUT
+from api.endpoints.metrics import collect_metrics, merge_metrics, stage
+
+
+T = TypeVar('T')
+
+
+class ComputeExecutor:
+    '''
+    Bounded asynchronous front end to a thread or process pool.
+
+    At most `max_workers` computations run at the same time; further calls wait for
+    a free slot. A computation that doesn't finish within `timeout` seconds raises
+    `asyncio.TimeoutError`. Python threads can't be interrupted, so a timed out
+    computation still runs to completion in the background.
+
+    Parameters
+    ----------
+    kind : str
+        'thread' for a thread pool or 'process' for a process pool.
+    max_workers : int
+        The size of the pool and the maximum number of concurrent computations.
+    timeout : float
+        The default timeout in seconds. 0 disables the timeout.
+    '''
+
+    def __init__(self, kind: str = EXECUTOR_KIND, max_workers: int = EXECUTOR_MAX_WORKERS,
+                 timeout: float = EXECUTOR_TIMEOUT):
+        if kind not in ('thread', 'process'):
+            raise ValueError(f"Executor kind must be 'thread' or 'process', not {kind!r}.")
+
+        self.kind = kind
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self._pool: Optional[Executor] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    async def run(self, func: Callable[..., T], *args, timeout: Optional[float] = None) -> T:
+        '''
+        Runs a function in the pool and waits for its result.
+
+        Parameters
+        ----------
+        func : Callable
+            The function to run.
+        *args
+            The positional arguments of the function.
+        timeout : float, optional
+            The timeout in seconds for this call. Defaults to the executor timeout.
+
+        Raises
+        ----------
+        asyncio.TimeoutError
+            If the function doesn't finish within the timeout.
+
+        Returns
+        ----------
+        The return value of the function. Exceptions raised by the function are re-raised.
+        '''
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_workers)
+
+        timeout = self.timeout if timeout is None else timeout
+
+        with stage('executor_wait'):
+            await self._semaphore.acquire()
+
+        try:
+            future = asyncio.get_running_loop().run_in_executor(
+                self._get_pool(), functools.partial(collect_metrics, func, *args))
+
+            result, metrics = await asyncio.wait_for(future, timeout or None)
+        finally:
+            self._semaphore.release()
+
+        merge_metrics(metrics)
+
+        return result
+
+    def shutdown(self):
+        '''
+        Shuts the pool down, waiting for the running computations to finish.
+        '''
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+
+    def _get_pool(self) -> Executor:
+        '''Returns the pool, creating it on first use.'''
+        if self._pool is None:
+            if self.kind == 'process':
+                self._pool = ProcessPoolExecutor(max_workers=self.max_workers)
+            else:
+                self._pool = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix='compute')
+
+        return self._pool
+
+
+COMPUTE_EXECUTOR = ComputeExecutor()
@@ -0,0 +1,490 @@
+'''
+Module that computes the drift of every model input against the test dataset.
+
+The /aderencia statistics only compare the distribution of the model scores. The
+feature drift compares the distribution of each input of the model instead: the
+Population Stability Index (PSI) and the Jensen-Shannon (JS) distance for every input,
+and the Kolmogorov-Smirnov (KS) test for the numeric ones.
+
+The test dataset is summarized once per model into a `FeatureProfile`, persisted next
+to the reference profile of the model, which holds for every input:
+
+- Numeric inputs: the distinct test values, which split the real line into cells (the
+    distinct values themselves and the open intervals between them), the count of test
+    records in each cell, and the assignment of the cells to FEATURE_BINS quantile bins
+    of the test values. The input records only have to be counted by cell: the PSI and
+    the JS distance are calculated over the bins, and the KS statistic is exact, since
+    the empirical distributions can only cross at the edges of the cells.
+- Categorical inputs: the test categories, with a bin for categories unseen in the
+    test dataset.
+
+Nulls are counted in their own bin, and are left out of the KS test.
+
+Every step works on all the inputs at once instead of looping over them: the numeric
+values are located in the sorted distinct test values of every input with a single
+binary search, the categories with a single hash lookup, and the counts of every input
+are kept in one flat array, reduced by input with `np.add.reduceat`. Profiling all the
+inputs of a file costs about one pass over its values, and large files can be read in
+chunks of rows whose counts add up.
+
+Classes:
+----------
+- FeatureProfile:
+    The distribution of every model input in the test dataset.
+
+- FeatureSummary:
+    Counts of the values of every model input, by cell and bin of a feature profile.
+
+- FeatureProfileStore:
+    Reference store of the feature profiles of the models.
+
+Functions:
+----------
+- build_feature_profile(model: object, model_digest: str) -> FeatureProfile:
+    Summarizes the inputs of a model in the test dataset into a feature profile.
+
+- calculate_feature_drift(path: str, profile: FeatureProfile,
+                          chunk_size: int) -> Dict[str, Dict[str, object]]:
+    Calculates the drift of every model input of the dataset in the path.
+
+Attributes:
+----------
+- FEATURE_PROFILE_STORE: FeatureProfileStore
+    The feature profile store shared by the whole application.
+'''
+
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from api.endpoints.adherence import PSI_EPSILON
+from api.endpoints.reference import ReferenceStore, load_reference_profile
+from api.endpoints.registry import ModelEntry
+from api.endpoints.metrics import count_records, stage
+from api.endpoints.utils import get_test_data, ks_asymptotic_p_value
+
+
+# Number of quantile bins of the numeric inputs used by the PSI and the JS distance.
+FEATURE_BINS = 10
+
+
+class FeatureProfile(NamedTuple):
+    '''
+    The distribution of every model input in the test dataset.
+
+    The cells and bins of all the inputs are laid out in flat arrays, the ones of the
+    i-th input of a kind between its offsets i and i + 1.
+
+    Attributes:
+        model_digest (str): The SHA-256 digest of the model file.
+        numeric_columns (np.ndarray): The names of the numeric inputs.
+        numeric_values (np.ndarray): The distinct test values of all the numeric inputs,
+            in ascending order.
+        numeric_ranks (np.ndarray): For each numeric input and position in
+            `numeric_values`, the number of distinct test values of the input lower than
+            the value at that position, with one more position for the end.
+        numeric_cell_offsets (np.ndarray): The offsets of the cells of each numeric input.
+        numeric_cell_bins (np.ndarray): The flat bin of each cell.
+        numeric_bin_offsets (np.ndarray): The offsets of the bins of each numeric input,
+            whose last bin holds the nulls.
+        reference_numeric_cells (np.ndarray): The count of test records in each cell.
+        reference_numeric_bins (np.ndarray): The count of test records in each bin.
+        categorical_columns (np.ndarray): The names of the categorical inputs.
+        categories (np.ndarray): The distinct test categories of all the categorical
+            inputs, in ascending order.
+        categorical_bins (np.ndarray): For each categorical input and category, the flat
+            bin of the category, or the bin of the unseen categories of the input, with
+            one more position for the unseen categories.
+        categorical_bin_offsets (np.ndarray): The offsets of the bins of each categorical
+            input, whose last two bins hold the unseen categories and the nulls.
+        reference_categorical_bins (np.ndarray): The count of test records in each bin.
+    '''
+    model_digest: str
+    numeric_columns: np.ndarray
+    numeric_values: np.ndarray
+    numeric_ranks: np.ndarray
+    numeric_cell_offsets: np.ndarray
+    numeric_cell_bins: np.ndarray
+    numeric_bin_offsets: np.ndarray
+    reference_numeric_cells: np.ndarray
+    reference_numeric_bins: np.ndarray
+    categorical_columns: np.ndarray
+    categories: np.ndarray
+    categorical_bins: np.ndarray
+    categorical_bin_offsets: np.ndarray
+    reference_categorical_bins: np.ndarray
+
+
+class FeatureSummary:
+    '''
+    Counts of the values of every model input, by cell and bin of a feature profile.
+
+    Parameters
+    ----------
+    profile : FeatureProfile
+        The feature profile of the model.
+    '''
+
+    def __init__(self, profile: FeatureProfile):
+        self.profile = profile
+        self.numeric_cells = np.zeros(profile.numeric_cell_offsets[-1], dtype=np.int64)
+        self.numeric_nulls = np.zeros(len(profile.numeric_columns), dtype=np.int64)
+        self.categorical_bins = np.zeros(profile.categorical_bin_offsets[-1], dtype=np.int64)
+        self._categories = pd.Index(profile.categories.astype(object))
+
+    @property
+    def numeric_bins(self) -> np.ndarray:
+        '''The count of records in each bin of the numeric inputs.'''
+        return _numeric_bin_counts(self.profile, self.numeric_cells, self.numeric_nulls)
+
+    def update(self, records: pd.DataFrame):
+        '''
+        Folds records into the counts.
+
+        Parameters
+        ----------
+        records : pd.DataFrame
+            The records, holding every input of the profile.
+        '''
+        profile = self.profile
+
+        if len(profile.numeric_columns):
+            values = records[list(profile.numeric_columns)].to_numpy(dtype=np.float64)
+            nulls = np.isnan(values)
+            columns = np.arange(values.shape[1])
+
+            positions = np.searchsorted(profile.numeric_values, values)
+            ranks = profile.numeric_ranks[columns, positions]
+            next_ranks = profile.numeric_ranks[
+                columns, np.minimum(positions + 1, profile.numeric_values.shape[0])]
+            is_value = (np.append(profile.numeric_values, np.nan)[positions] == values) \
+                & (next_ranks > ranks)
+            cells = profile.numeric_cell_offsets[:-1] + 2 * ranks + is_value
+
+            self.numeric_cells += np.bincount(
+                cells[~nulls], minlength=self.numeric_cells.shape[0])
+            self.numeric_nulls += nulls.sum(axis=0)
+
+        if len(profile.categorical_columns):
+            values = records[list(profile.categorical_columns)].to_numpy(dtype=object)
+            columns = np.broadcast_to(np.arange(values.shape[1]), values.shape).ravel()
+            # Unseen categories and nulls get -1, the last position of `categorical_bins`.
+            categories = self._categories.get_indexer(values.ravel())
+
+            bins = np.where(
+                pd.isna(values.ravel()), profile.categorical_bin_offsets[1:][columns] - 1,
+                profile.categorical_bins[columns, categories])
+
+            self.categorical_bins += np.bincount(
+                bins, minlength=self.categorical_bins.shape[0])
+
+    def drift(self) -> Dict[str, Dict[str, object]]:
+        '''
+        Calculates the drift of every input against the profile.
+
+        Returns
+        ----------
+        Dict[str, Dict[str, object]]
+            By input name, its kind, PSI and JS distance and, for numeric inputs, the
+            KS statistic and asymptotic p-value. A statistic is None when the input or
+            the test dataset has no values to compare.
+        '''
+        profile = self.profile
+        drift = {}
+
+        if len(profile.numeric_columns):
+            psi, js_distance = _binned_divergences(
+                self.numeric_bins, profile.reference_numeric_bins,
+                profile.numeric_bin_offsets)
+            ks_statistic, p_value = _cell_ks_test(
+                self.numeric_cells, profile.reference_numeric_cells,
+                profile.numeric_cell_offsets)
+
+            for index, name in enumerate(profile.numeric_columns.tolist()):
+                drift[name] = {
+                    'type': 'numeric',
+                    'psi': _to_float(psi[index]),
+                    'js_divergence': _to_float(js_distance[index]),
+                    'ks_test': {
+                        'ks_statistic': _to_float(ks_statistic[index]),
+                        'p_value': _to_float(p_value[index])
+                    }
+                }
+
+        if len(profile.categorical_columns):
+            psi, js_distance = _binned_divergences(
+                self.categorical_bins, profile.reference_categorical_bins,
+                profile.categorical_bin_offsets)
+
+            for index, name in enumerate(profile.categorical_columns.tolist()):
+                drift[name] = {
+                    'type': 'categorical',
+                    'psi': _to_float(psi[index]),
+                    'js_divergence': _to_float(js_distance[index])
+                }
+
+        return drift
+
+
+def _to_float(value: float) -> Optional[float]:
+    '''Converts a statistic to a JSON serializable float, with NaN as None.'''
+    return None if np.isnan(value) else float(value)
+
+
+def _numeric_bin_counts(profile: FeatureProfile, cells: np.ndarray,
+                        nulls: np.ndarray) -> np.ndarray:
+    '''Adds the counts of the cells of the numeric inputs into the counts of their bins.'''
+    bins = np.bincount(profile.numeric_cell_bins, weights=cells,
+                       minlength=profile.numeric_bin_offsets[-1]).astype(np.int64)
+    bins[profile.numeric_bin_offsets[1:] - 1] += nulls
+
+    return bins
+
+
+def _segment_sums(values: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    '''Sums the values between consecutive offsets, which are at least one apart.'''
+    return np.add.reduceat(values, offsets[:-1])
+
+
+def _binned_divergences(counts: np.ndarray, reference_counts: np.ndarray,
+                        offsets: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    '''
+    Calculates the PSI, with the bin proportions floored at PSI_EPSILON, and the JS
+    distance of every input between the bin counts of the input data and of the test
+    dataset, laid out between consecutive offsets.
+    '''
+    from scipy.special import rel_entr  # pylint: disable=import-outside-toplevel
+
+    sizes = np.diff(offsets)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        actual = counts / np.repeat(_segment_sums(counts, offsets), sizes)
+        expected = reference_counts / np.repeat(_segment_sums(reference_counts, offsets), sizes)
+
+        floored_actual = np.maximum(actual, PSI_EPSILON)
+        floored_expected = np.maximum(expected, PSI_EPSILON)
+        psi = _segment_sums(
+            (floored_actual - floored_expected) * np.log(floored_actual / floored_expected),
+            offsets)
+
+        middle = (actual + expected) / 2
+        js_distance = np.sqrt(_segment_sums(
+            rel_entr(actual, middle) + rel_entr(expected, middle), offsets) / 2)
+
+    return psi, js_distance
+
+
+def _cell_ks_test(cells: np.ndarray, reference_cells: np.ndarray,
+                  offsets: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    '''
+    Calculates the two-sided two-sample KS test of every numeric input between the cell
+    counts of the input data and of the test dataset, laid out between consecutive offsets.
+    Both empirical distributions are evaluated at the end of every cell.
+    '''
+    sizes = np.diff(offsets)
+
+    def cumulative_distribution(counts: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        totals = _segment_sums(counts, offsets)
+        cumulative = np.cumsum(counts)
+        before = np.repeat(cumulative[offsets[:-1]] - counts[offsets[:-1]], sizes)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return (cumulative - before) / np.repeat(totals, sizes), totals
+
+    distribution, size = cumulative_distribution(cells)
+    reference_distribution, reference_size = cumulative_distribution(reference_cells)
+
+    ks_statistic = np.maximum.reduceat(
+        np.abs(distribution - reference_distribution), offsets[:-1])
+    comparable = (size > 0) & (reference_size > 0)
+    ks_statistic[~comparable] = np.nan
+
+    p_value = np.full(ks_statistic.shape, np.nan)
+    p_value[comparable] = ks_asymptotic_p_value(
+        ks_statistic[comparable], size[comparable], reference_size[comparable])
+
+    return ks_statistic, p_value
+
+
+def build_feature_profile(model: object, model_digest: str) -> FeatureProfile:
+    '''
+    Summarizes the inputs of a model in the test dataset into a feature profile.
+    Inputs with a numeric type in the test dataset are numeric and the other ones are
+    categorical.
+
+    Parameters
+    ----------
+    model : object
+        The pre-trained model. Its inputs are the `feature_names_in_` of the model or,
+        when it doesn't have them, every column of the test dataset.
+    model_digest : str
+        The SHA-256 digest of the model file.
+
+    Returns
+    ----------
+    FeatureProfile
+        The feature profile of the model.
+    '''
+    x_test, _ = get_test_data()
+    columns = list(getattr(model, 'feature_names_in_', x_test.columns))
+    numeric_columns = [name for name in columns if x_test[name].dtype.kind in 'biuf']
+    categorical_columns = [name for name in columns if name not in set(numeric_columns)]
+
+    numeric = x_test[numeric_columns].to_numpy(dtype=np.float64)
+    numeric_values = np.unique(numeric[~np.isnan(numeric)])
+    ranks, cell_bins, cell_offsets, bin_offsets = [], [], [0], [0]
+    for column in numeric.T:
+        column = np.sort(column[~np.isnan(column)])
+        values = np.unique(column)
+        # The lower quantiles, so the bin edges are test values.
+        edges = np.unique(column[np.floor(
+            np.linspace(0, 1, FEATURE_BINS + 1)[1:-1] * (column.shape[0] - 1)).astype(np.int64)]) \
+            if column.shape[0] else column
+        value_bins = np.searchsorted(edges, values)
+
+        ranks.append(np.append(np.searchsorted(values, numeric_values), values.shape[0]))
+        # Cell 2i is the open interval below the i-th value and cell 2i + 1 the value itself.
+        cell_bins.append(bin_offsets[-1] + np.append(
+            np.repeat(value_bins, 2), edges.shape[0]))
+        cell_offsets.append(cell_offsets[-1] + 2 * values.shape[0] + 1)
+        bin_offsets.append(bin_offsets[-1] + edges.shape[0] + 2)
+
+    categorical = x_test[categorical_columns].to_numpy(dtype=object)
+    categories = np.unique(categorical[~pd.isna(categorical)].astype(str))
+    categorical_bins = np.empty(
+        (len(categorical_columns), categories.shape[0] + 1), dtype=np.int64)
+    categorical_offsets = [0]
+    for index, column in enumerate(categorical.T):
+        values = np.unique(column[~pd.isna(column)].astype(str))
+        seen = np.append(np.isin(categories, values), False)
+        categorical_bins[index] = categorical_offsets[-1] + np.where(
+            seen, np.cumsum(seen) - 1, values.shape[0])
+        categorical_offsets.append(categorical_offsets[-1] + values.shape[0] + 2)
+
+    profile = FeatureProfile(
+        model_digest=model_digest,
+        numeric_columns=np.array(numeric_columns, dtype=str),
+        numeric_values=numeric_values,
+        numeric_ranks=np.array(ranks, dtype=np.int64).reshape(
+            len(numeric_columns), numeric_values.shape[0] + 1),
+        numeric_cell_offsets=np.array(cell_offsets, dtype=np.int64),
+        numeric_cell_bins=np.concatenate(cell_bins or [[]]).astype(np.int64),
+        numeric_bin_offsets=np.array(bin_offsets, dtype=np.int64),
+        reference_numeric_cells=np.zeros(cell_offsets[-1], dtype=np.int64),
+        reference_numeric_bins=np.zeros(bin_offsets[-1], dtype=np.int64),
+        categorical_columns=np.array(categorical_columns, dtype=str),
+        categories=categories,
+        categorical_bins=categorical_bins,
+        categorical_bin_offsets=np.array(categorical_offsets, dtype=np.int64),
+        reference_categorical_bins=np.zeros(categorical_offsets[-1], dtype=np.int64)
+    )
+
+    summary = FeatureSummary(profile)
+    summary.update(x_test)
+
+    return profile._replace(
+        reference_numeric_cells=summary.numeric_cells,
+        reference_numeric_bins=summary.numeric_bins,
+        reference_categorical_bins=summary.categorical_bins
+    )
+
+
+def read_feature_chunks(path: str, profile: FeatureProfile,
+                        chunk_size: Optional[int] = None) -> Iterator[pd.DataFrame]:
+    '''
+    Reads the inputs of a profile from the CSV file in the path, in chunks of rows.
+
+    Parameters
+    ----------
+    path : str
+        The path to the CSV file.
+    profile : FeatureProfile
+        The feature profile of the model.
+    chunk_size : int, optional
+        The number of rows read at a time. None reads the whole file at once.
+
+    Raises
+    ----------
+    ValueError
+        If the file is missing an input of the profile.
+
+    Returns
+    ----------
+    Iterator[pd.DataFrame]
+        The chunks of records.
+    '''
+    dtypes = {
+        **{name: np.float64 for name in profile.numeric_columns.tolist()},
+        **{name: object for name in profile.categorical_columns.tolist()}
+    }
+
+    chunks = pd.read_csv(path, usecols=lambda column: column in dtypes,
+                         dtype=dtypes, chunksize=chunk_size or None)
+    if not chunk_size:
+        chunks = [chunks]
+
+    for chunk in chunks:
+        missing: List[str] = [name for name in dtypes if name not in chunk]
+        if missing:
+            raise ValueError(f'The input file is missing the model inputs: {", ".join(missing)}.')
+        yield chunk
+
+
+def calculate_feature_drift(path: str, profile: FeatureProfile,
+                            chunk_size: Optional[int] = None) -> Dict[str, Dict[str, object]]:
+    '''
+    Calculates the drift of every model input of the dataset in the path against
+    the feature profile of the model.
+
+    Parameters
+    ----------
+    path : str
+        The path to the data file.
+    profile : FeatureProfile
+        The feature profile of the model.
+    chunk_size : int, optional
+        The number of rows read at a time. None reads the whole file at once.
+
+    Raises
+    ----------
+    ValueError
+        If the file is missing an input of the profile.
+
+    Returns
+    ----------
+    Dict[str, Dict[str, object]]
+        The drift statistics of each input by its name.
+    '''
+    summary = FeatureSummary(profile)
+    chunks = read_feature_chunks(path, profile, chunk_size)
+
+    while True:
+        with stage('read_csv'):
+            records = next(chunks, None)
+        if records is None:
+            break
+        with stage('profile'):
+            summary.update(records)
+        count_records(len(records))
+
+    with stage('statistics'):
+        return summary.drift()
+
+
+class FeatureProfileStore(ReferenceStore):
+    '''
+    Reference store of the feature profiles of the models, persisted next to
+    their reference profiles.
+    '''
+
+    file_suffix = '-features'
+
+    def _build(self, entry: ModelEntry) -> FeatureProfile:
+        '''Builds the feature profile of a model.'''
+        return build_feature_profile(entry.model, entry.digest)
+
+    def _load(self, path: str) -> FeatureProfile:
+        '''Loads a persisted feature profile.'''
+        return load_reference_profile(path, FeatureProfile)
+
+
+FEATURE_PROFILE_STORE = FeatureProfileStore()
@@ -0,0 +1,214 @@
+'''
+Module that runs long computations as asynchronous jobs.
+
+A job is submitted to the in-process job queue, which returns its id right away, and
+is run in the compute executor by one of the queue workers, without the request
+timeout. Clients poll the status of the job and fetch its result once it finishes.
+Finished jobs are kept for `JOB_RESULT_TTL` seconds and then forgotten.
+
+The queue lives in the API process: queued and finished jobs are lost when the
+process stops, and the API must keep running while the jobs run.
+
+Classes:
+----------
+- Job:
+    A computation submitted to the job queue, with its status and outcome.
+
+- JobQueue:
+    In-process queue that runs jobs in the compute executor with a fixed number of workers.
+
+Attributes:
+----------
+- JOB_QUEUE: JobQueue
+    The job queue shared by the whole application.
+'''
+
+import asyncio
+import time
+import uuid
+from typing import Callable, Dict, List, Optional
+
+from api.settings import JOB_WORKERS, JOB_RESULT_TTL, JOB_TIMEOUT
+from api.endpoints.executor import COMPUTE_EXECUTOR, ComputeExecutor
+from api.endpoints.utils import format_timestamp
+
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_SUCCEEDED = 'succeeded'
+JOB_FAILED = 'failed'
+
+
+class Job:
+    '''
+    A computation submitted to the job queue, with its status and outcome.
+
+    Attributes:
+        job_id (str): The id of the job.
+        status (str): 'queued', 'running', 'succeeded' or 'failed'.
+        submitted_at (float): The submission time, in seconds since the epoch.
+        started_at (float): The time the job started running, if it did.
+        finished_at (float): The time the job finished, if it did.
+        result (object): The return value of the computation, once it succeeded.
+        error (Exception): The exception raised by the computation, once it failed.
+    '''
+
+    def __init__(self, job_id: str):
+        self.job_id = job_id
+        self.status = JOB_QUEUED
+        self.submitted_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.result: object = None
+        self.error: Optional[Exception] = None
+
+    @property
+    def finished(self) -> bool:
+        '''Whether the job succeeded or failed.'''
+        return self.status in (JOB_SUCCEEDED, JOB_FAILED)
+
+    def describe(self, result_ttl: float = JOB_RESULT_TTL) -> Dict[str, object]:
+        '''
+        Describes the status of the job, with its times as ISO 8601 UTC strings.
+
+        Parameters
+        ----------
+        result_ttl : float
+            The number of seconds the job is kept once finished.
+
+        Returns
+        ----------
+        Dict[str, object]
+            The id, status and times of the job.
+        '''
+        return {
+            'job_id': self.job_id,
+            'status': self.status,
+            'submitted_at': format_timestamp(self.submitted_at),
+            'started_at': format_timestamp(self.started_at),
+            'finished_at': format_timestamp(self.finished_at),
+            'expires_at': format_timestamp(
+                self.finished_at + result_ttl if self.finished else None)
+        }
+
+
+class JobQueue:
+    '''
+    In-process queue that runs jobs in the compute executor with a fixed number of workers.
+
+    The workers are asyncio tasks started on the first submission, so at most `workers`
+    jobs run at the same time and the others wait in the queue in submission order.
+
+    Parameters
+    ----------
+    workers : int
+        The number of jobs run at the same time.
+    result_ttl : float
+        The number of seconds a finished job is kept.
+    timeout : float
+        The timeout in seconds of each job. 0 disables the timeout.
+    executor : ComputeExecutor
+        The compute executor the jobs run in.
+    '''
+
+    def __init__(self, workers: int = JOB_WORKERS, result_ttl: float = JOB_RESULT_TTL,
+                 timeout: float = JOB_TIMEOUT, executor: ComputeExecutor = COMPUTE_EXECUTOR):
+        self.workers = workers
+        self.result_ttl = result_ttl
+        self.timeout = timeout
+        self.executor = executor
+        self._jobs: Dict[str, Job] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker_tasks: List[asyncio.Task] = []
+
+    def submit(self, func: Callable, *args) -> Job:
+        '''
+        Queues a function call as a job. Must be called from the event loop.
+
+        Parameters
+        ----------
+        func : Callable
+            The function to run, defined at module level.
+        *args
+            The positional arguments of the function.
+
+        Returns
+        ----------
+        Job
+            The queued job.
+        '''
+        self._purge_expired()
+
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+            self._worker_tasks = [
+                asyncio.get_running_loop().create_task(self._work())
+                for _ in range(self.workers)
+            ]
+
+        job = Job(uuid.uuid4().hex)
+        self._jobs[job.job_id] = job
+        self._queue.put_nowait((job, func, args))
+
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        '''
+        Returns a job by its id.
+
+        Parameters
+        ----------
+        job_id : str
+            The id of the job.
+
+        Returns
+        ----------
+        Job, optional
+            The job, or None when it doesn't exist or has expired.
+        '''
+        self._purge_expired()
+
+        return self._jobs.get(job_id)
+
+    def shutdown(self):
+        '''
+        Stops the workers. Queued jobs are dropped and running jobs are abandoned.
+        '''
+        for task in self._worker_tasks:
+            task.cancel()
+
+        self._worker_tasks = []
+        self._queue = None
+
+    async def _work(self):
+        '''Runs the queued jobs one at a time.'''
+        queue = self._queue
+
+        while True:
+            job, func, args = await queue.get()
+            job.status = JOB_RUNNING
+            job.started_at = time.time()
+
+            try:
+                job.result = await self.executor.run(func, *args, timeout=self.timeout)
+                job.status = JOB_SUCCEEDED
+            except Exception as exception:  # pylint: disable=broad-except
+                job.error = exception
+                job.status = JOB_FAILED
+            finally:
+                job.finished_at = time.time()
+                queue.task_done()
+
+    def _purge_expired(self):
+        '''Forgets the jobs that finished more than `result_ttl` seconds ago.'''
+        expired_before = time.time() - self.result_ttl
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job.finished and job.finished_at < expired_before
+        ]
+
+        for job_id in expired:
+            del self._jobs[job_id]
+
+
+JOB_QUEUE = JobQueue()
@@ -0,0 +1,425 @@
+'''
+Module that instruments the stages of the API requests and exposes them as metrics.
+
+Each stage of a request (reading the body, decoding, validating, loading the model,
+predicting, calculating a metric...) is wrapped in `stage`, which measures its duration
+and adds it to the `RequestMetrics` of the current request, along with the number of
+records the request processed (`count_records`). The request metrics live in a context
+variable set by the HTTP middleware of the application, which, once the response is
+ready, adds the duration of each stage to the `api_stage_duration_seconds` histogram and
+returns them in the `Server-Timing` response header.
+
+The compute executor runs functions in other threads or processes, which don't see the
+context of the request. It runs them through `collect_metrics`, which gathers their
+stages in fresh request metrics and returns them with the result, and merges them into
+the metrics of the request with `merge_metrics`. Stages measured outside a request, or
+after its response, go straight to the histogram.
+
+The metrics are kept in the API process and rendered in the Prometheus text format by
+`MetricsRegistry.render`, served at `/metrics`.
+
+Classes:
+----------
+- Counter:
+    Prometheus counter with labels.
+
+- Histogram:
+    Prometheus histogram with labels.
+
+- MetricsRegistry:
+    Collection of metrics rendered together.
+
+- RequestMetrics:
+    The stage durations, record count and error of one request.
+
+Functions:
+----------
+- stage(name: str) -> ContextManager:
+    Measures the duration of a stage of the current request. Also works as a decorator.
+
+- count_records(count: int):
+    Adds to the number of records processed by the current request.
+
+- record_error(exception: Exception):
+    Records the exception a request failed with.
+
+- collect_metrics(func: Callable, *args) -> Tuple[object, RequestMetrics]:
+    Runs a function and returns its result with the request metrics it recorded.
+
+- merge_metrics(metrics: RequestMetrics):
+    Merges request metrics recorded elsewhere into the current request metrics.
+
+Attributes:
+----------
+- METRICS: MetricsRegistry
+    The metrics registry shared by the whole application.
+'''
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+
+# Upper bounds in seconds of the buckets of the duration histograms.
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                    1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    '''Formats label names and values as a Prometheus label set.'''
+    if not names:
+        return ''
+
+    labels = ','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"')
+                         .replace('\n', '\\n'))
+        for name, value in zip(names, values))
+
+    return '{' + labels + '}'
+
+
+class Counter:
+    '''
+    Prometheus counter with labels.
+
+    Parameters
+    ----------
+    name : str
+        The metric name.
+    documentation : str
+        The help text of the metric.
+    label_names : Sequence[str]
+        The names of the labels.
+    '''
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values: Dict[LabelValues, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values: str, amount: float = 1):
+        '''
+        Increments the counter of the given label values.
+
+        Parameters
+        ----------
+        *label_values : str
+            The value of each label, in the order of the label names.
+        amount : float
+            The increment.
+        '''
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self) -> List[str]:
+        '''Renders the counter in the Prometheus text format.'''
+        with self._lock:
+            values = sorted(self._values.items())
+
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter'] + [
+            f'{self.name}{_format_labels(self.label_names, label_values)} {value}'
+            for label_values, value in values
+        ]
+
+
+class Histogram:
+    '''
+    Prometheus histogram with labels.
+
+    Parameters
+    ----------
+    name : str
+        The metric name.
+    documentation : str
+        The help text of the metric.
+    label_names : Sequence[str]
+        The names of the labels.
+    buckets : Sequence[float]
+        The upper bounds of the buckets, in ascending order. The +Inf bucket is implicit.
+    '''
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = (),
+                 buckets: Sequence[float] = DURATION_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._values: Dict[LabelValues, Tuple[List[int], float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values: str):
+        '''
+        Adds an observation for the given label values.
+
+        Parameters
+        ----------
+        value : float
+            The observed value.
+        *label_values : str
+            The value of each label, in the order of the label names.
+        '''
+        bucket = bisect.bisect_left(self.buckets, value)
+
+        with self._lock:
+            counts, total = self._values.get(
+                label_values, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bucket] += 1
+            self._values[label_values] = (counts, total + value)
+
+    def render(self) -> List[str]:
+        '''Renders the histogram in the Prometheus text format, with cumulative buckets.'''
+        with self._lock:
+            values = sorted((labels, (list(counts), total))
+                            for labels, (counts, total) in self._values.items())
+
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        bucket_label_names = self.label_names + ('le',)
+
+        for label_values, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                bound_label = '+Inf' if bound == float('inf') else f'{bound:g}'
+                lines.append(f'{self.name}_bucket'
+                             f'{_format_labels(bucket_label_names, label_values + (bound_label,))}'
+                             f' {cumulative}')
+            labels = _format_labels(self.label_names, label_values)
+            lines.append(f'{self.name}_sum{labels} {total}')
+            lines.append(f'{self.name}_count{labels} {cumulative}')
+
+        return lines
+
+
+class MetricsRegistry:
+    '''
+    Collection of metrics rendered together.
+    '''
+
+    def __init__(self):
+        self.requests = Counter(
+            'api_requests_total', 'Number of HTTP requests.', ('method', 'route', 'status'))
+        self.request_duration = Histogram(
+            'api_request_duration_seconds', 'Duration of the HTTP requests.', ('route',))
+        self.stage_duration = Histogram(
+            'api_stage_duration_seconds', 'Duration of the stages of the requests.', ('stage',))
+        self.records = Counter(
+            'api_records_total', 'Number of records processed by the requests.', ('route',))
+        self.errors = Counter(
+            'api_errors_total', 'Number of failed requests by exception type.',
+            ('route', 'exception'))
+
+    def render(self) -> str:
+        '''
+        Renders every metric in the Prometheus text format.
+
+        Returns
+        ----------
+        str
+            The metrics exposition.
+        '''
+        metrics = (self.requests, self.request_duration, self.stage_duration,
+                   self.records, self.errors)
+
+        return '\n'.join(line for metric in metrics for line in metric.render()) + '\n'
+
+
+METRICS = MetricsRegistry()
+
+
+class RequestMetrics:
+    '''
+    The stage durations, record count and error of one request.
+
+    Attributes:
+        stages (Dict[str, float]): The total duration in seconds of each stage, in the
+            order the stages were first recorded.
+        records (int): The number of records processed.
+        exception (str, optional): The type name of the exception the request failed with.
+        finished (bool): Whether the metrics were already added to the registry.
+    '''
+
+    def __init__(self):
+        self.stages: Dict[str, float] = {}
+        self.records = 0
+        self.exception: Optional[str] = None
+        self.finished = False
+
+    def add_stage(self, name: str, seconds: float):
+        '''Adds the duration of a stage, straight to the histogram once finished.'''
+        if self.finished:
+            METRICS.stage_duration.observe(seconds, name)
+        else:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def server_timing(self, total: float) -> str:
+        '''
+        Formats the stage durations as a `Server-Timing` header value.
+
+        Parameters
+        ----------
+        total : float
+            The duration of the whole request in seconds.
+
+        Returns
+        ----------
+        str
+            The duration of each stage and of the whole request, in milliseconds.
+        '''
+        return ', '.join(
+            f'{name};dur={seconds * 1000:.3f}'
+            for name, seconds in [*self.stages.items(), ('total', total)])
+
+    def finish(self, method: str, route: str, status: int, duration: float):
+        '''
+        Adds the metrics of the request to the registry.
+
+        Parameters
+        ----------
+        method : str
+            The HTTP method.
+        route : str
+            The path template of the route.
+        status : int
+            The status code of the response.
+        duration : float
+            The duration of the request in seconds.
+        '''
+        self.finished = True
+
+        METRICS.requests.inc(method, route, str(int(status)))
+        METRICS.request_duration.observe(duration, route)
+        for name, seconds in self.stages.items():
+            METRICS.stage_duration.observe(seconds, name)
+        if self.records:
+            METRICS.records.inc(route, amount=self.records)
+        if self.exception is not None:
+            METRICS.errors.inc(route, self.exception)
+
+
+_CURRENT_METRICS: ContextVar[Optional[RequestMetrics]] = ContextVar(
+    'request_metrics', default=None)
+
+
+def current_metrics() -> Optional[RequestMetrics]:
+    '''Returns the metrics of the current request, if any.'''
+    return _CURRENT_METRICS.get()
+
+
+def start_request() -> RequestMetrics:
+    '''
+    Starts the metrics of a request in the current context.
+
+    Returns
+    ----------
+    RequestMetrics
+        The metrics of the request.
+    '''
+    metrics = RequestMetrics()
+    _CURRENT_METRICS.set(metrics)
+
+    return metrics
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    '''
+    Measures the duration of a stage of the current request. Also works as a decorator.
+
+    Parameters
+    ----------
+    name : str
+        The stage name.
+    '''
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        metrics = _CURRENT_METRICS.get()
+        if metrics is None:
+            METRICS.stage_duration.observe(seconds, name)
+        else:
+            metrics.add_stage(name, seconds)
+
+
+def count_records(count: int):
+    '''
+    Adds to the number of records processed by the current request.
+
+    Parameters
+    ----------
+    count : int
+        The number of records.
+    '''
+    metrics = _CURRENT_METRICS.get()
+    if metrics is not None:
+        metrics.records += count
+
+
+def record_error(exception: Exception):
+    '''
+    Records the exception the current request failed with.
+
+    Parameters
+    ----------
+    exception : Exception
+        The exception.
+    '''
+    metrics = _CURRENT_METRICS.get()
+    if metrics is not None:
+        metrics.exception = type(exception).__name__
+
+
+def collect_metrics(func: Callable, *args) -> Tuple[object, RequestMetrics]:
+    '''
+    Runs a function with fresh request metrics and returns its result with the metrics
+    it recorded. Used by the compute executor, whose threads and processes don't see
+    the context of the request.
+
+    Parameters
+    ----------
+    func : Callable
+        The function to run.
+    *args
+        The positional arguments of the function.
+
+    Returns
+    ----------
+    Tuple[object, RequestMetrics]
+        The return value of the function and its metrics.
+    '''
+    metrics = RequestMetrics()
+    token = _CURRENT_METRICS.set(metrics)
+    try:
+        return func(*args), metrics
+    finally:
+        _CURRENT_METRICS.reset(token)
+
+
+def merge_metrics(metrics: RequestMetrics):
+    '''
+    Merges request metrics recorded elsewhere into the metrics of the current request,
+    or into the registry when there is no current request.
+
+    Parameters
+    ----------
+    metrics : RequestMetrics
+        The metrics returned by `collect_metrics`.
+    '''
+    current = _CURRENT_METRICS.get()
+
+    for name, seconds in metrics.stages.items():
+        if current is None:
+            METRICS.stage_duration.observe(seconds, name)
+        else:
+            current.add_stage(name, seconds)
+
+    if current is not None and not current.finished:
+        current.records += metrics.records
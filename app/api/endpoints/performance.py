@@ -2,31 +2,288 @@
 Module that handles the /performance endpoint call.
 
 The endpoint reads the model AUC-ROC performance using the body request as the input.
+The model version can be selected with the `model_version` query parameter and
+the volumetry period ('day', 'week' or 'month') with the `granularity` query parameter.
+The body format is chosen by the `Content-Type` header (see `INPUT_FORMATS`): a JSON
+array of records (default), newline-delimited JSON (NDJSON), Apache Arrow IPC or
+Parquet. NDJSON bodies are decoded line by line while they are received. The other
+bodies are decoded from the raw request bytes, validated and ingested into a DataFrame
+in the compute executor, outside the event loop, where the metrics are calculated too.
+Every format goes through the same validation and metrics.
+
+Labelled batches sent over time can be accumulated in a session (see
+`api.endpoints.sessions`): `POST /performance/sessions` opens a session, a body sent
+to `POST /performance?session_id=...` is appended to it and the response holds the
+running volumetry and AUC-ROC of every batch of the session, which can also be read
+from `GET /performance/sessions/{session_id}` and closed with `DELETE`.
+
+The `auc_by_period` query parameter adds the AUC-ROC of each volumetry period to the
+response. The batch is scored once and the AUC-ROC of every period is calculated in a
+single grouped pass (see `api.endpoints.auc.grouped_auc`); periods with only positive or
+only negative records get a null AUC-ROC with their counts instead of failing.
+
+The `confidence_intervals` query parameter adds a bootstrap confidence interval of the
+AUC-ROC to the response, calculated from the same scores by resampling the labelled
+records (see `api.endpoints.bootstrap`).
+
+The records are scored through the score cache (see `api.endpoints.scores`): records
+already scored by the same model, in this batch or an earlier one, are not sent to the
+model again. `GET /performance/cache` reads its hit and miss counts.
 '''
 
+import asyncio
 from http import HTTPStatus
+from typing import Dict, List, Optional, Union
+import numpy as np
+import pandas as pd
+import orjson
 from fastapi import APIRouter, Request
 from fastapi.responses import JSONResponse
 from jsonschema import exceptions
 
-from api.endpoints.utils import format_input_records, count_records_by_month, calculate_aucroc
-from api.endpoints.validators import validate_performance_body
-from api.endpoints.exceptions import InvalidRequestError, InternalServerError
+from api.endpoints.utils import (
+    decode_input_records, decode_ndjson_records, read_arrow_records, read_parquet_records,
+    normalize_input_records, count_records_by_month, calculate_aucroc, record_periods,
+    INPUT_FORMATS, VOLUMETRY_GRANULARITIES)
+from api.settings import BOOTSTRAP_RESAMPLES, BOOTSTRAP_CONFIDENCE
+from api.endpoints.registry import MODEL_REGISTRY
+from api.endpoints.auc import AucSummary, grouped_auc
+from api.endpoints.bootstrap import auc_interval
+from api.endpoints.scores import SCORE_CACHE
+from api.endpoints.executor import COMPUTE_EXECUTOR
+from api.endpoints.metrics import count_records, stage
+from api.endpoints.sessions import (
+    PERFORMANCE_SESSIONS, PerformanceSession, PerformanceSummary, summarize_records)
+from api.endpoints.validators import validate_performance_body, validate_performance_frame
+from api.endpoints.exceptions import (
+    InvalidRequestError, InternalServerError, InvalidPathError, RequestTimeoutError,
+    UnsupportedMediaTypeError)
 
 
 router = APIRouter(prefix='/performance')
 
 
+def read_input_records(body: Union[bytes, List[object]], input_format: str) -> pd.DataFrame:
+    '''
+    Decodes and validates the body in the given format and returns its records as
+    a DataFrame, with the missing values as NaN.
+
+    Parameters
+    ----------
+    body : bytes or list
+        The raw request body, or the decoded records of an NDJSON body.
+    input_format : str
+        The body format: 'json', 'ndjson', 'arrow' or 'parquet'.
+
+    Raises
+    ----------
+    InvalidRequestError
+        If the body can't be decoded in its format or doesn't match the body schema.
+
+    Returns
+    ----------
+    pd.DataFrame
+        The validated input records.
+    '''
+    # The errors are raised as InvalidRequestError here, in the compute executor: the
+    # jsonschema errors can't be pickled back from the workers of a process pool.
+    try:
+        if input_format == 'json':
+            body = decode_input_records(body)
+
+        if input_format in ('json', 'ndjson'):
+            return normalize_input_records(validate_performance_body(body), empty_strings=False)
+
+        reader = read_arrow_records if input_format == 'arrow' else read_parquet_records
+
+        return normalize_input_records(validate_performance_frame(reader(body)))
+    except orjson.JSONDecodeError as exception:
+        raise InvalidRequestError(
+            'Invalid request body. Must be a valid JSON object.') from exception
+    except exceptions.ValidationError as exception:
+        raise InvalidRequestError(
+            f'Body schema is invalid: {exception.message}.') from exception
+
+
+async def read_ndjson_body(request: Request) -> List[object]:
+    '''
+    Decodes an NDJSON request body while it is received, so that the raw body is
+    never buffered whole: each received chunk is decoded up to its last complete line.
+
+    Parameters
+    ----------
+    request : Request
+        The request.
+
+    Raises
+    ----------
+    orjson.JSONDecodeError
+        If a line is not valid JSON.
+
+    Returns
+    ----------
+    List[object]
+        The decoded records.
+    '''
+    records = []
+    partial_line = b''
+
+    async for chunk in request.stream():
+        lines, _, partial_line = (partial_line + chunk).rpartition(b'\n')
+        if lines:
+            records.extend(decode_ndjson_records(lines))
+
+    records.extend(decode_ndjson_records(partial_line))
+
+    return records
+
+
+def evaluate_performance(body: Union[bytes, List[object]], model_version: Optional[str],
+                         granularity: str = 'month', input_format: str = 'json',
+                         auc_by_period: bool = False,
+                         confidence_intervals: bool = False) -> Dict[str, object]:
+    '''
+    Decodes and validates the body, then calculates the volumetry by period and the
+    AUC-ROC of its records, and optionally the AUC-ROC of each period and the
+    confidence interval of the AUC-ROC. Runs in the compute executor.
+
+    Parameters
+    ----------
+    body : bytes or list
+        The raw request body, or the decoded records of an NDJSON body.
+    model_version : str, optional
+        The version of the model to evaluate.
+    granularity : str
+        The volumetry period: 'day', 'week' or 'month'.
+    input_format : str
+        The body format: 'json', 'ndjson', 'arrow' or 'parquet'.
+    auc_by_period : bool
+        Whether to calculate the AUC-ROC of each period too.
+    confidence_intervals : bool
+        Whether to calculate the bootstrap confidence interval of the AUC-ROC too.
+
+    Raises
+    ----------
+    InvalidRequestError
+        If the body can't be decoded in its format or doesn't match the body schema.
+
+    Returns
+    ----------
+    Dict[str, object]
+        The volumetry by period and the AUC-ROC value, with the AUC-ROC by period
+        and the confidence interval of the AUC-ROC when requested.
+    '''
+    df_input = read_input_records(body, input_format)
+    count_records(len(df_input))
+    scores = SCORE_CACHE.predict(df_input, MODEL_REGISTRY.get(model_version))
+
+    performance = {
+        'volumetry': count_records_by_month(df_input, granularity),
+        'auc_roc': calculate_aucroc(df_input, scores=scores)
+    }
+
+    if auc_by_period:
+        with stage('auc_by_period'):
+            periods, labels = record_periods(df_input, granularity)
+            aucs, positives, negatives = grouped_auc(
+                scores, df_input['TARGET'].to_numpy(), periods, len(labels))
+
+        performance['auc_roc_by_period'] = {
+            label: {
+                'auc_roc': None if np.isnan(auc) else float(auc),
+                'positives': int(positive_count),
+                'negatives': int(negative_count)
+            }
+            for label, auc, positive_count, negative_count in zip(
+                labels, aucs, positives, negatives)
+        }
+
+    if confidence_intervals:
+        with stage('bootstrap'):
+            summary = AucSummary.from_scores(
+                scores, df_input['TARGET'].to_numpy(), max_distinct=None)
+            performance['confidence_intervals'] = {
+                'confidence': BOOTSTRAP_CONFIDENCE,
+                'resamples': BOOTSTRAP_RESAMPLES,
+                'auc_roc': auc_interval(summary.positives, summary.negatives)
+            }
+
+    return performance
+
+
+def summarize_performance(body: Union[bytes, List[object]], model_version: Optional[str],
+                          input_format: str = 'json') -> PerformanceSummary:
+    '''
+    Decodes and validates the body, then scores and summarizes its records to be
+    appended to a session. Runs in the compute executor.
+
+    Parameters
+    ----------
+    body : bytes or list
+        The raw request body, or the decoded records of an NDJSON body.
+    model_version : str, optional
+        The version of the model that scores the records.
+    input_format : str
+        The body format: 'json', 'ndjson', 'arrow' or 'parquet'.
+
+    Raises
+    ----------
+    InvalidRequestError
+        If the body can't be decoded in its format or doesn't match the body schema.
+
+    Returns
+    ----------
+    PerformanceSummary
+        The mergeable summary of the records.
+    '''
+    df_input = read_input_records(body, input_format)
+    count_records(len(df_input))
+
+    scores = SCORE_CACHE.predict(df_input, MODEL_REGISTRY.get(model_version))
+
+    return summarize_records(df_input, scores)
+
+
 @router.post('')
-async def read_performance(request: Request):
+async def read_performance(request: Request, model_version: Optional[str] = None,
+                           granularity: str = 'month', session_id: Optional[str] = None,
+                           auc_by_period: bool = False, confidence_intervals: bool = False):
     '''
     Endpoint to read the model AUC-ROC performance using the body request as the input.
 
+    Parameters
+    ----------
+    model_version : str, optional
+        The version of the model to evaluate. Defaults to the default model version,
+        or to the model version of the session.
+    granularity : str
+        The volumetry period: 'day', 'week' or 'month'. Defaults to 'month'.
+    session_id : str, optional
+        The session the body is appended to. The response then holds the running
+        metrics of the session.
+    auc_by_period : bool
+        Whether to add the AUC-ROC of each period to the response. Defaults to False.
+    confidence_intervals : bool
+        Whether to add the bootstrap confidence interval of the AUC-ROC to the response.
+        Defaults to False.
+
     Raises
     ----------
     InvalidRequestError
-        If request body is not a valid JSON object or the
-        body doesn't match the body schema.
+        If request body can't be decoded in its format, the
+        body doesn't match the body schema, the model version is unknown,
+        the granularity is not supported or the AUC-ROC by period or the confidence
+        intervals are requested with a session.
+
+    InvalidPathError
+        If the session doesn't exist, has expired or was closed while the batch
+        was summarized.
+
+    UnsupportedMediaTypeError
+        If the Content-Type of the body is not supported.
+
+    RequestTimeoutError
+        If the calculation takes longer than the executor timeout.
 
     InternalServerError
         If an internal server error occurs.
@@ -34,31 +291,230 @@ async def read_performance(request: Request):
     Returns
     ----------
     JSONResponse
-        JSON response object containing the volumetry by month and the AUC-ROC value.
+        JSON response object containing the volumetry by period and the AUC-ROC value,
+        with the AUC-ROC by period and its confidence interval when requested.
     '''
+    session = None
+    if session_id is not None:
+        session = get_session(session_id)
+        if model_version not in (None, session.model_version):
+            raise InvalidRequestError(
+                f'Model version {model_version} does not match the model version '
+                f'{session.model_version} of the session.')
+        model_version = session.model_version
+        if auc_by_period:
+            raise InvalidRequestError('The AUC-ROC by period is not available for sessions.')
+        if confidence_intervals:
+            raise InvalidRequestError('The confidence intervals are not available for sessions.')
+
+    if not MODEL_REGISTRY.has_version(model_version):
+        raise InvalidRequestError(f'Unknown model version: {model_version}.')
+
+    check_granularity(granularity)
+
+    content_type = request.headers.get('content-type', 'application/json')
+    input_format = INPUT_FORMATS.get(content_type.split(';')[0].strip().lower())
+
+    if input_format is None:
+        raise UnsupportedMediaTypeError(
+            f'Unsupported Content-Type: {content_type}. '
+            f'Must be one of: {", ".join(INPUT_FORMATS)}.')
 
     try:
-        body = await request.json()
+        with stage('read_body'):
+            if input_format == 'ndjson':
+                body = await read_ndjson_body(request)
+            else:
+                body = await request.body()
 
-        validate_performance_body(body)
-    except ValueError as exception:
+        if session is None:
+            performance = await COMPUTE_EXECUTOR.run(
+                evaluate_performance, body, model_version, granularity, input_format,
+                auc_by_period, confidence_intervals)
+        else:
+            summary = await COMPUTE_EXECUTOR.run(
+                summarize_performance, body, model_version, input_format)
+            if not PERFORMANCE_SESSIONS.append(session, summary):
+                raise InvalidPathError(
+                    f'No such session: {session_id}. It was closed or has expired.')
+            performance = session.describe(granularity)
+    except orjson.JSONDecodeError as exception:
         raise InvalidRequestError(
             'Invalid request body. Must be a valid JSON object.') from exception
-    except exceptions.ValidationError as exception:
-        raise InvalidRequestError(
-            f'Body schema is invalid: {exception.message}.') from exception
-
-    try:
-        df_input = format_input_records(body)
-        records_by_month = count_records_by_month(df_input)
-        auc_roc = calculate_aucroc(df_input)
+    except (InvalidRequestError, InvalidPathError):
+        raise
+    except asyncio.TimeoutError as exception:
+        raise RequestTimeoutError(
+            'The request took too long to be processed.') from exception
     except Exception as exception:
         raise InternalServerError(str(exception)) from exception
 
     return JSONResponse(
-        content={
-            'volumetry': records_by_month,
-            'auc_roc': auc_roc
-        },
+        content=performance,
         status_code=HTTPStatus.OK
     )
+
+
+@router.get('/cache')
+async def read_score_cache():
+    '''
+    Endpoint to read the hit and miss counts of the score cache.
+
+    Returns
+    ----------
+    JSONResponse
+        The hits, misses, duplicates, entries and maximum entries of the cache.
+    '''
+    return JSONResponse(
+        content=SCORE_CACHE.statistics()._asdict(),
+        status_code=HTTPStatus.OK
+    )
+
+
+@router.post('/sessions')
+async def create_session(request: Request, model_version: Optional[str] = None):
+    '''
+    Endpoint to open a session that accumulates labelled batches.
+
+    Parameters
+    ----------
+    model_version : str, optional
+        The version of the model that scores the batches of the session.
+        Defaults to the default model version.
+
+    Raises
+    ----------
+    InvalidRequestError
+        If the model version is unknown.
+
+    Returns
+    ----------
+    JSONResponse
+        The new session, with its URL in the Location header.
+    '''
+    if not MODEL_REGISTRY.has_version(model_version):
+        raise InvalidRequestError(f'Unknown model version: {model_version}.')
+
+    session = PERFORMANCE_SESSIONS.create(MODEL_REGISTRY.get(model_version).version)
+
+    return JSONResponse(
+        content=session.describe(),
+        status_code=HTTPStatus.CREATED,
+        headers={'Location': f'{request.url.path}/{session.session_id}'}
+    )
+
+
+@router.get('/sessions/{session_id}')
+async def read_session(session_id: str, granularity: str = 'month'):
+    '''
+    Endpoint to read the running volumetry and AUC-ROC of a session.
+
+    Parameters
+    ----------
+    session_id : str
+        The id of the session.
+    granularity : str
+        The volumetry period: 'day', 'week' or 'month'. Defaults to 'month'.
+
+    Raises
+    ----------
+    InvalidRequestError
+        If the granularity is not supported.
+
+    InvalidPathError
+        If the session doesn't exist or has expired.
+
+    Returns
+    ----------
+    JSONResponse
+        The running metrics of the session.
+    '''
+    check_granularity(granularity)
+
+    return JSONResponse(
+        content=get_session(session_id).describe(granularity),
+        status_code=HTTPStatus.OK
+    )
+
+
+@router.delete('/sessions/{session_id}')
+async def delete_session(session_id: str, granularity: str = 'month'):
+    '''
+    Endpoint to close a session.
+
+    Parameters
+    ----------
+    session_id : str
+        The id of the session.
+    granularity : str
+        The volumetry period: 'day', 'week' or 'month'. Defaults to 'month'.
+
+    Raises
+    ----------
+    InvalidRequestError
+        If the granularity is not supported.
+
+    InvalidPathError
+        If the session doesn't exist or has expired.
+
+    Returns
+    ----------
+    JSONResponse
+        The final metrics of the session.
+    '''
+    check_granularity(granularity)
+
+    session = get_session(session_id)
+    PERFORMANCE_SESSIONS.delete(session_id)
+
+    return JSONResponse(
+        content=session.describe(granularity),
+        status_code=HTTPStatus.OK
+    )
+
+
+def get_session(session_id: str) -> PerformanceSession:
+    '''
+    Returns a performance session by its id.
+
+    Parameters
+    ----------
+    session_id : str
+        The id of the session.
+
+    Raises
+    ----------
+    InvalidPathError
+        If the session doesn't exist or has expired.
+
+    Returns
+    ----------
+    PerformanceSession
+        The session.
+    '''
+    session = PERFORMANCE_SESSIONS.get(session_id)
+
+    if session is None:
+        raise InvalidPathError(f'No such session: {session_id}. It may have expired.')
+
+    return session
+
+
+def check_granularity(granularity: str):
+    '''
+    Checks that a volumetry granularity is supported.
+
+    Parameters
+    ----------
+    granularity : str
+        The volumetry period.
+
+    Raises
+    ----------
+    InvalidRequestError
+        If the granularity is not supported.
+    '''
+    if granularity not in VOLUMETRY_GRANULARITIES:
+        raise InvalidRequestError(
+            f'Unknown granularity: {granularity}. '
+            f'Must be one of: {", ".join(VOLUMETRY_GRANULARITIES)}.')
@@ -0,0 +1,340 @@
+'''
+Module that builds and keeps the reference profiles used by the /aderencia endpoint.
+
+A reference profile holds everything the adherence statistics need from the test
+dataset for one model version: the sorted test scores, the score histogram and a
+quantile summary. Profiles are built once per model file (identified by its SHA-256
+digest), persisted as `.npz` files in the reference directory and loaded at startup,
+so a request only has to score its own input file.
+
+The test dataset itself is read from a memory-mapped Arrow copy of its CSV file
+(see `api.endpoints.utils.get_test_data`).
+
+Run `python -m api.endpoints.reference` from the `app` directory to convert the test
+dataset and build the reference and feature profiles of every model in the models
+directory, and add `--force` to rebuild existing ones. A profile that can't be
+persisted, such as in a read-only directory, is kept in memory only.
+
+Classes:
+----------
+- ReferenceProfile:
+    The summaries of the test dataset scores for one model version.
+
+- ReferenceStore:
+    Thread-safe in-memory cache of reference profiles backed by the reference directory.
+
+Functions:
+----------
+- build_reference_profile(model: object, model_digest: str) -> ReferenceProfile:
+    Scores the test dataset and summarizes the scores into a reference profile.
+
+- save_reference_profile(profile: ReferenceProfile, path: str):
+    Persists a reference profile as a `.npz` file.
+
+- load_reference_profile(path: str, profile_class: type) -> NamedTuple:
+    Loads a reference profile persisted by `save_reference_profile`.
+
+Attributes:
+----------
+- REFERENCE_STORE: ReferenceStore
+    The reference store shared by the whole application.
+'''
+
+import argparse
+import logging
+import os
+import threading
+from typing import Dict, List, NamedTuple
+
+import numpy as np
+
+from api.settings import REFERENCE_DIR
+from api.endpoints.registry import MODEL_REGISTRY, ModelEntry, ModelRegistry
+from api.endpoints.utils import (
+    convert_test_data, get_test_data, score_histogram, HISTOGRAM_BINS)
+
+
+logger = logging.getLogger(__name__)
+
+QUANTILE_LEVELS = np.array([0.01, 0.05, 0.1, 0.25, 0.5, 0.75, 0.9, 0.95, 0.99])
+
+
+class ReferenceProfile(NamedTuple):
+    '''
+    The summaries of the test dataset scores for one model version.
+
+    Attributes:
+        model_digest (str): The SHA-256 digest of the model file that produced the scores.
+        sorted_scores (np.ndarray): The test scores in ascending order.
+        histogram (np.ndarray): The density histogram of the test scores.
+        bin_edges (np.ndarray): The edges of the histogram bins.
+        quantile_levels (np.ndarray): The levels of the quantile summary.
+        quantiles (np.ndarray): The test score quantiles at each level.
+    '''
+    model_digest: str
+    sorted_scores: np.ndarray
+    histogram: np.ndarray
+    bin_edges: np.ndarray
+    quantile_levels: np.ndarray
+    quantiles: np.ndarray
+
+
+def build_reference_profile(model: object, model_digest: str) -> ReferenceProfile:
+    '''
+    Scores the test dataset and summarizes the scores into a reference profile.
+
+    Parameters
+    ----------
+    model : object
+        The pre-trained model.
+    model_digest : str
+        The SHA-256 digest of the model file.
+
+    Returns
+    ----------
+    ReferenceProfile
+        The reference profile of the model.
+    '''
+    x_test, _ = get_test_data()
+    sorted_scores = np.sort(model.predict_proba(x_test)[:, 1])
+
+    return ReferenceProfile(
+        model_digest=model_digest,
+        sorted_scores=sorted_scores,
+        histogram=score_histogram(sorted_scores),
+        bin_edges=np.linspace(0, 1, HISTOGRAM_BINS + 1),
+        quantile_levels=QUANTILE_LEVELS,
+        quantiles=np.quantile(sorted_scores, QUANTILE_LEVELS)
+    )
+
+
+def save_reference_profile(profile: ReferenceProfile, path: str):
+    '''
+    Persists a reference profile as a `.npz` file. The file is written next to
+    its destination first and then renamed, so readers never see a partial file.
+
+    Parameters
+    ----------
+    profile : ReferenceProfile
+        The reference profile.
+    path : str
+        The destination path.
+    '''
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    temporary_path = f'{path}.{os.getpid()}.tmp'
+
+    with open(temporary_path, 'wb') as file:
+        np.savez(file, **profile._asdict())
+    os.replace(temporary_path, path)
+
+
+def load_reference_profile(path: str, profile_class: type = ReferenceProfile) -> NamedTuple:
+    '''
+    Loads a reference profile persisted by `save_reference_profile`.
+
+    Parameters
+    ----------
+    path : str
+        The path to the `.npz` file.
+    profile_class : type
+        The NamedTuple class of the profile, with a `model_digest` field.
+
+    Returns
+    ----------
+    NamedTuple
+        The reference profile.
+    '''
+    with np.load(path) as data:
+        fields = {field: data[field] for field in profile_class._fields}
+
+    fields['model_digest'] = str(fields['model_digest'])
+
+    return profile_class(**fields)
+
+
+class ReferenceStore:
+    '''
+    Thread-safe in-memory cache of reference profiles backed by the reference directory.
+
+    Profiles are looked up by the digest of the model file, so a hot-swapped model
+    gets its own profile the first time it is used. Subclasses keep other profiles
+    of the test dataset by overriding `file_suffix`, `_build` and `_load`.
+
+    Parameters
+    ----------
+    reference_dir : str
+        The directory where the profiles are persisted.
+    '''
+
+    file_suffix = ''
+
+    def __init__(self, reference_dir: str = REFERENCE_DIR):
+        self.reference_dir = reference_dir
+        self._profiles: Dict[str, ReferenceProfile] = {}
+        self._lock = threading.Lock()
+
+    def path(self, entry: ModelEntry) -> str:
+        '''
+        Returns the path of the persisted profile of a model.
+
+        Parameters
+        ----------
+        entry : ModelEntry
+            The model registry entry.
+
+        Returns
+        ----------
+        str
+            The path to the `.npz` file.
+        '''
+        return os.path.join(
+            self.reference_dir, f'{entry.version}-{entry.digest[:16]}{self.file_suffix}.npz')
+
+    def get(self, entry: ModelEntry) -> ReferenceProfile:
+        '''
+        Returns the reference profile of a model, loading it from the reference
+        directory or building and persisting it when it doesn't exist yet.
+
+        Parameters
+        ----------
+        entry : ModelEntry
+            The model registry entry.
+
+        Raises
+        ----------
+        FileNotFoundError
+            If the profile has to be built and the test dataset doesn't exist.
+
+        Returns
+        ----------
+        ReferenceProfile
+            The reference profile of the model.
+        '''
+        profile = self._profiles.get(entry.digest)
+        if profile is not None:
+            return profile
+
+        with self._lock:
+            profile = self._profiles.get(entry.digest)
+            if profile is None:
+                profile = self._load_or_build(entry, force=False)
+                self._profiles[entry.digest] = profile
+
+        return profile
+
+    def is_loaded(self, entry: ModelEntry) -> bool:
+        '''
+        Checks whether the profile of a model is in memory, without loading it.
+
+        Parameters
+        ----------
+        entry : ModelEntry
+            The model registry entry.
+
+        Returns
+        ----------
+        bool
+            True if the profile is in memory.
+        '''
+        return entry.digest in self._profiles
+
+    def refresh(self, entry: ModelEntry) -> ReferenceProfile:
+        '''
+        Rebuilds and persists the reference profile of a model.
+
+        Parameters
+        ----------
+        entry : ModelEntry
+            The model registry entry.
+
+        Returns
+        ----------
+        ReferenceProfile
+            The rebuilt reference profile.
+        '''
+        with self._lock:
+            profile = self._load_or_build(entry, force=True)
+            self._profiles[entry.digest] = profile
+
+        return profile
+
+    def preload(self, registry: ModelRegistry = MODEL_REGISTRY) -> List[str]:
+        '''
+        Loads the reference profile of every registered model. Models whose profile
+        can't be read or built, such as when the test dataset is missing, are skipped
+        with a warning.
+
+        Parameters
+        ----------
+        registry : ModelRegistry
+            The model registry.
+
+        Returns
+        ----------
+        List[str]
+            The model versions whose profile is loaded.
+        '''
+        loaded = []
+        for version in registry.versions():
+            try:
+                self.get(registry.get(version))
+                loaded.append(version)
+            except OSError as exception:
+                logger.warning('Reference profile of model version %s is not available: %s',
+                               version, exception)
+
+        return loaded
+
+    def _load_or_build(self, entry: ModelEntry, force: bool) -> ReferenceProfile:
+        '''Loads the persisted profile of a model, building it when needed.'''
+        path = self.path(entry)
+
+        if not force and os.path.exists(path):
+            return self._load(path)
+
+        profile = self._build(entry)
+        try:
+            save_reference_profile(profile, path)
+        except OSError as exception:
+            logger.warning('Could not persist the profile of model version %s, it is kept '
+                           'in memory only: %s', entry.version, exception)
+        else:
+            logger.info('Built profile of model version %s at %s.', entry.version, path)
+
+        return profile
+
+    def _build(self, entry: ModelEntry) -> ReferenceProfile:
+        '''Builds the profile of a model.'''
+        return build_reference_profile(entry.scorer, entry.digest)
+
+    def _load(self, path: str) -> ReferenceProfile:
+        '''Loads a persisted profile.'''
+        return load_reference_profile(path)
+
+
+REFERENCE_STORE = ReferenceStore()
+
+
+if __name__ == '__main__':
+    # The feature profiles are kept by a subclass of ReferenceStore defined in
+    # api.endpoints.features, which imports this module.
+    from api.endpoints.features import FEATURE_PROFILE_STORE
+
+    parser = argparse.ArgumentParser(
+        description='Converts the test dataset and builds the reference and feature '
+                    'profiles of every model in the models directory.')
+    parser.add_argument('--force', action='store_true',
+                        help='rebuild the profiles that already exist')
+    arguments = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    logger.info('Converted the test dataset to %s.', convert_test_data())
+
+    for model_version in MODEL_REGISTRY.preload():
+        model_entry = MODEL_REGISTRY.get(model_version)
+        for profile_store in (REFERENCE_STORE, FEATURE_PROFILE_STORE):
+            if arguments.force:
+                profile_store.refresh(model_entry)
+            else:
+                profile_store.get(model_entry)
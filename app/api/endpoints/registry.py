@@ -0,0 +1,346 @@
+'''
+Module that keeps the pre-trained models in memory.
+
+The registry loads every model pickle found in the models directory once, hands out
+the same shared instance to every request and hot swaps a model when its pickle file
+changes on disk. A pickle added to the directory later is registered when its version
+is first requested. Each pickle is registered under its file name without the extension,
+so `./models/model.pkl` is the model version `model`.
+
+The model instances handed out by the registry are shared between requests and must
+be treated as read-only. Each model is compiled into a NumPy scorer when it is loaded
+(see `api.endpoints.compiled`), which `get_model` hands out in its place.
+
+Classes:
+----------
+- ModelEntry:
+    A loaded model together with the metadata of the file it was loaded from.
+
+- ModelRegistry:
+    Thread-safe in-process registry of versioned pre-trained models.
+
+Attributes:
+----------
+- MODEL_REGISTRY: ModelRegistry
+    The registry shared by the whole application.
+'''
+
+import glob
+import hashlib
+import logging
+import os
+import pickle
+import threading
+import time
+from typing import Dict, List, NamedTuple, Optional
+
+from api.settings import MODELS_DIR, DEFAULT_MODEL_VERSION, MODEL_RELOAD_INTERVAL
+from api.endpoints.metrics import stage
+from api.endpoints.compiled import compile_scorer
+
+
+logger = logging.getLogger(__name__)
+
+
+class ModelEntry(NamedTuple):
+    '''
+    A loaded model together with the metadata of the file it was loaded from.
+
+    Attributes:
+        version (str): The model version name.
+        path (str): The path to the pickle file.
+        model (object): The unpickled model.
+        mtime_ns (int): The modification time of the file when it was loaded.
+        size (int): The size in bytes of the file when it was loaded.
+        digest (str): The SHA-256 hex digest of the file contents.
+        scorer (object): The compiled scorer of the model, or the model itself when it
+            can't be compiled. Scores records like the model with `predict_proba`.
+    '''
+    version: str
+    path: str
+    model: object
+    mtime_ns: int
+    size: int
+    digest: str
+    scorer: object
+
+
+def load_model_entry(version: str, path: str) -> ModelEntry:
+    '''
+    Reads and unpickles a model file.
+
+    Parameters
+    ----------
+    version : str
+        The model version name.
+    path : str
+        The path to the pickle file containing the pre-trained model.
+
+    Returns
+    -------
+    ModelEntry
+        The loaded model and the metadata of its file.
+    '''
+    stat = os.stat(path)
+    with open(path, 'rb') as file:
+        content = file.read()
+    model = pickle.loads(content)
+
+    return ModelEntry(
+        version=version,
+        path=path,
+        model=model,
+        mtime_ns=stat.st_mtime_ns,
+        size=stat.st_size,
+        digest=hashlib.sha256(content).hexdigest(),
+        scorer=compile_scorer(model, version)
+    )
+
+
+class ModelRegistry:
+    '''
+    Thread-safe in-process registry of versioned pre-trained models.
+
+    Models are unpickled once and kept in memory. Every `get` call checks, at most once
+    per `reload_interval` seconds, whether the model file changed on disk (modification
+    time or size) and, if its contents changed, loads the new pickle and swaps it in
+    atomically. Requests already holding the previous instance keep using it. A version
+    that isn't registered makes the registry scan the models directory again for new
+    pickles, at most once per `reload_interval` seconds.
+
+    Parameters
+    ----------
+    models_dir : str
+        The directory scanned for `<version>.pkl` files.
+    default_version : str
+        The model version used when no version is requested.
+    reload_interval : float
+        Minimum number of seconds between two checks of a model file.
+    '''
+
+    def __init__(self, models_dir: str = MODELS_DIR,
+                 default_version: str = DEFAULT_MODEL_VERSION,
+                 reload_interval: float = MODEL_RELOAD_INTERVAL):
+        self.models_dir = models_dir
+        self.default_version = default_version
+        self.reload_interval = reload_interval
+        self._entries: Dict[str, ModelEntry] = {}
+        self._last_checks: Dict[str, float] = {}
+        self._last_scan = float('-inf')
+        self._lock = threading.Lock()
+
+    def preload(self) -> List[str]:
+        '''
+        Loads every model pickle found in the models directory.
+
+        Returns
+        -------
+        List[str]
+            The registered model versions.
+        '''
+        self._last_scan = time.monotonic()
+
+        for path in sorted(glob.glob(os.path.join(self.models_dir, '*.pkl'))):
+            version = os.path.splitext(os.path.basename(path))[0]
+            self.register(version, path)
+
+        return self.versions()
+
+    def register(self, version: str, path: str) -> ModelEntry:
+        '''
+        Loads a model pickle and registers it under the given version,
+        replacing any model previously registered under that version.
+
+        Parameters
+        ----------
+        version : str
+            The model version name.
+        path : str
+            The path to the pickle file containing the pre-trained model.
+
+        Returns
+        -------
+        ModelEntry
+            The registered model entry.
+        '''
+        entry = load_model_entry(version, path)
+
+        with self._lock:
+            self._entries[version] = entry
+            self._last_checks[version] = time.monotonic()
+
+        logger.info('Loaded model version %s from %s (sha256 %s).',
+                    version, path, entry.digest[:12])
+
+        return entry
+
+    def versions(self) -> List[str]:
+        '''
+        Returns the registered model versions.
+
+        Returns
+        -------
+        List[str]
+            The sorted list of registered model versions.
+        '''
+        return sorted(self._entries)
+
+    def entries(self) -> List[ModelEntry]:
+        '''
+        Returns the registered entries, without loading or reloading any model.
+
+        Returns
+        -------
+        List[ModelEntry]
+            The registered model entries, sorted by version.
+        '''
+        with self._lock:
+            return [self._entries[version] for version in sorted(self._entries)]
+
+    def has_version(self, version: Optional[str]) -> bool:
+        '''
+        Checks whether a model version is available.
+
+        Parameters
+        ----------
+        version : str, optional
+            The model version name. None stands for the default version.
+
+        Returns
+        -------
+        bool
+            True if the version is registered.
+        '''
+        version = version or self.default_version
+        self._ensure_loaded(version)
+
+        return version in self._entries
+
+    @stage('load_model')
+    def get(self, version: Optional[str] = None) -> ModelEntry:
+        '''
+        Returns the registered entry of a model version, reloading it first
+        if its pickle file changed on disk.
+
+        Parameters
+        ----------
+        version : str, optional
+            The model version name. None stands for the default version.
+
+        Raises
+        ----------
+        KeyError
+            If the model version is not registered.
+
+        Returns
+        -------
+        ModelEntry
+            The model entry.
+        '''
+        version = version or self.default_version
+        self._ensure_loaded(version)
+        entry = self._entries[version]
+
+        now = time.monotonic()
+        if now - self._last_checks.get(version, 0.0) >= self.reload_interval:
+            entry = self._refresh(entry, now)
+
+        return entry
+
+    def get_model(self, version: Optional[str] = None) -> object:
+        '''
+        Returns the shared scorer of a model version: its compiled scorer, or the model
+        itself when it can't be compiled.
+
+        Parameters
+        ----------
+        version : str, optional
+            The model version name. None stands for the default version.
+
+        Raises
+        ----------
+        KeyError
+            If the model version is not registered.
+
+        Returns
+        -------
+        object
+            The scorer of the pre-trained model, with a `predict_proba` method.
+        '''
+        return self.get(version).scorer
+
+    def _ensure_loaded(self, version: str):
+        '''
+        Loads the models directory when nothing has been registered yet, and scans it
+        for new pickles when the version isn't registered.
+        '''
+        if not self._entries:
+            with self._lock:
+                if self._entries:
+                    return
+            self.preload()
+        elif version not in self._entries:
+            self._scan(time.monotonic())
+
+    def _scan(self, now: float):
+        '''Registers the pickles added to the models directory, at most once per interval.'''
+        with self._lock:
+            if now - self._last_scan < self.reload_interval:
+                return
+            self._last_scan = now
+
+        for path in sorted(glob.glob(os.path.join(self.models_dir, '*.pkl'))):
+            version = os.path.splitext(os.path.basename(path))[0]
+            if version in self._entries:
+                continue
+
+            try:
+                self.register(version, path)
+            except Exception:  # pylint: disable=broad-except
+                logger.exception('Could not load model version %s from %s.', version, path)
+
+    def _refresh(self, entry: ModelEntry, now: float) -> ModelEntry:
+        '''Swaps in a new model instance if the file of the entry changed.'''
+        with self._lock:
+            current = self._entries[entry.version]
+            if now - self._last_checks.get(entry.version, 0.0) < self.reload_interval:
+                return current
+            self._last_checks[entry.version] = now
+
+        try:
+            stat = os.stat(current.path)
+            if (stat.st_mtime_ns, stat.st_size) == (current.mtime_ns, current.size):
+                return current
+
+            with open(current.path, 'rb') as file:
+                content = file.read()
+            digest = hashlib.sha256(content).hexdigest()
+
+            if digest == current.digest:
+                refreshed = current._replace(
+                    mtime_ns=stat.st_mtime_ns, size=stat.st_size)
+            else:
+                model = pickle.loads(content)
+                refreshed = ModelEntry(
+                    version=current.version,
+                    path=current.path,
+                    model=model,
+                    mtime_ns=stat.st_mtime_ns,
+                    size=stat.st_size,
+                    digest=digest,
+                    scorer=compile_scorer(model, current.version)
+                )
+                logger.info('Reloaded model version %s from %s (sha256 %s).',
+                            current.version, current.path, digest[:12])
+        except Exception:  # pylint: disable=broad-except
+            logger.exception('Could not reload model version %s, keeping the loaded one.',
+                             current.version)
+            return current
+
+        with self._lock:
+            self._entries[current.version] = refreshed
+
+        return refreshed
+
+
+MODEL_REGISTRY = ModelRegistry()
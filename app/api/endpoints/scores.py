@@ -0,0 +1,347 @@
+'''
+Module that caches the predicted scores of the /performance records.
+
+Upstream systems often send overlapping windows of records (a monthly report repeats
+the records of the weekly ones), which would be scored again by every request. Each
+record is keyed by a 64-bit hash of its feature values, every column but the
+RECORD_FIELDS, computed in one vectorized pass over the batch by
+`pandas.util.hash_pandas_object`. The hash is keyed on the digest of the model file
+and on the feature names, so the scores of another model, or of a model file changed
+on disk, are never mixed up. A batch is first deduplicated, then its distinct records
+are looked up, and only the records missing from the cache are sent to the model, in a
+single `predict_proba` call. The scores are kept in memory, up to SCORE_CACHE_SIZE of
+them, and evicted in least recently used order. With the process compute executor,
+each worker process keeps a cache of its own.
+
+The records a request sends to the model go through the micro-batcher. The first
+scoring call waits SCORE_BATCH_WAIT seconds for the calls of concurrent requests of the
+same model, or until SCORE_BATCH_MAX_ROWS records are gathered, then scores them all in
+one `predict_proba` call and hands each request the scores of its records. This
+amortizes the fixed cost of scikit-learn's `predict_proba` over several requests, at
+the cost of up to SCORE_BATCH_WAIT seconds of latency. The compiled scorers (see
+`api.endpoints.compiled`) are not batched: their fixed cost is lower than the cost of
+concatenating the records. The batches only gather the requests computed by the threads
+of one process, so there is no batching with the process pool executor, whose workers
+compute one request at a time, nor with a single worker thread.
+
+Classes:
+----------
+- ScoreCacheStatistics:
+    The hit and miss counts of the score cache.
+
+- ScoreCache:
+    Thread-safe LRU cache of the predicted scores of records.
+
+- ScoreBatcher:
+    Coalesces the scoring calls of concurrent requests into micro-batches.
+
+Functions:
+----------
+- concat_records(frames: Sequence[pd.DataFrame]) -> pd.DataFrame:
+    Concatenates DataFrames of records with the same columns.
+
+Attributes:
+----------
+- SCORE_CACHE: ScoreCache
+    The score cache shared by the whole application.
+
+- SCORE_BATCHER: ScoreBatcher
+    The micro-batcher shared by the whole application.
+'''
+
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from api.settings import (
+    SCORE_CACHE_SIZE, SCORE_BATCH_WAIT, SCORE_BATCH_MAX_ROWS, EXECUTOR_KIND,
+    EXECUTOR_MAX_WORKERS)
+from api.endpoints.registry import ModelEntry
+from api.endpoints.compiled import CompiledScorer
+from api.endpoints.metrics import stage
+from api.endpoints.utils import RECORD_FIELDS
+
+
+class ScoreCacheStatistics(NamedTuple):
+    '''
+    The hit and miss counts of the score cache.
+
+    Attributes:
+        hits (int): The distinct records of a batch whose score was cached.
+        misses (int): The distinct records of a batch scored by the model.
+        duplicates (int): The records that repeat another record of the same batch.
+        entries (int): The number of cached scores.
+        max_entries (int): The maximum number of cached scores.
+    '''
+    hits: int
+    misses: int
+    duplicates: int
+    entries: int
+    max_entries: int
+
+
+class ScoreCache:
+    '''
+    Thread-safe LRU cache of the predicted scores of records.
+
+    Parameters
+    ----------
+    max_entries : int
+        The maximum number of cached scores. 0 disables the cache.
+    '''
+
+    def __init__(self, max_entries: int = SCORE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._scores: 'OrderedDict[int, float]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._duplicates = 0
+
+    @property
+    def enabled(self) -> bool:
+        '''Whether the cache keeps any score.'''
+        return self.max_entries > 0
+
+    @staticmethod
+    def record_keys(records: pd.DataFrame, model_entry: ModelEntry) -> np.ndarray:
+        '''
+        Computes the cache key of each record: a hash of its feature values, keyed on
+        the model file digest and the feature names.
+
+        Parameters
+        ----------
+        records : pd.DataFrame
+            The input records.
+        model_entry : ModelEntry
+            The model registry entry.
+
+        Returns
+        ----------
+        np.ndarray
+            The uint64 key of each record.
+        '''
+        features = sorted(column for column in records.columns if column not in RECORD_FIELDS)
+        hash_key = hashlib.sha256(
+            '\0'.join([model_entry.digest, *features]).encode()).hexdigest()[:16]
+
+        return pd.util.hash_pandas_object(
+            records[features], index=False, hash_key=hash_key).to_numpy()
+
+    def predict(self, records: pd.DataFrame, model_entry: ModelEntry) -> np.ndarray:
+        '''
+        Returns the predicted score of each record, scoring only the distinct records
+        that are not cached, in one call of the model.
+
+        Parameters
+        ----------
+        records : pd.DataFrame
+            The input records. Must have a 'TARGET' column.
+        model_entry : ModelEntry
+            The model registry entry.
+
+        Returns
+        ----------
+        np.ndarray
+            The predicted probability of the positive class for each record.
+        '''
+        x_input = records.drop(['TARGET'], axis=1)
+
+        if not self.enabled:
+            with stage('predict'):
+                return SCORE_BATCHER.predict(model_entry.scorer, x_input)
+
+        with stage('score_cache'):
+            keys, first_rows, inverse = np.unique(
+                self.record_keys(records, model_entry), return_index=True, return_inverse=True)
+            scores = np.empty(len(keys))
+
+            with self._lock:
+                missing = np.zeros(len(keys), dtype=bool)
+                for index, key in enumerate(keys.tolist()):
+                    score = self._scores.get(key)
+                    if score is None:
+                        missing[index] = True
+                    else:
+                        self._scores.move_to_end(key)
+                        scores[index] = score
+
+                self._duplicates += len(records) - len(keys)
+                self._misses += int(missing.sum())
+                self._hits += len(keys) - int(missing.sum())
+
+        if missing.any():
+            with stage('predict'):
+                scores[missing] = SCORE_BATCHER.predict(
+                    model_entry.scorer, x_input.iloc[first_rows[missing]])
+
+            with stage('score_cache'), self._lock:
+                self._scores.update(zip(keys[missing].tolist(), scores[missing].tolist()))
+                while len(self._scores) > self.max_entries:
+                    self._scores.popitem(last=False)
+
+        return scores[inverse]
+
+    def statistics(self) -> ScoreCacheStatistics:
+        '''
+        Returns the hit and miss counts of the cache.
+
+        Returns
+        ----------
+        ScoreCacheStatistics
+            The counts since the cache was created.
+        '''
+        with self._lock:
+            return ScoreCacheStatistics(
+                self._hits, self._misses, self._duplicates, len(self._scores), self.max_entries)
+
+
+def concat_records(frames: Sequence[pd.DataFrame]) -> pd.DataFrame:
+    '''
+    Concatenates DataFrames of records with the same columns. The categorical columns
+    are concatenated as codes of the union of their categories, where `pd.concat` would
+    convert them to objects when their categories differ.
+
+    Parameters
+    ----------
+    frames : Sequence[pd.DataFrame]
+        The records.
+
+    Returns
+    ----------
+    pd.DataFrame
+        The records of every DataFrame, in order, with a new index.
+    '''
+    columns = {}
+
+    for name in frames[0].columns:
+        arrays = [frame[name].array for frame in frames]
+
+        if all(isinstance(array, pd.Categorical) for array in arrays):
+            categories: Dict[object, int] = {}
+            codes = []
+            for array in arrays:
+                # The missing values have the code -1, so they take the last index.
+                indexer = [categories.setdefault(category, len(categories))
+                           for category in array.categories.tolist()]
+                codes.append(np.array(indexer + [-1], dtype=np.int64)[array.codes])
+            columns[name] = pd.Categorical.from_codes(
+                np.concatenate(codes), dtype=pd.CategoricalDtype(list(categories)))
+        else:
+            columns[name] = np.concatenate([np.asarray(array) for array in arrays])
+
+    return pd.DataFrame(columns, copy=False)
+
+
+class _ScoreBatch:
+    '''
+    The records of the requests gathered in a micro-batch and their scores.
+    '''
+
+    def __init__(self, scorer: object):
+        self.scorer = scorer
+        self.frames: List[pd.DataFrame] = []
+        self.rows = 0
+        self.scores: Optional[np.ndarray] = None
+        self.failed = False
+        self.done = threading.Event()
+
+
+class ScoreBatcher:
+    '''
+    Coalesces the scoring calls of concurrent requests into micro-batches scored by
+    one `predict_proba` call.
+
+    Parameters
+    ----------
+    max_wait : float
+        The seconds the first call of a batch waits for the other calls. 0 disables
+        the micro-batching.
+    max_rows : int
+        The number of records that closes a batch before its wait ends.
+    '''
+
+    def __init__(self, max_wait: float = SCORE_BATCH_WAIT, max_rows: int = SCORE_BATCH_MAX_ROWS):
+        self.max_wait = max_wait
+        self.max_rows = max_rows
+        self._batches: Dict[Tuple[int, Tuple[str, ...]], _ScoreBatch] = {}
+        self._lock = threading.Lock()
+        self._closed = threading.Condition(self._lock)
+
+    @property
+    def enabled(self) -> bool:
+        '''Whether the scoring calls are batched.'''
+        return self.max_wait > 0
+
+    def predict(self, scorer: object, x_input: pd.DataFrame) -> np.ndarray:
+        '''
+        Scores records together with the records of the concurrent calls for the same
+        scorer and columns. When the batch fails, the records are scored alone, so a
+        request only fails on its own records.
+
+        Parameters
+        ----------
+        scorer : object
+            The scorer of the model, with a `predict_proba` method.
+        x_input : pd.DataFrame
+            The input records.
+
+        Returns
+        ----------
+        np.ndarray
+            The predicted probability of the positive class for each record.
+        '''
+        if not self.enabled or isinstance(scorer, CompiledScorer) \
+                or len(x_input) >= self.max_rows:
+            return scorer.predict_proba(x_input)[:, 1]
+
+        key = (id(scorer), tuple(x_input.columns))
+
+        with stage('batch_wait'):
+            with self._lock:
+                batch = self._batches.get(key)
+                leader = batch is None
+                if leader:
+                    batch = self._batches[key] = _ScoreBatch(scorer)
+                offset = batch.rows
+                batch.frames.append(x_input)
+                batch.rows += len(x_input)
+                if batch.rows >= self.max_rows:
+                    del self._batches[key]
+                    self._closed.notify_all()
+
+                if leader:
+                    self._closed.wait_for(lambda: self._batches.get(key) is not batch,
+                                          timeout=self.max_wait)
+                    if self._batches.get(key) is batch:
+                        del self._batches[key]
+
+            if not leader:
+                batch.done.wait()
+
+        if leader:
+            try:
+                frames = batch.frames
+                batch.scores = scorer.predict_proba(
+                    frames[0] if len(frames) == 1 else concat_records(frames))[:, 1]
+            except Exception:  # pylint: disable=broad-except
+                batch.failed = True
+            finally:
+                batch.done.set()
+
+        if batch.failed:
+            return scorer.predict_proba(x_input)[:, 1]
+
+        return batch.scores[offset:offset + len(x_input)]
+
+
+SCORE_CACHE = ScoreCache()
+
+# A worker process of the process pool, or a single worker thread, computes one request
+# at a time: the first call of a batch would always wait alone.
+SCORE_BATCHER = ScoreBatcher(
+    SCORE_BATCH_WAIT if EXECUTOR_KIND == 'thread' and EXECUTOR_MAX_WORKERS > 1 else 0)
@@ -0,0 +1,379 @@
+'''
+Module that keeps the accumulating sessions of the /performance endpoint.
+
+A performance session accumulates labelled batches sent over time, so that the
+running AUC-ROC and volumetry of all of them can be read at any time without sending
+them again. Each batch is scored in the compute executor and reduced to a
+`PerformanceSummary`: the counts of positive and negative records by distinct score
+(see `api.endpoints.auc`) and the count of records by date. Appending a batch merges
+its summary into the session, so its cost doesn't depend on the records already
+appended.
+
+Sessions are kept in memory until they stay idle for PERFORMANCE_SESSION_TTL seconds
+and, when a session directory is set, persisted as JSON files that survive restarts.
+
+Classes:
+----------
+- PerformanceSummary:
+    The mergeable summary of a batch of labelled records.
+
+- PerformanceSession:
+    An accumulating session of labelled batches.
+
+- SessionStore:
+    Thread-safe store of performance sessions with an optional on-disk backing.
+
+Functions:
+----------
+- summarize_records(records: pd.DataFrame, scores: np.ndarray) -> PerformanceSummary:
+    Summarizes a batch of scored labelled records.
+
+Attributes:
+----------
+- PERFORMANCE_SESSIONS: SessionStore
+    The session store shared by the whole application.
+'''
+
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from typing import Dict, NamedTuple, Optional
+
+import numpy as np
+import pandas as pd
+
+from api.settings import PERFORMANCE_SESSION_TTL, PERFORMANCE_SESSION_DIR
+from api.endpoints.auc import AucSummary
+from api.endpoints.utils import count_records_by_date, count_by_period, format_timestamp
+from api.endpoints.metrics import stage
+
+
+logger = logging.getLogger(__name__)
+
+
+class PerformanceSummary(NamedTuple):
+    '''
+    The mergeable summary of a batch of labelled records.
+
+    Attributes:
+        auc (AucSummary): The counts of positive and negative records by distinct score.
+        counts_by_date (pd.Series): The count of records by date.
+    '''
+    auc: AucSummary
+    counts_by_date: pd.Series
+
+
+def summarize_records(records: pd.DataFrame, scores: np.ndarray) -> PerformanceSummary:
+    '''
+    Summarizes a batch of scored labelled records.
+
+    Parameters
+    ----------
+    records : pd.DataFrame
+        The input records. Must have a 'TARGET' column.
+    scores : np.ndarray
+        The predicted scores of the records.
+
+    Raises
+    ----------
+    ValueError
+        If a 'TARGET' is neither 0 nor 1.
+
+    Returns
+    ----------
+    PerformanceSummary
+        The summary of the batch.
+    '''
+    with stage('summarize'):
+        return PerformanceSummary(
+            auc=AucSummary.from_scores(scores, records['TARGET'].to_numpy()),
+            counts_by_date=count_records_by_date(records)
+        )
+
+
+class PerformanceSession:
+    '''
+    An accumulating session of labelled batches.
+
+    Parameters
+    ----------
+    session_id : str
+        The id of the session.
+    model_version : str
+        The version of the model that scores the batches.
+    '''
+
+    def __init__(self, session_id: str, model_version: str):
+        self.session_id = session_id
+        self.model_version = model_version
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+        self.batches = 0
+        self.auc = AucSummary()
+        self.counts_by_date = pd.Series([], index=pd.DatetimeIndex([]), dtype='int64')
+
+    @property
+    def records(self) -> int:
+        '''The number of appended records.'''
+        return self.auc.positive_count + self.auc.negative_count
+
+    def append(self, summary: PerformanceSummary):
+        '''
+        Merges the summary of a batch into the session.
+
+        Parameters
+        ----------
+        summary : PerformanceSummary
+            The summary of the batch.
+        '''
+        self.auc.merge(summary.auc)
+        self.counts_by_date = self.counts_by_date.add(
+            summary.counts_by_date, fill_value=0).astype('int64')
+        self.batches += 1
+        self.updated_at = time.time()
+
+    def describe(self, granularity: str = 'month') -> Dict[str, object]:
+        '''
+        Describes the running metrics of the session.
+
+        Parameters
+        ----------
+        granularity : str
+            The volumetry period: 'day', 'week' or 'month'.
+
+        Returns
+        ----------
+        Dict[str, object]
+            The volumetry by period and the AUC-ROC of every appended record, which is
+            None until there are both positive and negative records, with the session
+            metadata.
+        '''
+        return {
+            'session_id': self.session_id,
+            'model_version': self.model_version,
+            'batches': self.batches,
+            'records': self.records,
+            'created_at': format_timestamp(self.created_at),
+            'updated_at': format_timestamp(self.updated_at),
+            'volumetry': count_by_period(self.counts_by_date, granularity),
+            'auc_roc': self.auc.auc()
+        }
+
+    def to_dict(self) -> Dict[str, object]:
+        '''
+        Converts the session state to a JSON serializable dictionary.
+
+        Returns
+        ----------
+        Dict[str, object]
+            The session state.
+        '''
+        return {
+            'session_id': self.session_id,
+            'model_version': self.model_version,
+            'created_at': self.created_at,
+            'updated_at': self.updated_at,
+            'batches': self.batches,
+            'auc': self.auc.to_dict(),
+            'counts_by_date': {
+                date.strftime('%Y-%m-%d'): int(count) for date, count in self.counts_by_date.items()
+            }
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, object]) -> 'PerformanceSession':
+        '''
+        Restores a session converted by `to_dict`.
+
+        Parameters
+        ----------
+        data : Dict[str, object]
+            The dictionary returned by `to_dict`.
+
+        Returns
+        ----------
+        PerformanceSession
+            The restored session.
+        '''
+        session = cls(data['session_id'], data['model_version'])
+        session.created_at = data['created_at']
+        session.updated_at = data['updated_at']
+        session.batches = data['batches']
+        session.auc = AucSummary.from_dict(data['auc'])
+        session.counts_by_date = pd.Series(
+            list(data['counts_by_date'].values()),
+            index=pd.to_datetime(list(data['counts_by_date']), format='%Y-%m-%d'),
+            dtype='int64')
+
+        return session
+
+
+class SessionStore:
+    '''
+    Thread-safe store of performance sessions with an optional on-disk backing.
+
+    Parameters
+    ----------
+    ttl : float
+        The number of seconds an idle session is kept.
+    session_dir : str
+        The directory where the sessions are persisted. An empty string keeps them
+        in memory only.
+    '''
+
+    def __init__(self, ttl: float = PERFORMANCE_SESSION_TTL,
+                 session_dir: str = PERFORMANCE_SESSION_DIR):
+        self.ttl = ttl
+        self.session_dir = session_dir
+        self._sessions: Dict[str, PerformanceSession] = {}
+        self._lock = threading.Lock()
+
+    def create(self, model_version: str) -> PerformanceSession:
+        '''
+        Opens a new session.
+
+        Parameters
+        ----------
+        model_version : str
+            The version of the model that scores the batches of the session.
+
+        Returns
+        ----------
+        PerformanceSession
+            The new session.
+        '''
+        session = PerformanceSession(uuid.uuid4().hex, model_version)
+
+        with self._lock:
+            self._purge_expired()
+            self._sessions[session.session_id] = session
+            self._write(session)
+
+        return session
+
+    def get(self, session_id: str) -> Optional[PerformanceSession]:
+        '''
+        Returns a session by its id, from memory or from the session directory.
+
+        Parameters
+        ----------
+        session_id : str
+            The id of the session.
+
+        Returns
+        ----------
+        PerformanceSession, optional
+            The session, or None when it doesn't exist or has expired.
+        '''
+        with self._lock:
+            self._purge_expired()
+            session = self._sessions.get(session_id)
+
+            if session is None:
+                session = self._read(session_id)
+                if session is not None and self._is_expired(session):
+                    self._remove(session_id)
+                    session = None
+                elif session is not None:
+                    self._sessions[session_id] = session
+
+        return session
+
+    def append(self, session: PerformanceSession, summary: PerformanceSummary) -> bool:
+        '''
+        Merges the summary of a batch into a session and persists it. The session may
+        have been closed or purged while the batch was summarized, in which case it is
+        left alone so that its file isn't written again.
+
+        Parameters
+        ----------
+        session : PerformanceSession
+            The session.
+        summary : PerformanceSummary
+            The summary of the batch.
+
+        Returns
+        ----------
+        bool
+            Whether the session still exists and the summary was merged into it.
+        '''
+        with self._lock:
+            if self._sessions.get(session.session_id) is not session:
+                return False
+
+            session.append(summary)
+            self._write(session)
+
+        return True
+
+    def delete(self, session_id: str):
+        '''
+        Closes a session.
+
+        Parameters
+        ----------
+        session_id : str
+            The id of the session.
+        '''
+        with self._lock:
+            self._sessions.pop(session_id, None)
+            self._remove(session_id)
+
+    def _is_expired(self, session: PerformanceSession) -> bool:
+        '''Whether a session stayed idle for longer than the TTL.'''
+        return session.updated_at < time.time() - self.ttl
+
+    def _purge_expired(self):
+        '''Forgets the sessions that stayed idle for longer than the TTL. Holds the lock.'''
+        for session_id in [
+                session_id for session_id, session in self._sessions.items()
+                if self._is_expired(session)]:
+            del self._sessions[session_id]
+            self._remove(session_id)
+
+    def _path(self, session_id: str) -> str:
+        '''Returns the path of a persisted session.'''
+        return os.path.join(self.session_dir, f'{session_id}.json')
+
+    def _read(self, session_id: str) -> Optional[PerformanceSession]:
+        '''Reads a persisted session, if any.'''
+        if not self.session_dir or not session_id.isalnum():
+            return None
+
+        try:
+            with open(self._path(session_id), 'r', encoding='utf-8') as file:
+                return PerformanceSession.from_dict(json.load(file))
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _write(self, session: PerformanceSession):
+        '''Persists a session, when a session directory is set.'''
+        if not self.session_dir:
+            return
+
+        try:
+            os.makedirs(self.session_dir, exist_ok=True)
+            path = self._path(session.session_id)
+            temporary_path = f'{path}.{os.getpid()}.tmp'
+            with open(temporary_path, 'w', encoding='utf-8') as file:
+                json.dump(session.to_dict(), file)
+            os.replace(temporary_path, path)
+        except OSError as exception:
+            logger.warning('Could not persist the performance session %s: %s',
+                           session.session_id, exception)
+
+    def _remove(self, session_id: str):
+        '''Removes a persisted session, if any.'''
+        if not self.session_dir or not session_id.isalnum():
+            return
+
+        try:
+            os.remove(self._path(session_id))
+        except OSError:
+            pass
+
+
+PERFORMANCE_SESSIONS = SessionStore()
@@ -0,0 +1,290 @@
+'''
+Module that prepares the API to serve requests and reports how warm it is.
+
+Importing the API only pulls in what routing and decoding a request needs: the
+statistics libraries (scikit-learn metrics, SciPy) and the Parquet reader are imported
+by the functions that use them, and the jsonschema validator of the /performance body is
+only compiled to report an invalid body. The rest of the cold start happens when the
+application starts, in `Startup.run`, depending on STARTUP_MODE:
+
+- 'eager' loads every model and its reference and feature profiles, imports the
+    DEFERRED_MODULES, then runs a warm-up inference of each model on WARMUP_RECORDS
+    synthetic records, resampled from the sample body `./datasets/batch_records.json`.
+    The records go through the /performance computation, the adherence statistics and
+    the feature drift, so that the first call of the model and of the NumPy and pandas
+    code paths are paid before the first request. Behind AWS Lambda, this runs in the
+    init phase of the container.
+- 'lazy' loads nothing: each model and profile is loaded by the first request that needs
+    it, which keeps the start short when most containers serve few requests.
+
+`Startup.readiness` reports which components are warm, for the `/ready` endpoint.
+
+Classes:
+----------
+- Startup:
+    Startup of the API in a mode and the state of its components.
+
+Functions:
+----------
+- synthetic_records(size: int, seed: int) -> List[dict]:
+    Resamples the records of the sample body to a synthetic batch.
+
+- warm_up_model(entry: ModelEntry, records: List[dict], reference: ReferenceProfile,
+                feature_profile: FeatureProfile):
+    Runs a warm-up inference of a model on records.
+
+Attributes:
+----------
+- DEFERRED_MODULES: Tuple[str, ...]
+    The heavy modules imported on first use.
+
+- STARTUP: Startup
+    The startup of the application.
+'''
+
+import importlib
+import logging
+import sys
+import time
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+import orjson
+
+from api.settings import STARTUP_MODE, WARMUP_RECORDS
+from api.endpoints.registry import MODEL_REGISTRY, ModelEntry, ModelRegistry
+from api.endpoints.reference import REFERENCE_STORE, ReferenceProfile, ReferenceStore
+from api.endpoints.features import FEATURE_PROFILE_STORE, FeatureProfile, FeatureSummary
+from api.endpoints.adherence import ADHERENCE_STATISTICS, ScoreSummary
+from api.endpoints.performance import evaluate_performance, read_input_records
+from api.endpoints.metrics import collect_metrics
+from api.endpoints.executor import COMPUTE_EXECUTOR
+
+
+logger = logging.getLogger(__name__)
+
+STARTUP_MODES = ('eager', 'lazy')
+
+DEFERRED_MODULES = ('sklearn.metrics', 'scipy.stats', 'scipy.spatial.distance',
+                    'scipy.special', 'pyarrow.parquet')
+
+SAMPLE_BODY_PATH = './datasets/batch_records.json'
+
+
+def synthetic_records(size: int, seed: int = 0) -> List[dict]:
+    '''
+    Resamples the records of the sample body with replacement to a synthetic batch.
+
+    Parameters
+    ----------
+    size : int
+        The number of records.
+    seed : int
+        The seed of the random generator.
+
+    Raises
+    ----------
+    FileNotFoundError
+        If the sample body doesn't exist.
+
+    Returns
+    ----------
+    List[dict]
+        The synthetic records.
+    '''
+    with open(SAMPLE_BODY_PATH, 'rb') as file:
+        records = orjson.loads(file.read())
+
+    indices = np.random.default_rng(seed).integers(0, len(records), size)
+
+    return [records[index] for index in indices]
+
+
+def warm_up_model(entry: ModelEntry, records: List[dict], reference: ReferenceProfile,
+                  feature_profile: FeatureProfile):
+    '''
+    Runs a warm-up inference of a model on records: the /performance computation,
+    the adherence statistics against its reference profile and the drift of its
+    inputs against its feature profile.
+
+    Parameters
+    ----------
+    entry : ModelEntry
+        The model registry entry.
+    records : List[dict]
+        The records, as in a /performance body.
+    reference : ReferenceProfile
+        The reference profile of the model.
+    feature_profile : FeatureProfile
+        The feature profile of the model.
+    '''
+    body = orjson.dumps(records)
+    evaluate_performance(body, entry.version)
+
+    data_frame = read_input_records(body, 'json')
+    scores = entry.scorer.predict_proba(data_frame.drop(['TARGET'], axis=1))[:, 1]
+
+    summary = ScoreSummary.from_scores(scores)
+    for statistic in ADHERENCE_STATISTICS.values():
+        statistic(summary, reference)
+
+    feature_summary = FeatureSummary(feature_profile)
+    feature_summary.update(data_frame)
+    feature_summary.drift()
+
+
+class Startup:
+    '''
+    Startup of the API in a mode and the state of its components.
+
+    Parameters
+    ----------
+    mode : str
+        'eager' or 'lazy'.
+    warmup_records : int
+        The number of synthetic records of the warm-up inference, 0 disables it.
+    registry : ModelRegistry
+        The model registry.
+    reference_store : ReferenceStore
+        The store of the reference profiles.
+    feature_store : ReferenceStore
+        The store of the feature profiles.
+
+    Attributes:
+        started (bool): Whether the startup finished.
+        durations (Dict[str, float]): The duration in seconds of each startup step.
+        warmed_up (List[str]): The model versions that ran the warm-up inference.
+        warmup_error (str, optional): Why the warm-up inference failed, if it did.
+    '''
+
+    def __init__(self, mode: str = STARTUP_MODE, warmup_records: int = WARMUP_RECORDS,
+                 registry: ModelRegistry = MODEL_REGISTRY,
+                 reference_store: ReferenceStore = REFERENCE_STORE,
+                 feature_store: ReferenceStore = FEATURE_PROFILE_STORE):
+        self.mode = mode
+        self.warmup_records = warmup_records
+        self.registry = registry
+        self.reference_store = reference_store
+        self.feature_store = feature_store
+        self.started = False
+        self.durations: Dict[str, float] = {}
+        self.warmed_up: List[str] = []
+        self.warmup_error: Optional[str] = None
+
+    def run(self):
+        '''
+        Starts the API up: in the eager mode, loads the models and their profiles,
+        imports the deferred modules and runs the warm-up inference. A failed warm-up is
+        logged and reported, not raised.
+
+        Raises
+        ----------
+        ValueError
+            If the mode is not 'eager' or 'lazy'.
+        '''
+        if self.mode not in STARTUP_MODES:
+            raise ValueError(f'Invalid startup mode {self.mode!r}, must be one of {STARTUP_MODES}.')
+
+        if self.mode == 'eager':
+            self._timed('models', self.registry.preload)
+            self._timed('reference_profiles', lambda: self.reference_store.preload(self.registry))
+            self._timed('feature_profiles', lambda: self.feature_store.preload(self.registry))
+            self._timed('imports', self.import_modules)
+            if self.warmup_records > 0:
+                self._timed('warm_up', self.warm_up)
+
+        self.started = True
+        logger.info('Started up in %s mode in %.3f s.', self.mode, sum(self.durations.values()))
+
+    @staticmethod
+    def import_modules():
+        '''
+        Imports the deferred modules, some of which, such as the Parquet reader, only
+        the requests of some formats or statistics would import.
+        '''
+        for name in DEFERRED_MODULES:
+            importlib.import_module(name)
+
+    def warm_up(self):
+        '''
+        Runs the warm-up inference of every registered model. Its stages are measured
+        apart, so that they don't show in the metrics of the requests.
+        '''
+        try:
+            records = synthetic_records(self.warmup_records)
+            for entry in self.registry.entries():
+                collect_metrics(warm_up_model, entry, records, self.reference_store.get(entry),
+                                self.feature_store.get(entry))
+                self.warmed_up.append(entry.version)
+        except Exception as exception:  # pylint: disable=broad-except
+            logger.exception('The warm-up inference failed.')
+            self.warmup_error = f'{type(exception).__name__}: {exception}'
+
+    def readiness(self) -> Dict[str, object]:
+        '''
+        Reports whether the startup finished and which components are warm.
+
+        Returns
+        ----------
+        Dict[str, object]
+            Whether the API is ready, the startup mode, the kind of the compute executor
+            ('thread' or 'process') and, for each component, whether it is warm, the
+            model versions or modules it holds and its startup duration.
+            The models component also lists the versions scored by a compiled scorer.
+        '''
+        entries = self.registry.entries()
+        versions = [entry.version for entry in entries]
+
+        def profiles(store: ReferenceStore) -> List[str]:
+            return [entry.version for entry in entries if store.is_loaded(entry)]
+
+        reference_versions = profiles(self.reference_store)
+        feature_versions = profiles(self.feature_store)
+        modules = {name: name in sys.modules for name in DEFERRED_MODULES}
+        warm_up = {
+            'warm': bool(versions) and set(versions) <= set(self.warmed_up),
+            'versions': list(self.warmed_up),
+            'seconds': self.durations.get('warm_up')
+        }
+        if self.warmup_error is not None:
+            warm_up['error'] = self.warmup_error
+
+        return {
+            'ready': self.started,
+            'mode': self.mode,
+            'executor': COMPUTE_EXECUTOR.kind,
+            'components': {
+                'models': {
+                    'warm': bool(versions),
+                    'versions': versions,
+                    'compiled': [entry.version for entry in entries
+                                 if entry.scorer is not entry.model],
+                    'seconds': self.durations.get('models')
+                },
+                'reference_profiles': {
+                    'warm': bool(versions) and reference_versions == versions,
+                    'versions': reference_versions,
+                    'seconds': self.durations.get('reference_profiles')
+                },
+                'feature_profiles': {
+                    'warm': bool(versions) and feature_versions == versions,
+                    'versions': feature_versions,
+                    'seconds': self.durations.get('feature_profiles')
+                },
+                'warm_up': warm_up,
+                'imports': {
+                    'warm': all(modules.values()),
+                    'modules': modules,
+                    'seconds': self.durations.get('imports')
+                }
+            }
+        }
+
+    def _timed(self, step: str, function: Callable[[], object]):
+        '''Runs a startup step and records its duration.'''
+        start = time.perf_counter()
+        function()
+        self.durations[step] = time.perf_counter() - start
+
+
+STARTUP = Startup()
@@ -2,10 +2,15 @@
 The utils module contains utility functions for handling internal operations in
 the endpoints of a machine learning web service. 
 
+The statistics libraries (scikit-learn metrics, SciPy) and the Parquet reader are
+imported by the functions that use them rather than with the module, so that importing
+the API, a cold start of its container, doesn't pay for them (see `api.endpoints.startup`).
+
 Functions:
 ----------
 - get_pre_trained_model(path: str) -> object:
     Returns the pre-trained machine learning model loaded from the given path.
+    The endpoints use the in-memory models of `api.endpoints.registry` instead.
 
 - get_data(path: str) -> pd.DataFrame:
     Reads the CSV file from the given path and returns a Pandas dataframe.
@@ -13,44 +18,158 @@ Functions:
 - load_batch_records(path: str) -> pd.DataFrame:
     Load batch records data from a JSON file into a Pandas DataFrame.
 
+- input_dtypes(schema: dict, float32: bool) -> Dict[str, object]:
+    Derives the compact dtype of each model input from the JSON schema of the records.
+
+- decode_input_records(content: bytes) -> list:
+    Decodes the raw JSON body of a request, with the empty string values as null.
+
+- decode_ndjson_records(content: bytes) -> List[object]:
+    Decodes a block of complete lines of a newline-delimited JSON (NDJSON) body.
+
+- read_arrow_records(content: bytes) -> pd.DataFrame:
+    Reads the records of an Apache Arrow IPC body, in the stream or the file format.
+
+- read_parquet_records(content: bytes) -> pd.DataFrame:
+    Reads the records of a Parquet body.
+
 - format_input_records(body: List[dict]) -> pd.DataFrame:
     Formats the input records (dict) contained in a list as a Pandas DataFrame.
 
-- count_records_by_month(records: pd.DataFrame) -> Dict[str, int]:
-    Counts the number of records by month in a given DataFrame.
+- normalize_input_records(data_frame: pd.DataFrame,
+                          empty_strings: bool = True) -> pd.DataFrame:
+    Replaces the empty strings and the null values of the input records by NaN and
+    converts the model inputs to their compact dtype.
+
+- count_records_by_month(records: pd.DataFrame, granularity: str = 'month') -> Dict[str, int]:
+    Counts the number of records by month, or by another period, in a given DataFrame.
+
+- count_records_by_date(records: pd.DataFrame) -> pd.Series:
+    Counts the number of records by the calendar date of their 'REF_DATE'.
+
+- record_periods(records: pd.DataFrame,
+                 granularity: str = 'month') -> Tuple[np.ndarray, List[str]]:
+    Assigns each record to the period of its 'REF_DATE'.
+
+- count_by_period(counts_by_date: pd.Series, granularity: str = 'month') -> Dict[str, int]:
+    Sums counts by date into counts by period.
 
-- calculate_aucroc(input: pd.DataFrame) -> float:
+- calculate_aucroc(input: pd.DataFrame, model: object = None,
+                   scores: Optional[np.ndarray] = None) -> float:
     Calculates the area under the receiver operating characteristic (ROC) curve
     for the given input DataFrame.
 
+- format_timestamp(timestamp: Optional[float]) -> Optional[str]:
+    Formats seconds since the epoch as an ISO 8601 UTC string.
+
+- convert_test_data(csv_path: str, arrow_path: str) -> str:
+    Converts the gzip-compressed CSV test dataset into an uncompressed Arrow IPC file.
+
+- read_test_data(path: str) -> pd.DataFrame:
+    Reads the Arrow IPC test dataset through a memory map.
+
 - get_test_data() -> Tuple[pd.DataFrame, pd.Series]:
-    Reads and loads test data from a gzip-compressed CSV file
-    located at './datasets/credit_01/test.gz'.
+    Reads and loads test data from its memory-mapped Arrow copy, converting the
+    gzip-compressed CSV file located at './datasets/credit_01/test.gz' once.
+
+- score_data(path: str, model: object = None) -> np.ndarray:
+    Reads the CSV file from the given path and returns the predicted scores of its records.
+
+- score_data_chunks(path: str, model: object = None,
+                    chunk_size: int = 100000) -> Iterator[np.ndarray]:
+    Reads the CSV file from the given path in chunks of rows and yields the
+    predicted scores of each chunk.
+
+- score_histogram(scores: np.ndarray) -> np.ndarray:
+    Computes the density histogram of model scores used by the JS divergence.
+
+- ks_asymptotic_p_value(ks_statistic: float, n_scores: int, n_reference: int) -> float:
+    Computes the p-value of a two-sided two-sample KS statistic with Smirnov's
+    asymptotic distribution.
+
+- ks_2samp_sorted(scores: np.ndarray, sorted_reference: np.ndarray) -> Tuple[float, float]:
+    Computes the two-sample KS test against reference scores that are already sorted.
+
+- ks_2samp_counts(values: np.ndarray, counts: np.ndarray,
+                  sorted_reference: np.ndarray) -> Tuple[float, float]:
+    Computes the two-sample KS test between scores given as distinct values with
+    their counts and reference scores that are already sorted.
 
-- calculate_ks(path: str) -> Tuple[float, float]:
+- calculate_ks(path: str, model: object = None,
+               reference_scores: np.ndarray = None) -> Tuple[float, float]:
     Calculates the KS statistic and p-value for the predicted scores of a given
     model on the data in the path entry and test data.
 
-- calculate_js(path: str) -> float:
+- calculate_js(path: str, model: object = None,
+               reference_histogram: np.ndarray = None) -> float:
     Calculates the Jensen-Shannon (JS) distance between the probability
     distributions of a given model on the training and test data.
 '''
 
+import logging
+import os
 import pickle
-from collections import defaultdict
-from datetime import datetime
-from typing import Dict, Tuple, List
+import re
+from datetime import datetime, timezone
+from typing import Dict, Iterator, Optional, Tuple, List
+import orjson
 import pandas as pd
 import numpy as np
-from sklearn.metrics import roc_auc_score
-from scipy.stats import ks_2samp
-from scipy.spatial.distance import jensenshannon
+import pyarrow as pa
 
+from api.settings import (
+    TEST_DATA_PATH, TEST_DATA_ARROW_PATH, INPUT_FLOAT32, INPUT_CATEGORICAL_MIN_RECORDS)
+from api.endpoints.schemas.performance_body import BODY_SCHEMA
+from api.endpoints.registry import MODEL_REGISTRY
+from api.endpoints.exceptions import InvalidRequestError
+from api.endpoints.metrics import stage
 
+
+logger = logging.getLogger(__name__)
+
+# Period frequency and key format of each granularity of count_records_by_month.
+VOLUMETRY_GRANULARITIES = {
+    'day': ('D', '%Y-%m-%d'),
+    'week': ('W', '%G-W%V'),
+    'month': ('M', '%Y-%m')
+}
+
+# Input format of each Content-Type accepted for the input records.
+INPUT_FORMATS = {
+    'application/json': 'json',
+    'application/x-ndjson': 'ndjson',
+    'application/ndjson': 'ndjson',
+    'application/vnd.apache.arrow.stream': 'arrow',
+    'application/vnd.apache.arrow.file': 'arrow',
+    'application/vnd.apache.parquet': 'parquet',
+    'application/x-parquet': 'parquet'
+}
+
+# Magic bytes that open an Arrow IPC file, as opposed to an Arrow IPC stream.
+ARROW_FILE_MAGIC = b'ARROW1'
+
+# Empty string object values in raw JSON. A `""` right after a colon can only be a value:
+# inside a JSON string, quotes are escaped.
+EMPTY_STRING_VALUE = re.compile(rb':(\s*)""')
+
+# Number of equal-width score bins over [0, 1] used by the JS divergence.
+HISTOGRAM_BINS = 20
+
+# Largest sample size for which scipy's ks_2samp computes the exact p-value.
+KS_EXACT_MAX_SIZE = 10000
+
+# Fields of the records that are not model inputs, kept in their own dtype.
+RECORD_FIELDS = ('REF_DATE', 'TARGET')
+
+
+@stage('load_model')
 def get_pre_trained_model(path: str = './models/model.pkl') -> object:
     '''
     Returns the pre-trained machine learning model loaded from the given path.
 
+    The model is unpickled on every call. Use `MODEL_REGISTRY` from
+    `api.endpoints.registry` to get the shared in-memory instance.
+
     Parameters
     ----------
     path : str
@@ -81,9 +200,7 @@ def get_data(path: str) -> pd.DataFrame:
     pd.DataFrame
         A Pandas dataframe containing the data.
     '''
-    data_frame = pd.read_csv(path)
-
-    return data_frame
+    return normalize_input_records(pd.read_csv(path), empty_strings=False)
 
 
 def load_batch_records(path: str = './datasets/batch_records.json') -> pd.DataFrame:
@@ -100,11 +217,175 @@ def load_batch_records(path: str = './datasets/batch_records.json') -> pd.DataFr
     pd.DataFrame:
         The batch records data in a Pandas DataFrame.
     '''
-    data_frame = pd.read_json(path)
-    data_frame.replace('', np.nan, inplace=True)
-    data_frame.fillna(value=np.nan, inplace=True)
+    return normalize_input_records(pd.read_json(path))
+
+
+def input_dtypes(schema: dict = BODY_SCHEMA, float32: bool = INPUT_FLOAT32) -> Dict[str, object]:
+    '''
+    Derives the compact dtype of each model input from the JSON schema of the records:
+    the string properties are categoricals and the number properties float32, or
+    float64 when `float32` is False. The RECORD_FIELDS and the properties with a
+    format or several types keep the dtype they are read with.
+
+    Parameters
+    ----------
+    schema : dict
+        The JSON schema of the records: an array of objects.
+    float32 : bool
+        Whether the numbers are float32.
+
+    Returns
+    ----------
+    Dict[str, object]
+        The dtype of each model input by name.
+    '''
+    dtypes = {}
+
+    for name, prop in schema['items'].get('properties', {}).items():
+        types = prop.get('type', ())
+        types = {types} if isinstance(types, str) else set(types)
+        types.discard('null')
+        if name in RECORD_FIELDS or 'format' in prop or len(types) != 1:
+            continue
+
+        if types == {'string'}:
+            dtypes[name] = 'category'
+        elif types == {'number'}:
+            dtypes[name] = np.float32 if float32 else np.float64
+
+    return dtypes
+
+
+INPUT_DTYPES = input_dtypes()
+
+
+@stage('decode')
+def decode_input_records(content: bytes) -> list:
+    '''
+    Decodes the raw JSON body of a request with orjson. The empty string values are
+    rewritten as null in the raw bytes first, and only when the body holds any, so the
+    decoded records don't need another pass to map them to NaN.
+
+    Parameters
+    ----------
+    content : bytes
+        The raw request body.
+
+    Raises
+    ----------
+    orjson.JSONDecodeError
+        If the content is not valid JSON. It is a subclass of ValueError.
+
+    Returns
+    ----------
+    list
+        The decoded body, a list of records when the body is valid.
+    '''
+    if b'""' in content:
+        content = EMPTY_STRING_VALUE.sub(rb':\1null', content)
+
+    return orjson.loads(content)
+
+
+@stage('decode')
+def decode_ndjson_records(content: bytes) -> List[object]:
+    '''
+    Decodes a block of complete lines of a newline-delimited JSON (NDJSON) body, one
+    record per line. Blank lines are skipped and the empty string values are mapped to
+    null as in `decode_input_records`.
+
+    Parameters
+    ----------
+    content : bytes
+        The lines to decode.
+
+    Raises
+    ----------
+    orjson.JSONDecodeError
+        If a line is not valid JSON.
+
+    Returns
+    ----------
+    List[object]
+        The decoded records.
+    '''
+    if b'""' in content:
+        content = EMPTY_STRING_VALUE.sub(rb':\1null', content)
+
+    return [orjson.loads(line) for line in content.split(b'\n') if line.strip()]
+
+
+@stage('decode')
+def read_arrow_records(content: bytes) -> pd.DataFrame:
+    '''
+    Reads the records of an Apache Arrow IPC body, in the stream or the file format.
+
+    Parameters
+    ----------
+    content : bytes
+        The raw request body.
 
-    return data_frame
+    Raises
+    ----------
+    InvalidRequestError
+        If the body is not valid Arrow IPC data.
+
+    Returns
+    ----------
+    pd.DataFrame
+        The records of the body, without any value conversion.
+    '''
+    try:
+        if content.startswith(ARROW_FILE_MAGIC):
+            table = pa.ipc.open_file(pa.BufferReader(content)).read_all()
+        else:
+            table = pa.ipc.open_stream(content).read_all()
+    except pa.ArrowException as exception:
+        raise InvalidRequestError(
+            'Invalid request body. Must be a valid Apache Arrow IPC stream or file.') from exception
+
+    return _table_to_data_frame(table)
+
+
+@stage('decode')
+def read_parquet_records(content: bytes) -> pd.DataFrame:
+    '''
+    Reads the records of a Parquet body.
+
+    Parameters
+    ----------
+    content : bytes
+        The raw request body.
+
+    Raises
+    ----------
+    InvalidRequestError
+        If the body is not a valid Parquet file.
+
+    Returns
+    ----------
+    pd.DataFrame
+        The records of the body, without any value conversion.
+    '''
+    import pyarrow.parquet as pq  # pylint: disable=import-outside-toplevel
+
+    try:
+        table = pq.read_table(pa.BufferReader(content))
+    except pa.ArrowException as exception:
+        raise InvalidRequestError(
+            'Invalid request body. Must be a valid Parquet file.') from exception
+
+    return _table_to_data_frame(table)
+
+
+def _table_to_data_frame(table: pa.Table) -> pd.DataFrame:
+    '''Converts an Arrow table to a DataFrame, with dictionary columns decoded to values.'''
+    for index, field in enumerate(table.schema):
+        if pa.types.is_dictionary(field.type):
+            table = table.set_column(
+                index, field.name, table.column(index).cast(field.type.value_type))
+
+    return table.to_pandas()
 
 
 def format_input_records(body: List[dict]) -> pd.DataFrame:
@@ -121,44 +402,188 @@ def format_input_records(body: List[dict]) -> pd.DataFrame:
     pd.DataFrame
         A Pandas DataFrame containing the formatted input records.
     '''
-    data_frame = pd.DataFrame(body)
+    return normalize_input_records(pd.DataFrame(body))
 
-    data_frame.replace('', np.nan, inplace=True)
-    data_frame.fillna(value=np.nan, inplace=True)
 
-    return data_frame
+@stage('normalize')
+def normalize_input_records(data_frame: pd.DataFrame,
+                            empty_strings: bool = True) -> pd.DataFrame:
+    '''
+    Replaces the empty strings and the null values of the input records by NaN and
+    converts the model inputs to their dtype in INPUT_DTYPES, in one pass over the
+    columns. The numeric inputs become float32. From INPUT_CATEGORICAL_MIN_RECORDS
+    records, the text inputs become categoricals, whose categories are the distinct
+    values of the column and whose codes take a byte per record, instead of a pointer
+    to a string object each. Building them takes longer than the rest of the
+    normalization, so smaller batches keep their text inputs as strings.
 
+    Parameters
+    ----------
+    data_frame : pd.DataFrame
+        A Pandas DataFrame containing the input records.
+    empty_strings : bool
+        Whether to replace the empty strings. Records decoded by `decode_input_records`
+        don't hold any.
 
-def count_records_by_month(records: pd.DataFrame) -> Dict[str, int]:
+    Returns
+    ----------
+    pd.DataFrame
+        A new DataFrame, with the missing values as NaN and the compact dtypes.
     '''
-    Counts the number of records by month in a given DataFrame.
+    columns = {}
+    categorical = len(data_frame) >= INPUT_CATEGORICAL_MIN_RECORDS
+
+    for name, column in data_frame.items():
+        values = column.to_numpy()
+
+        if values.dtype == object:
+            missing = pd.isna(values)
+            if empty_strings:
+                missing |= values == ''
+            if missing.any():
+                values = values.copy()
+                values[missing] = np.nan
+
+        dtype = INPUT_DTYPES.get(name)
+        if dtype == 'category':
+            columns[name] = pd.Categorical(values) if categorical else values
+        elif dtype is not None:
+            columns[name] = values.astype(dtype)
+        else:
+            columns[name] = values
+
+    return pd.DataFrame(columns, index=data_frame.index, copy=False)
+
+
+@stage('volumetry')
+def count_records_by_month(records: pd.DataFrame, granularity: str = 'month') -> Dict[str, int]:
+    '''
+    Counts the number of records by month, or by another period, in a given DataFrame.
+
+    The period of a record is taken from the calendar date of its 'REF_DATE' as written,
+    in the record's own UTC offset. The column is processed as a whole: the records are
+    counted by date string first and only the distinct dates are parsed and grouped.
+    Records without a 'REF_DATE' are not counted.
 
     Parameters:
     -----------
     records : pd.DataFrame
         The input DataFrame containing the records to be counted.
+    granularity : str
+        The period records are counted by: 'day', 'week' or 'month'.
 
     Returns:
     --------
     Dict[str, int]
-        A dictionary containing the count of records by month, where the key is a string
-        in the format 'YYYY-MM' representing the year and month, and the value is the count
-        of records for that month.
+        A dictionary containing the count of records by period in chronological order,
+        where the key is a string in the format 'YYYY-MM' representing the year and month
+        (or 'YYYY-MM-DD' by day and the ISO week 'YYYY-Www' by week), and the value is
+        the count of records for that period.
+    '''
+    return count_by_period(count_records_by_date(records), granularity)
+
+
+def count_records_by_date(records: pd.DataFrame) -> pd.Series:
+    '''
+    Counts the number of records by the calendar date of their 'REF_DATE', as written
+    in the record's own UTC offset. Records without a 'REF_DATE' are not counted.
+
+    Parameters
+    ----------
+    records : pd.DataFrame
+        The input DataFrame containing the records to be counted.
+
+    Returns
+    ----------
+    pd.Series
+        The count of records indexed by date (a DatetimeIndex at midnight).
+    '''
+    if 'REF_DATE' not in records:
+        return pd.Series([], index=pd.DatetimeIndex([]), dtype=np.int64)
+
+    ref_dates = records['REF_DATE'].dropna()
+
+    if pd.api.types.is_datetime64_any_dtype(ref_dates):
+        if ref_dates.dt.tz is not None:
+            ref_dates = ref_dates.dt.tz_localize(None)
+        counts_by_date = ref_dates.dt.normalize().value_counts()
+    else:
+        counts_by_date = ref_dates.astype(str).str.slice(0, 10).value_counts()
+        counts_by_date.index = pd.to_datetime(counts_by_date.index, format='%Y-%m-%d')
+
+    return counts_by_date
+
+
+def record_periods(records: pd.DataFrame,
+                   granularity: str = 'month') -> Tuple[np.ndarray, List[str]]:
+    '''
+    Assigns each record to the period of its 'REF_DATE', taken as `count_records_by_date`
+    does. Only the distinct dates are parsed and grouped.
+
+    Parameters
+    ----------
+    records : pd.DataFrame
+        The input DataFrame containing the records.
+    granularity : str
+        The period: 'day', 'week' or 'month'.
+
+    Returns
+    ----------
+    A tuple with two elements:
+        - codes: the index of the period of each record in the labels, or -1 for
+            records without a 'REF_DATE'.
+        - labels: the period labels, in chronological order.
     '''
-    counts = defaultdict(int)
+    if 'REF_DATE' not in records:
+        return np.full(len(records), -1, dtype=np.int64), []
+
+    ref_dates = records['REF_DATE']
+
+    if pd.api.types.is_datetime64_any_dtype(ref_dates):
+        if ref_dates.dt.tz is not None:
+            ref_dates = ref_dates.dt.tz_localize(None)
+        date_codes, dates = pd.factorize(ref_dates.dt.normalize())
+    else:
+        date_codes, dates = pd.factorize(ref_dates.str.slice(0, 10))
+        dates = pd.to_datetime(dates, format='%Y-%m-%d')
 
-    for _, record in records.iterrows():
-        ref_date_str = record.get('REF_DATE')
+    frequency, label_format = VOLUMETRY_GRANULARITIES[granularity]
+    period_codes, periods = pd.factorize(pd.DatetimeIndex(dates).to_period(frequency), sort=True)
 
-        if isinstance(ref_date_str, str):
-            ref_date = datetime.fromisoformat(ref_date_str[:-6])
-            key = f'{ref_date.year}-{ref_date.month:02}'
-            counts[key] += 1
+    codes = np.where(date_codes >= 0, period_codes[date_codes], -1).astype(np.int64) \
+        if len(dates) else np.full(len(records), -1, dtype=np.int64)
 
-    return dict(counts)
+    return codes, [period.start_time.strftime(label_format) for period in periods]
 
 
-def calculate_aucroc(input: pd.DataFrame) -> float:
+def count_by_period(counts_by_date: pd.Series, granularity: str = 'month') -> Dict[str, int]:
+    '''
+    Sums counts by date into counts by period.
+
+    Parameters
+    ----------
+    counts_by_date : pd.Series
+        The counts indexed by date, as returned by `count_records_by_date`.
+    granularity : str
+        The period the counts are summed by: 'day', 'week' or 'month'.
+
+    Returns
+    ----------
+    Dict[str, int]
+        The count by period label, in chronological order.
+    '''
+    frequency, label_format = VOLUMETRY_GRANULARITIES[granularity]
+
+    counts = counts_by_date.groupby(counts_by_date.index.to_period(frequency)).sum().sort_index()
+
+    return {
+        period.start_time.strftime(label_format): int(count)
+        for period, count in counts.items()
+    }
+
+
+def calculate_aucroc(input: pd.DataFrame, model: object = None,
+                     scores: Optional[np.ndarray] = None) -> float:
     '''
     Calculates the area under the receiver operating characteristic (ROC) curve
     for the given input DataFrame.
@@ -170,26 +595,148 @@ def calculate_aucroc(input: pd.DataFrame) -> float:
         A Pandas DataFrame 
         containing the input data. Must have a 'TARGET' column.
 
+    model : object, optional
+        The pre-trained model. Defaults to the default version of the model registry.
+
+    scores : np.ndarray, optional
+        The predicted scores of the records, when they are already known.
+
     Returns
     ----------
     float
         The calculated AUCROC score.
     '''
-    x_input = input.drop(['TARGET'], axis=1)
     y_input = input['TARGET']
 
-    model = get_pre_trained_model()
+    if scores is None:
+        x_input = input.drop(['TARGET'], axis=1)
 
-    y_pred = model.predict_proba(x_input)[:, 1]
-    aucroc = roc_auc_score(y_input, y_pred)
+        if model is None:
+            model = MODEL_REGISTRY.get_model()
+
+        with stage('predict'):
+            scores = model.predict_proba(x_input)[:, 1]
+
+    from sklearn.metrics import roc_auc_score  # pylint: disable=import-outside-toplevel
+
+    with stage('auc'):
+        aucroc = roc_auc_score(y_input, scores)
 
     return aucroc
 
 
+def format_timestamp(timestamp: Optional[float]) -> Optional[str]:
+    '''
+    Formats seconds since the epoch as an ISO 8601 UTC string.
+
+    Parameters
+    ----------
+    timestamp : float, optional
+        The seconds since the epoch.
+
+    Returns
+    ----------
+    str, optional
+        The formatted time, or None when the timestamp is None.
+    '''
+    if timestamp is None:
+        return None
+
+    return datetime.fromtimestamp(timestamp, timezone.utc).isoformat()
+
+
+def convert_test_data(csv_path: str = TEST_DATA_PATH,
+                      arrow_path: str = TEST_DATA_ARROW_PATH) -> str:
+    '''
+    Converts the gzip-compressed CSV test dataset into an uncompressed Arrow IPC file
+    (Feather v2), read by `read_test_data` without parsing or decompressing anything.
+
+    The numeric columns keep their dtype and their missing values as NaN rather than
+    Arrow nulls, so they are read without a copy, and the text columns are dictionary
+    encoded. The file is written next to its destination first and then renamed, so
+    readers never see a partial file.
+
+    Parameters
+    ----------
+    csv_path : str
+        The path to the gzip-compressed CSV file.
+    arrow_path : str
+        The path to the Arrow IPC file.
+
+    Returns
+    ----------
+    str
+        The path to the Arrow IPC file.
+    '''
+    df_test = pd.read_csv(csv_path, compression='gzip')
+
+    arrays = [
+        pa.array(column.to_numpy(), from_pandas=False) if column.dtype.kind in 'biuf'
+        else pa.array(column, type=pa.string(), from_pandas=True).dictionary_encode()
+        for _, column in df_test.items()
+    ]
+    table = pa.Table.from_arrays(arrays, names=list(df_test.columns))
+
+    os.makedirs(os.path.dirname(arrow_path) or '.', exist_ok=True)
+    temporary_path = f'{arrow_path}.{os.getpid()}.tmp'
+
+    with pa.OSFile(temporary_path, 'wb') as file:
+        with pa.ipc.new_file(file, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(temporary_path, arrow_path)
+
+    return arrow_path
+
+
+def read_test_data(path: str = TEST_DATA_ARROW_PATH) -> pd.DataFrame:
+    '''
+    Reads the Arrow IPC test dataset written by `convert_test_data` through a memory
+    map. The numeric columns are read-only views of the mapped file, whose pages are
+    shared by every process that reads it.
+
+    Parameters
+    ----------
+    path : str
+        The path to the Arrow IPC file.
+
+    Returns
+    ----------
+    pd.DataFrame
+        The test dataset.
+    '''
+    table = pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+
+    columns = {
+        name: _decode_dictionary(column) if pa.types.is_dictionary(column.type)
+        else column.to_numpy()
+        for name, column in zip(table.column_names, table.columns)
+    }
+
+    return pd.DataFrame(columns, copy=False)
+
+
+def _decode_dictionary(column: pa.ChunkedArray) -> np.ndarray:
+    '''
+    Decodes a dictionary encoded text column to an object array, with the nulls as NaN
+    as `pd.read_csv` reads them. Each distinct value is a single shared string.
+    '''
+    column = column.combine_chunks()
+    values = np.array(column.dictionary.to_pylist() + [np.nan], dtype=object)
+
+    return values[column.indices.fill_null(-1).to_numpy()]
+
+
 def get_test_data() -> Tuple[pd.DataFrame, pd.Series]:
     '''
-    Reads and loads test data from a gzip-compressed CSV file
-    located at './datasets/credit_01/test.gz'.
+    Reads and loads test data from its memory-mapped Arrow copy. The copy is converted
+    from the gzip-compressed CSV file located at './datasets/credit_01/test.gz' the
+    first time, or when the CSV file is newer. When the copy can't be written, the
+    CSV file is read instead.
+
+    Raises
+    ----------
+    FileNotFoundError
+        If the CSV file doesn't exist.
 
     Returns
     ----------
@@ -197,15 +744,211 @@ def get_test_data() -> Tuple[pd.DataFrame, pd.Series]:
         - X: a pandas DataFrame with the features of the test data.
         - y: a pandas Series with the target variable of the test data.
     '''
-    df_test = pd.read_csv(
-        './datasets/credit_01/test.gz', compression='gzip')
-    x_test = df_test.drop(['TARGET'], axis=1)
-    y_test = df_test['TARGET']
+    csv_mtime = os.stat(TEST_DATA_PATH).st_mtime_ns
+
+    try:
+        if (not os.path.exists(TEST_DATA_ARROW_PATH)
+                or os.stat(TEST_DATA_ARROW_PATH).st_mtime_ns < csv_mtime):
+            convert_test_data()
+        df_test = read_test_data()
+    except OSError as exception:
+        logger.warning('Could not convert the test dataset to %s, reading %s: %s',
+                       TEST_DATA_ARROW_PATH, TEST_DATA_PATH, exception)
+        df_test = pd.read_csv(TEST_DATA_PATH, compression='gzip')
+
+    # Popping the target, unlike dropping it, doesn't copy the other columns.
+    y_test = df_test.pop('TARGET')
 
-    return x_test, y_test
+    return df_test, y_test
 
 
-def calculate_ks(path: str) -> Tuple[float, float]:
+def score_data(path: str, model: object = None) -> np.ndarray:
+    '''
+    Reads the CSV file from the given path and returns the predicted scores of its
+    records. The 'TARGET' column is skipped while parsing instead of being dropped
+    afterwards, so the file is held in memory once.
+
+    Parameters
+    ----------
+    path : str
+        The path to the CSV file containing the data.
+    model : object, optional
+        The pre-trained model. Defaults to the default version of the model registry.
+
+    Returns
+    ----------
+    np.ndarray
+        The predicted probability of the positive class for each record.
+    '''
+    if model is None:
+        model = MODEL_REGISTRY.get_model()
+
+    with stage('read_csv'):
+        x_input = pd.read_csv(path, usecols=lambda column: column != 'TARGET')
+
+    with stage('predict'):
+        return model.predict_proba(x_input)[:, 1]
+
+
+def score_data_chunks(path: str, model: object = None,
+                      chunk_size: int = 100000) -> Iterator[np.ndarray]:
+    '''
+    Reads the CSV file from the given path in chunks of rows and yields the
+    predicted scores of each chunk, so only one chunk is held in memory at a time.
+
+    Parameters
+    ----------
+    path : str
+        The path to the CSV file containing the data.
+    model : object, optional
+        The pre-trained model. Defaults to the default version of the model registry.
+    chunk_size : int
+        The number of rows of each chunk.
+
+    Returns
+    ----------
+    Iterator[np.ndarray]
+        The predicted probability of the positive class for the records of each chunk.
+    '''
+    if model is None:
+        model = MODEL_REGISTRY.get_model()
+
+    with pd.read_csv(path, usecols=lambda column: column != 'TARGET',
+                     chunksize=chunk_size) as reader:
+        while True:
+            with stage('read_csv'):
+                x_chunk = next(reader, None)
+            if x_chunk is None:
+                return
+            with stage('predict'):
+                scores = model.predict_proba(x_chunk)[:, 1]
+            yield scores
+
+
+def score_histogram(scores: np.ndarray) -> np.ndarray:
+    '''
+    Computes the density histogram of model scores used by the JS divergence,
+    with HISTOGRAM_BINS equal-width bins over the [0, 1] range.
+
+    Parameters
+    ----------
+    scores : np.ndarray
+        The predicted scores.
+
+    Returns
+    ----------
+    np.ndarray
+        The density of each bin.
+    '''
+    histogram, _ = np.histogram(
+        scores, bins=HISTOGRAM_BINS, range=(0, 1), density=True)
+
+    return histogram
+
+
+def ks_asymptotic_p_value(ks_statistic: float, n_scores: int, n_reference: int) -> float:
+    '''
+    Computes the p-value of a two-sided two-sample KS statistic with Smirnov's
+    asymptotic distribution, as `scipy.stats.ks_2samp` does for large samples.
+
+    Parameters
+    ----------
+    ks_statistic : float
+        The KS statistic.
+    n_scores : int
+        The size of the first sample.
+    n_reference : int
+        The size of the second sample.
+
+    Returns
+    ----------
+    float
+        The p-value.
+    '''
+    from scipy.stats import kstwo  # pylint: disable=import-outside-toplevel
+
+    en = n_scores * n_reference / (n_scores + n_reference)
+
+    return np.clip(kstwo.sf(ks_statistic, np.round(en)), 0, 1)
+
+
+def ks_2samp_sorted(scores: np.ndarray, sorted_reference: np.ndarray) -> Tuple[float, float]:
+    '''
+    Computes the two-sided two-sample KS test between scores and reference scores
+    that are already sorted, giving the same result as `scipy.stats.ks_2samp`.
+
+    The reference scores are merged through binary searches instead of being
+    sorted again. Small samples, for which `ks_2samp` computes the exact p-value,
+    are delegated to `ks_2samp`.
+
+    Parameters
+    ----------
+    scores : np.ndarray
+        The predicted scores of the input data.
+    sorted_reference : np.ndarray
+        The predicted scores of the reference data in ascending order.
+
+    Returns
+    ----------
+    A tuple of the KS statistic and p-value.
+    '''
+    n_scores = scores.shape[0]
+    n_reference = sorted_reference.shape[0]
+
+    if max(n_scores, n_reference) <= KS_EXACT_MAX_SIZE:
+        from scipy.stats import ks_2samp  # pylint: disable=import-outside-toplevel
+        ks_statistic, p_value = ks_2samp(scores, sorted_reference)
+        return ks_statistic, p_value
+
+    sorted_scores = np.sort(scores)
+    data_all = np.concatenate([sorted_scores, sorted_reference])
+    cdf_scores = np.searchsorted(sorted_scores, data_all, side='right') / n_scores
+    cdf_reference = np.searchsorted(
+        sorted_reference, data_all, side='right') / n_reference
+    ks_statistic = np.max(np.abs(cdf_scores - cdf_reference))
+
+    return ks_statistic, ks_asymptotic_p_value(ks_statistic, n_scores, n_reference)
+
+
+def ks_2samp_counts(values: np.ndarray, counts: np.ndarray,
+                    sorted_reference: np.ndarray) -> Tuple[float, float]:
+    '''
+    Computes the two-sided two-sample KS test between scores given as distinct values
+    with their counts and reference scores that are already sorted. The result is the
+    same as `ks_2samp_sorted` over the scores with each value repeated by its count.
+
+    Parameters
+    ----------
+    values : np.ndarray
+        The distinct predicted scores of the input data in ascending order.
+    counts : np.ndarray
+        The number of input records with each score.
+    sorted_reference : np.ndarray
+        The predicted scores of the reference data in ascending order.
+
+    Returns
+    ----------
+    A tuple of the KS statistic and p-value.
+    '''
+    n_scores = int(counts.sum())
+    n_reference = sorted_reference.shape[0]
+
+    if max(n_scores, n_reference) <= KS_EXACT_MAX_SIZE:
+        return ks_2samp_sorted(np.repeat(values, counts), sorted_reference)
+
+    cumulative_counts = np.concatenate([[0], np.cumsum(counts)])
+    data_all = np.concatenate([values, sorted_reference])
+    cdf_scores = cumulative_counts[
+        np.searchsorted(values, data_all, side='right')] / n_scores
+    cdf_reference = np.searchsorted(
+        sorted_reference, data_all, side='right') / n_reference
+    ks_statistic = np.max(np.abs(cdf_scores - cdf_reference))
+
+    return ks_statistic, ks_asymptotic_p_value(ks_statistic, n_scores, n_reference)
+
+
+def calculate_ks(path: str, model: object = None,
+                 reference_scores: np.ndarray = None) -> Tuple[float, float]:
     '''
     Calculates the KS statistic and p-value for the predicted scores of a given model
     on the data in the path entry and test data.
@@ -214,27 +957,32 @@ def calculate_ks(path: str) -> Tuple[float, float]:
     ----------
     path : str
         The path to the data file.
+    model : object, optional
+        The pre-trained model. Defaults to the default version of the model registry.
+    reference_scores : np.ndarray, optional
+        The sorted predicted scores of the test data, as kept by the reference profiles
+        of `api.endpoints.reference`. Computed from the test data when not given.
 
     Returns
     ----------
     A tuple of the KS statistic and p-value.
     '''
-    model = get_pre_trained_model()
-
-    df_input = get_data(path)
+    if model is None:
+        model = MODEL_REGISTRY.get_model()
 
-    x_input = df_input.drop(['TARGET'], axis=1)
-    x_test, _ = get_test_data()
+    y_pred = score_data(path, model)
 
-    y_pred = model.predict_proba(x_input)[:, 1]
-    y_pred_test = model.predict_proba(x_test)[:, 1]
+    if reference_scores is None:
+        x_test, _ = get_test_data()
+        reference_scores = np.sort(model.predict_proba(x_test)[:, 1])
 
-    ks_statistic, p_value = ks_2samp(y_pred, y_pred_test)
+    ks_statistic, p_value = ks_2samp_sorted(y_pred, reference_scores)
 
     return ks_statistic, p_value
 
 
-def calculate_js(path: str) -> float:
+def calculate_js(path: str, model: object = None,
+                 reference_histogram: np.ndarray = None) -> float:
     '''
     Calculates the Jensen-Shannon (JS) distance between the probability
     distributions of a given model on the training and test data.
@@ -243,23 +991,27 @@ def calculate_js(path: str) -> float:
     ----------
     path : str
         The path to the data file.
+    model : object, optional
+        The pre-trained model. Defaults to the default version of the model registry.
+    reference_histogram : np.ndarray, optional
+        The score histogram of the test data, as kept by the reference profiles
+        of `api.endpoints.reference`. Computed from the test data when not given.
 
     Returns
     ----------
     The JS distance.
     '''
-    model = get_pre_trained_model()
+    if model is None:
+        model = MODEL_REGISTRY.get_model()
 
-    df_input = get_data(path)
-    x_input = df_input.drop(['TARGET'], axis=1)
-    x_test, _ = get_test_data()
+    y_pred = score_data(path, model)
 
-    y_pred = model.predict_proba(x_input)[:, 1]
-    y_pred_test = model.predict_proba(x_test)[:, 1]
+    if reference_histogram is None:
+        x_test, _ = get_test_data()
+        reference_histogram = score_histogram(model.predict_proba(x_test)[:, 1])
 
-    hist1, _ = np.histogram(y_pred, bins=20, range=(0, 1), density=True)
-    hist2, _ = np.histogram(y_pred_test, bins=20, range=(0, 1), density=True)
+    from scipy.spatial.distance import jensenshannon  # pylint: disable=import-outside-toplevel
 
-    js_distance = jensenshannon(hist1, hist2)
+    js_distance = jensenshannon(score_histogram(y_pred), reference_histogram)
 
     return js_distance
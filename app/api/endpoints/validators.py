@@ -3,27 +3,295 @@ validators.py
 
 This module contains functions for validating API request bodies.
 
+The /performance body is validated by a `PerformanceBodyValidator` compiled once from
+`BODY_SCHEMA`. It checks the body column by column on its DataFrame instead of walking
+every property of every record, and only falls back to the jsonschema validator to
+report the same error messages as `jsonschema.validate` when the body is invalid.
+Bodies read from a columnar format (Arrow, Parquet) are validated on their DataFrame
+directly, with the same checks.
+
 '''
 
-from jsonschema import validate
+import re
+from typing import Callable, Dict, List
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import infer_dtype, is_scalar
+from jsonschema import validate, exceptions
+from jsonschema.validators import validator_for
+from api.settings import ADHERENCE_BATCH_MAX_PATHS
 from api.endpoints.schemas.performance_body import BODY_SCHEMA
+from api.endpoints.adherence import ADHERENCE_STATISTICS
+from api.endpoints.metrics import stage
+
+
+# RFC 3339 date-time, also accepting a space between the date and the time.
+DATE_TIME_PATTERN = re.compile(
+    r'\d{4}-(0[1-9]|1[0-2])-(0[1-9]|[12]\d|3[01])[Tt ]'
+    r'([01]\d|2[0-3]):[0-5]\d:([0-5]\d|60)(\.\d+)?([Zz]|[+-]([01]\d|2[0-3]):[0-5]\d)')
+
+ColumnCheck = Callable[[pd.Series], bool]
+
+# Properties of the options shared by the adherence request bodies.
+ADHERENCE_OPTIONS_PROPERTIES = {
+    'statistics': {
+        'type': 'array',
+        'minItems': 1,
+        'uniqueItems': True,
+        'items': {'enum': list(ADHERENCE_STATISTICS)}
+    },
+    'chunk_size': {'type': 'integer', 'minimum': 1},
+    'cache': {'type': 'boolean'},
+    'confidence_intervals': {'type': 'boolean'}
+}
+
+
+def _is_number_column(column: pd.Series) -> bool:
+    '''Checks that a column only holds numbers, without nulls.'''
+    return column.dtype.kind in 'iu' or (column.dtype.kind == 'f' and not column.isna().any())
+
+
+def _is_nullable_number_column(column: pd.Series) -> bool:
+    '''Checks that a column only holds numbers or nulls.'''
+    return column.dtype.kind in 'iuf' or (column.dtype.kind == 'O' and column.isna().all())
+
+
+def _is_string_column(column: pd.Series) -> bool:
+    '''Checks that a column only holds strings, without nulls.'''
+    return column.dtype.kind == 'O' and infer_dtype(column, skipna=False) == 'string'
+
+
+def _is_nullable_string_column(column: pd.Series) -> bool:
+    '''Checks that a column only holds strings or nulls, where NaN is not a null.'''
+    if column.dtype.kind != 'O' or infer_dtype(column, skipna=True) not in ('string', 'empty'):
+        return False
 
+    values = column.to_numpy()
+    nans = pd.isna(values) & ~np.equal(values, None)
 
-def validate_performance_body(body: dict):
+    return not nans.any()
+
+
+def _is_date_time_column(column: pd.Series) -> bool:
+    '''Checks that a column only holds RFC 3339 date-time strings or timezone-aware timestamps.'''
+    if isinstance(column.dtype, pd.DatetimeTZDtype):
+        return not column.isna().any()
+
+    return _is_string_column(column) and bool(column.str.fullmatch(DATE_TIME_PATTERN).all())
+
+
+_COLUMN_CHECKS: Dict[tuple, ColumnCheck] = {
+    ('number', False, None): _is_number_column,
+    ('number', True, None): _is_nullable_number_column,
+    ('string', False, None): _is_string_column,
+    ('string', True, None): _is_nullable_string_column,
+    ('string', False, 'date-time'): _is_date_time_column
+}
+
+
+class PerformanceBodyValidator:
+    '''
+    Validator of the /performance body compiled once from its JSON schema.
+
+    The body is checked for its structure (a list of at least `minItems` objects holding
+    every required property) and ingested into a DataFrame, whose columns are checked
+    against the type of their property. Whenever a check fails, the body is validated by
+    the jsonschema validator of the schema, so that invalid bodies raise exactly the
+    same errors as `jsonschema.validate`. On top of that, the `date-time` format is
+    enforced, which `jsonschema.validate` doesn't check.
+
+    Properties whose type isn't a number or a string, optionally nullable, are always
+    checked by the jsonschema validator. The jsonschema validator is only compiled, and
+    the schema checked, the first time it is needed.
+
+    Parameters
+    ----------
+    schema : dict
+        The JSON schema of the body: an array of objects.
+    '''
+
+    def __init__(self, schema: dict = BODY_SCHEMA):
+        items = schema['items']
+
+        self.min_items = schema.get('minItems', 0)
+        self.required = frozenset(items.get('required', ()))
+        self.column_checks: Dict[str, ColumnCheck] = {}
+        self.date_time_columns = []
+        self.compiled = True
+
+        for name, prop in items.get('properties', {}).items():
+            types = prop.get('type', ())
+            types = {types} if isinstance(types, str) else set(types)
+            nullable = 'null' in types
+            types.discard('null')
+            key = (types.pop() if len(types) == 1 else None, nullable, prop.get('format'))
+
+            if key in _COLUMN_CHECKS and set(prop) <= {'type', 'format'}:
+                self.column_checks[name] = _COLUMN_CHECKS[key]
+                if prop.get('format') == 'date-time':
+                    self.date_time_columns.append(name)
+            else:
+                self.compiled = False
+
+        self.schema = schema
+        self._validator = None
+
+    @property
+    def validator(self):
+        '''The jsonschema validator of the schema, compiled on first use.'''
+        if self._validator is None:
+            validator_class = validator_for(self.schema)
+            validator_class.check_schema(self.schema)
+            self._validator = validator_class(self.schema)
+
+        return self._validator
+
+    def validate(self, body: list) -> pd.DataFrame:
+        '''
+        Validates a /performance body and returns it as a DataFrame.
+
+        Parameters
+        ----------
+        body
+            The decoded request body.
+
+        Raises
+        ----------
+        jsonschema.exceptions.ValidationError
+            If the body is not valid.
+
+        Returns
+        ----------
+        pd.DataFrame
+            The records of the body, without any value conversion.
+        '''
+        if self._is_valid_structure(body):
+            data_frame = pd.DataFrame(body)
+            if self.compiled and all(
+                    name not in data_frame or check(data_frame[name])
+                    for name, check in self.column_checks.items()):
+                return data_frame
+
+        error = exceptions.best_match(self.validator.iter_errors(body))
+        if error is not None:
+            raise error
+
+        data_frame = pd.DataFrame(body)
+        self._check_formats(data_frame)
+
+        return data_frame
+
+    def validate_frame(self, data_frame: pd.DataFrame) -> pd.DataFrame:
+        '''
+        Validates the records of a /performance body read from a columnar format.
+
+        Parameters
+        ----------
+        data_frame : pd.DataFrame
+            The records of the body.
+
+        Raises
+        ----------
+        jsonschema.exceptions.ValidationError
+            If the records are not valid.
+
+        Returns
+        ----------
+        pd.DataFrame
+            The records of the body, without any value conversion.
+        '''
+        if (self.compiled
+                and len(data_frame) >= self.min_items
+                and self.required <= set(data_frame.columns)
+                and all(name not in data_frame or check(data_frame[name])
+                        for name, check in self.column_checks.items())):
+            return data_frame
+
+        return self.validate(_to_json_records(data_frame))
+
+    def _is_valid_structure(self, body) -> bool:
+        '''Checks that the body is a list of enough objects holding every required property.'''
+        return (
+            isinstance(body, list)
+            and len(body) >= self.min_items
+            and set(map(type, body)) <= {dict}
+            and all(record.keys() >= self.required for record in body)
+        )
+
+    def _check_formats(self, data_frame: pd.DataFrame):
+        '''Raises a ValidationError for the first value that isn't a valid date-time.'''
+        for name in self.date_time_columns:
+            if name not in data_frame:
+                continue
+            values = data_frame[name]
+            strings = values[values.map(type) == str]
+            invalid = strings[~strings.str.fullmatch(DATE_TIME_PATTERN)]
+            if not invalid.empty:
+                raise exceptions.ValidationError(f"{invalid.iloc[0]!r} is not a 'date-time'")
+
+
+def _to_json_records(data_frame: pd.DataFrame) -> List[dict]:
+    '''
+    Converts a DataFrame to records as decoded from JSON: nulls as None, timestamps
+    as strings.
+    '''
+    return [
+        {name: None if is_scalar(value) and pd.isna(value)
+         else value.isoformat() if isinstance(value, pd.Timestamp) else value
+         for name, value in record.items()}
+        for record in data_frame.to_dict('records')
+    ]
+
+
+PERFORMANCE_BODY_VALIDATOR = PerformanceBodyValidator(BODY_SCHEMA)
+
+
+@stage('validate')
+def validate_performance_body(body: list) -> pd.DataFrame:
     '''
     Validates a performance API request body against a JSON schema.
 
     Parameters
     ----------
     body
-        A dictionary representing the performance API request body.
+        A list of records representing the performance API request body.
 
     Raises
     ----------
     jsonschema.exceptions.ValidationError
         If the body is not valid.
+
+    Returns
+    ----------
+    pd.DataFrame
+        The records of the body as a DataFrame, without any value conversion.
+    '''
+    return PERFORMANCE_BODY_VALIDATOR.validate(body)
+
+
+@stage('validate')
+def validate_performance_frame(data_frame: pd.DataFrame) -> pd.DataFrame:
     '''
-    validate(instance=body, schema=BODY_SCHEMA)
+    Validates the records of a performance API request body read from a columnar
+    format against the same JSON schema.
+
+    Parameters
+    ----------
+    data_frame : pd.DataFrame
+        The records of the body.
+
+    Raises
+    ----------
+    jsonschema.exceptions.ValidationError
+        If the records are not valid.
+
+    Returns
+    ----------
+    pd.DataFrame
+        The records of the body as a DataFrame, without any value conversion.
+    '''
+    return PERFORMANCE_BODY_VALIDATOR.validate_frame(data_frame)
 
 
 def validate_adherence_body(body: dict):
@@ -43,7 +311,64 @@ def validate_adherence_body(body: dict):
     validate(instance=body, schema={
         'type': 'object',
         'properties': {
-                'path': {'type': 'string', 'pattern': '.+'}
+                'path': {'type': 'string', 'pattern': '.+'},
+                **ADHERENCE_OPTIONS_PROPERTIES
+        },
+        'required': ['path']
+    })
+
+
+def validate_adherence_batch_body(body: dict):
+    '''
+    Validates a batch adherence API request body against a JSON schema. The body
+    holds either a list of paths or a glob pattern.
+
+    Parameters
+    ----------
+    body
+        A dictionary representing the batch adherence API request body.
+
+    Raises
+    ----------
+    jsonschema.exceptions.ValidationError
+        If the body is not valid.
+    '''
+    validate(instance=body, schema={
+        'type': 'object',
+        'properties': {
+                'paths': {
+                    'type': 'array',
+                    'minItems': 1,
+                    'maxItems': ADHERENCE_BATCH_MAX_PATHS,
+                    'items': {'type': 'string', 'pattern': '.+'}
+                },
+                'glob': {'type': 'string', 'pattern': '.+'},
+                **ADHERENCE_OPTIONS_PROPERTIES
+        },
+        'oneOf': [{'required': ['paths']}, {'required': ['glob']}]
+    })
+
+
+def validate_feature_drift_body(body: dict):
+    '''
+    Validates a feature drift API request body against a JSON schema.
+
+    Parameters
+    ----------
+    body
+        A dictionary representing the feature drift API request body.
+
+    Raises
+    ----------
+    jsonschema.exceptions.ValidationError
+        If the body is not valid.
+    '''
+    validate(instance=body, schema={
+        'type': 'object',
+        'properties': {
+                'path': {'type': 'string', 'pattern': '.+'},
+                'chunk_size': ADHERENCE_OPTIONS_PROPERTIES['chunk_size'],
+                'cache': ADHERENCE_OPTIONS_PROPERTIES['cache']
         },
         'required': ['path']
     })
@@ -0,0 +1,96 @@
+'''
+Module that holds the settings of the models monitoring API.
+
+Every setting can be overridden through an environment variable with the same name.
+
+Settings:
+----------
+- MODELS_DIR: Directory scanned for the pre-trained model pickles (`<version>.pkl`).
+- DEFAULT_MODEL_VERSION: Model version used when a request doesn't select one.
+- MODEL_RELOAD_INTERVAL: Minimum number of seconds between two checks of a model
+    file for changes on disk.
+- REFERENCE_DIR: Directory where the reference profiles of the models are persisted.
+- TEST_DATA_PATH: The gzip-compressed CSV file of the test dataset.
+- TEST_DATA_ARROW_PATH: The memory-mapped Arrow copy of the test dataset, converted
+    from TEST_DATA_PATH once.
+- EXECUTOR_KIND: 'thread' or 'process' pool for the compute executor.
+- EXECUTOR_MAX_WORKERS: Size of the compute executor pool.
+- EXECUTOR_TIMEOUT: Seconds a request computation may take, 0 disables the timeout.
+- ADHERENCE_CHUNK_SIZE: Default number of rows read at a time by /aderencia, 0 reads
+    the whole file at once.
+- ADHERENCE_MAX_DISTINCT_SCORES: Distinct scores kept exactly by the chunked KS test.
+- AUC_MAX_DISTINCT_SCORES: Distinct scores kept exactly by the incremental AUC-ROC.
+- PERFORMANCE_SESSION_TTL: Seconds an idle performance session is kept.
+- PERFORMANCE_SESSION_DIR: Directory where the performance sessions are persisted, empty
+    to keep them in memory only.
+- ADHERENCE_CACHE_SIZE: Maximum number of cached adherence results, 0 disables the cache.
+- ADHERENCE_CACHE_DIR: Directory where the cached adherence results are persisted, empty
+    to keep them in memory only.
+- ADHERENCE_CACHE_HASH: Whether the adherence cache key includes the digest of the input
+    file contents.
+- SCORE_CACHE_SIZE: Maximum number of cached record scores of /performance, 0 disables
+    the cache.
+- SCORE_BATCH_WAIT: Seconds a /performance scoring call waits for the calls of concurrent
+    requests to score them together, 0 disables the micro-batching. Only the models
+    scored by scikit-learn in a thread pool executor of several workers are batched.
+- SCORE_BATCH_MAX_ROWS: Number of records that closes a micro-batch before its wait ends.
+- BOOTSTRAP_RESAMPLES: Number of bootstrap resamples of the confidence intervals.
+- BOOTSTRAP_CONFIDENCE: Confidence level of the bootstrap confidence intervals.
+- BOOTSTRAP_WORKERS: Number of threads the bootstrap resamples are computed by, 1
+    computes them in the thread of the request.
+- ADHERENCE_BATCH_MAX_PATHS: Maximum number of files of a batch adherence request, listed
+    or matched by its glob pattern.
+- JOB_WORKERS: Number of adherence jobs run at the same time.
+- JOB_RESULT_TTL: Seconds a finished job and its result are kept.
+- JOB_TIMEOUT: Seconds a job may take, 0 disables the timeout.
+- INPUT_FLOAT32: Whether the numeric model inputs of the records are ingested as float32
+    rather than float64. The scikit-learn decision trees compute in float32 anyway;
+    disable it for models whose scores change with float32 inputs.
+- INPUT_CATEGORICAL_MIN_RECORDS: Number of records from which the text model inputs of
+    a batch are ingested as categoricals, which take less memory but are slower to
+    build, rather than as strings.
+- COMPILED_SCORER: Whether the supported models are scored by a NumPy scorer compiled
+    when they are loaded, rather than by their scikit-learn `predict_proba`.
+- STARTUP_MODE: 'eager' to load the models and their profiles and warm them up on
+    startup, or 'lazy' to load each of them on first use.
+- WARMUP_RECORDS: Number of synthetic records scored by the warm-up inference of each
+    model on an eager startup, 0 disables the warm-up.
+'''
+
+import os
+
+
+MODELS_DIR = os.environ.get('MODELS_DIR', './models')
+DEFAULT_MODEL_VERSION = os.environ.get('DEFAULT_MODEL_VERSION', 'model')
+MODEL_RELOAD_INTERVAL = float(os.environ.get('MODEL_RELOAD_INTERVAL', '1.0'))
+REFERENCE_DIR = os.environ.get('REFERENCE_DIR', './datasets/reference')
+TEST_DATA_PATH = os.environ.get('TEST_DATA_PATH', './datasets/credit_01/test.gz')
+TEST_DATA_ARROW_PATH = os.environ.get(
+    'TEST_DATA_ARROW_PATH', os.path.join(REFERENCE_DIR, 'test.arrow'))
+EXECUTOR_KIND = os.environ.get('EXECUTOR_KIND', 'thread')
+EXECUTOR_MAX_WORKERS = int(os.environ.get('EXECUTOR_MAX_WORKERS', str(os.cpu_count() or 1)))
+EXECUTOR_TIMEOUT = float(os.environ.get('EXECUTOR_TIMEOUT', '300'))
+ADHERENCE_CHUNK_SIZE = int(os.environ.get('ADHERENCE_CHUNK_SIZE', '0'))
+ADHERENCE_MAX_DISTINCT_SCORES = int(os.environ.get('ADHERENCE_MAX_DISTINCT_SCORES', '65536'))
+AUC_MAX_DISTINCT_SCORES = int(os.environ.get('AUC_MAX_DISTINCT_SCORES', '65536'))
+PERFORMANCE_SESSION_TTL = float(os.environ.get('PERFORMANCE_SESSION_TTL', '604800'))
+PERFORMANCE_SESSION_DIR = os.environ.get('PERFORMANCE_SESSION_DIR', '')
+ADHERENCE_CACHE_SIZE = int(os.environ.get('ADHERENCE_CACHE_SIZE', '256'))
+ADHERENCE_CACHE_DIR = os.environ.get('ADHERENCE_CACHE_DIR', '')
+ADHERENCE_CACHE_HASH = os.environ.get(
+    'ADHERENCE_CACHE_HASH', 'false').lower() in ('1', 'true', 'yes')
+SCORE_CACHE_SIZE = int(os.environ.get('SCORE_CACHE_SIZE', '100000'))
+SCORE_BATCH_WAIT = float(os.environ.get('SCORE_BATCH_WAIT', '0.005'))
+SCORE_BATCH_MAX_ROWS = int(os.environ.get('SCORE_BATCH_MAX_ROWS', '20000'))
+BOOTSTRAP_RESAMPLES = int(os.environ.get('BOOTSTRAP_RESAMPLES', '1000'))
+BOOTSTRAP_CONFIDENCE = float(os.environ.get('BOOTSTRAP_CONFIDENCE', '0.95'))
+BOOTSTRAP_WORKERS = int(os.environ.get('BOOTSTRAP_WORKERS', '1'))
+ADHERENCE_BATCH_MAX_PATHS = int(os.environ.get('ADHERENCE_BATCH_MAX_PATHS', '100'))
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', '2'))
+JOB_RESULT_TTL = float(os.environ.get('JOB_RESULT_TTL', '3600'))
+JOB_TIMEOUT = float(os.environ.get('JOB_TIMEOUT', '0'))
+INPUT_FLOAT32 = os.environ.get('INPUT_FLOAT32', 'true').lower() in ('1', 'true', 'yes')
+INPUT_CATEGORICAL_MIN_RECORDS = int(os.environ.get('INPUT_CATEGORICAL_MIN_RECORDS', '10000'))
+COMPILED_SCORER = os.environ.get('COMPILED_SCORER', 'true').lower() in ('1', 'true', 'yes')
+STARTUP_MODE = os.environ.get('STARTUP_MODE', 'eager')
+WARMUP_RECORDS = int(os.environ.get('WARMUP_RECORDS', '64'))
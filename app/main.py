@@ -1,23 +1,57 @@
 '''
 This module contains the FastAPI application for the models monitoring API.
 
-It defines the root endpoint, includes the router, and sets up exception handlers.
+It defines the root endpoint, includes the router, sets up exception handlers
+and starts the API up (see `api.endpoints.startup`): by default, the pre-trained models
+and their reference profiles are preloaded and warmed up before serving requests, and
+`/ready` reports which components are warm.
+Every request is measured by the `measure_request` middleware: its stage durations
+are returned in the `Server-Timing` header and, with the request, record and error
+counts, exposed in the Prometheus format at `/metrics` (see `api.endpoints.metrics`).
 '''
 
 
+import time
 from http import HTTPStatus
 # from mangum import Mangum
-import uvicorn
-from fastapi import FastAPI
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
+from starlette.routing import Match
 from api.routers import router
-
-from api.endpoints.exceptions import InvalidRequestError, InternalServerError, InvalidPathError
+from api.endpoints.startup import STARTUP
+from api.endpoints.executor import COMPUTE_EXECUTOR
+from api.endpoints.jobs import JOB_QUEUE
+from api.endpoints.metrics import METRICS, record_error, start_request
+from api.endpoints.exceptions import (
+    InvalidRequestError, InternalServerError, InvalidPathError, RequestTimeoutError,
+    UnsupportedMediaTypeError)
 
 
 app = FastAPI(title='Monitoramento de modelos', version='1.0.0')
 
 
+@app.on_event('startup')
+async def start_up():
+    '''
+    Starts the API up in the STARTUP_MODE. In the default eager mode, loads every
+    pre-trained model into the model registry and the reference and feature profiles
+    of each model, and runs a warm-up inference before serving requests, so that no
+    request pays for unpickling a model, summarizing the test dataset or the first
+    call of the model.
+    '''
+    STARTUP.run()
+
+
+@app.on_event('shutdown')
+async def stop_executor():
+    '''
+    Stops the job queue, then waits for the running computations and shuts the
+    compute executor down.
+    '''
+    JOB_QUEUE.shutdown()
+    COMPUTE_EXECUTOR.shutdown()
+
+
 @app.get('/')
 async def root():
     '''
@@ -34,9 +68,90 @@ async def root():
     )
 
 
+@app.get('/ready')
+async def read_readiness():
+    '''
+    Returns whether the API started up and which of its components are warm.
+
+    Returns:
+        A JSONResponse with the readiness report and an OK status code, or a
+        SERVICE_UNAVAILABLE status code while the API is starting up.
+    '''
+    readiness = STARTUP.readiness()
+
+    return JSONResponse(
+        content=readiness,
+        status_code=HTTPStatus.OK if readiness['ready'] else HTTPStatus.SERVICE_UNAVAILABLE
+    )
+
+
+@app.get('/metrics')
+async def read_metrics():
+    '''
+    Returns the request, stage, record and error metrics of the API.
+
+    Returns:
+        A PlainTextResponse with the metrics in the Prometheus text format.
+    '''
+    return PlainTextResponse(
+        content=METRICS.render(),
+        media_type='text/plain; version=0.0.4'
+    )
+
+
 app.include_router(router, prefix='/v1')
 
 
+def route_template(request: Request) -> str:
+    '''
+    Returns the path template of the route matching a request, so that metrics are not
+    labelled with ids.
+
+    Args:
+        request: The request object
+
+    Returns:
+        The path template of the route, or '<unmatched>'.
+    '''
+    for route in app.routes:
+        match, _ = route.matches(request.scope)
+        if match == Match.FULL:
+            return route.path
+
+    return '<unmatched>'
+
+
+@app.middleware('http')
+async def measure_request(request: Request, call_next):
+    '''
+    Measures a request: its stages are returned in the `Server-Timing` header and its
+    duration, stages, records and error are added to the metrics.
+
+    Args:
+        request: The request object
+        call_next: The next handler of the request
+
+    Returns:
+        The response, with the `Server-Timing` header.
+    '''
+    metrics = start_request()
+    start = time.perf_counter()
+
+    try:
+        response = await call_next(request)
+    except Exception as exception:
+        record_error(exception)
+        metrics.finish(request.method, route_template(request),
+                       HTTPStatus.INTERNAL_SERVER_ERROR, time.perf_counter() - start)
+        raise
+
+    duration = time.perf_counter() - start
+    response.headers['Server-Timing'] = metrics.server_timing(duration)
+    metrics.finish(request.method, route_template(request), response.status_code, duration)
+
+    return response
+
+
 @app.exception_handler(InvalidRequestError)
 async def invalid_request_handler(_, exc):
     '''
@@ -49,6 +164,8 @@ async def invalid_request_handler(_, exc):
     Returns:
         A JSONResponse with an error message and a BAD_REQUEST status code.
     '''
+    record_error(exc)
+
     return JSONResponse(
         content={'error': exc.message},
         status_code=HTTPStatus.BAD_REQUEST
@@ -67,6 +184,8 @@ async def internal_server_error_handler(_, exc):
     Returns:
         A JSONResponse with an error message and an INTERNAL_SERVER_ERROR status code.
     '''
+    record_error(exc)
+
     return JSONResponse(
         content={'error': exc.message},
         status_code=HTTPStatus.INTERNAL_SERVER_ERROR
@@ -85,13 +204,56 @@ async def invalid_path_handler(_, exc):
     Returns:
         A JSONResponse with an error message and a NOT_FOUND status code.
     '''
+    record_error(exc)
+
     return JSONResponse(
         content={'error': exc.message},
         status_code=HTTPStatus.NOT_FOUND
     )
 
+
+@app.exception_handler(RequestTimeoutError)
+async def request_timeout_handler(_, exc):
+    '''
+    Exception handler for RequestTimeoutError.
+
+    Args:
+        _: The request object
+        exc: The exception object
+
+    Returns:
+        A JSONResponse with an error message and a GATEWAY_TIMEOUT status code.
+    '''
+    record_error(exc)
+
+    return JSONResponse(
+        content={'error': exc.message},
+        status_code=HTTPStatus.GATEWAY_TIMEOUT
+    )
+
+
+@app.exception_handler(UnsupportedMediaTypeError)
+async def unsupported_media_type_handler(_, exc):
+    '''
+    Exception handler for UnsupportedMediaTypeError.
+
+    Args:
+        _: The request object
+        exc: The exception object
+
+    Returns:
+        A JSONResponse with an error message and an UNSUPPORTED_MEDIA_TYPE status code.
+    '''
+    record_error(exc)
+
+    return JSONResponse(
+        content={'error': exc.message},
+        status_code=HTTPStatus.UNSUPPORTED_MEDIA_TYPE
+    )
+
 ### deployment server
 # handler = Mangum(app)
 
 if __name__ == '__main__':
+    import uvicorn
     uvicorn.run(app, host='0.0.0.0', port=8001)
\ No newline at end of file
@@ -0,0 +1,165 @@
+'''
+Shared paths and result handling of the benchmarks.
+
+Every benchmark prints its results, writes them as JSON with `--output` and compares
+them with the results of a previous run with `--baseline`, exiting with status 1 when
+a measure regressed by more than `--tolerance`. The scripts import this module from
+the `benchmark` directory, which Python puts first on the path of a script run from it.
+
+Functions:
+----------
+- git_commit() -> str:
+    Returns the current commit of the repository.
+
+- add_result_arguments(parser: argparse.ArgumentParser):
+    Adds the --output, --baseline and --tolerance arguments to a parser.
+
+- compare_results(results: List[Dict[str, object]], baseline: List[Dict[str, object]],
+                  key: Callable, compare_result: Callable, tolerance: float) -> List[str]:
+    Compares results with the results of a baseline run.
+
+- report_results(arguments: argparse.Namespace, results: List[Dict[str, object]],
+                 metadata: Dict[str, object], key: Callable, compare_result: Callable):
+    Writes the results and compares them with the baseline, as the arguments request.
+
+Attributes:
+----------
+- REPOSITORY_DIR: str
+    The root directory of the repository.
+
+- APP_DIR: str
+    The directory of the API, where its modules resolve their relative paths.
+
+- INVOCATION_DIR: str
+    The working directory the benchmark was run from, for the paths of its arguments.
+
+- BATCH_RECORDS_PATH: str
+    The records the synthetic batches are resampled from.
+'''
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Tuple
+
+
+REPOSITORY_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_DIR = os.path.join(REPOSITORY_DIR, 'app')
+INVOCATION_DIR = os.getcwd()
+BATCH_RECORDS_PATH = os.path.join(APP_DIR, 'datasets', 'batch_records.json')
+
+
+def git_commit() -> str:
+    '''Returns the current commit of the repository, or an empty string outside git.'''
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=REPOSITORY_DIR, capture_output=True,
+            text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def add_result_arguments(parser: argparse.ArgumentParser):
+    '''
+    Adds the --output, --baseline and --tolerance arguments to a parser.
+
+    Parameters
+    ----------
+    parser : argparse.ArgumentParser
+        The parser of the arguments of a benchmark.
+    '''
+    parser.add_argument('--output', default='',
+                        help='path of the JSON file the results are written to')
+    parser.add_argument('--baseline', default='',
+                        help='path of the JSON results of a previous run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='relative change reported as a regression (default: %(default)s)')
+
+
+def compare_results(results: List[Dict[str, object]], baseline: List[Dict[str, object]],
+                    key: Callable[[Dict[str, object]], Tuple[object, ...]],
+                    compare_result: Callable[[Dict[str, object], Dict[str, object], float],
+                                             List[str]],
+                    tolerance: float = 0.2) -> List[str]:
+    '''
+    Compares results with the results of a baseline run, one pair of results with the
+    same key at a time.
+
+    Parameters
+    ----------
+    results : List[Dict[str, object]]
+        The results of this run.
+    baseline : List[Dict[str, object]]
+        The results of the baseline run.
+    key : Callable[[Dict[str, object]], Tuple[object, ...]]
+        Returns what a result measures, such as its stage and number of rows.
+    compare_result : Callable[[Dict[str, object], Dict[str, object], float], List[str]]
+        Prints the ratios of a result to its baseline result, given with the tolerance,
+        and returns the description of its regressions.
+    tolerance : float
+        The relative change of a measure reported as a regression.
+
+    Returns
+    ----------
+    List[str]
+        The description of every regression.
+    '''
+    baseline_results = {key(result): result for result in baseline}
+    regressions = []
+
+    for result in results:
+        previous = baseline_results.get(key(result))
+        if previous is not None:
+            regressions.extend(compare_result(result, previous, tolerance))
+
+    return regressions
+
+
+def report_results(arguments: argparse.Namespace, results: List[Dict[str, object]],
+                   metadata: Dict[str, object],
+                   key: Callable[[Dict[str, object]], Tuple[object, ...]],
+                   compare_result: Callable[[Dict[str, object], Dict[str, object], float],
+                                            List[str]]):
+    '''
+    Writes the results to `arguments.output` and compares them with the results in
+    `arguments.baseline`, when given. Exits with status 1 when there are regressions.
+
+    Parameters
+    ----------
+    arguments : argparse.Namespace
+        The arguments added by `add_result_arguments`.
+    results : List[Dict[str, object]]
+        The results of this run.
+    metadata : Dict[str, object]
+        The settings of the run, written with the results.
+    key : Callable[[Dict[str, object]], Tuple[object, ...]]
+        Returns what a result measures (see `compare_results`).
+    compare_result : Callable[[Dict[str, object], Dict[str, object], float], List[str]]
+        Compares a result with its baseline result (see `compare_results`).
+    '''
+    if arguments.output:
+        with open(os.path.join(INVOCATION_DIR, arguments.output), 'w',
+                  encoding='utf-8') as output_file:
+            json.dump({
+                'commit': git_commit(),
+                'created_at': datetime.now(timezone.utc).isoformat(),
+                'python': platform.python_version(),
+                **metadata,
+                'results': results
+            }, output_file, indent=2)
+
+    if arguments.baseline:
+        with open(os.path.join(INVOCATION_DIR, arguments.baseline),
+                  encoding='utf-8') as baseline_file:
+            regressions = compare_results(
+                results, json.load(baseline_file)['results'], key, compare_result,
+                arguments.tolerance)
+
+        for regression in regressions:
+            print(f'Regression: {regression}')
+
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,531 @@
+'''
+HTTP load test of the models monitoring API.
+
+The FastAPI `app` is started in this process by uvicorn, on a free local port, and
+driven over HTTP by `--concurrency` client threads, each sending requests one after
+the other on its own keep-alive connection for `--duration` seconds, after a
+`--warmup` whose requests are not counted. Each concurrency level is run in turn. With
+`--url`, an API already running elsewhere, such as several uvicorn workers, is driven
+instead.
+
+The requests are drawn from a mix of endpoints weighted by `--mix`:
+
+- `performance`: a POST /v1/performance with a JSON body of records.
+- `aderencia`: a POST /v1/aderencia with the path of a CSV file of records, with the
+    result cache bypassed unless `--adherence-cache` is given.
+
+The records of every body and file are the records of `app/datasets/batch_records.json`
+resampled to each of the `--sizes`. `--bodies` distinct payloads are generated for
+each size and sent in turn, so fewer bodies mean more hits of the score cache. The
+payloads are generated before the run and the files are written to a temporary
+directory, which must be readable by the API when it runs elsewhere.
+
+The report holds, for each concurrency level, endpoint and size, and for all the
+requests of a level together: the number of requests, the requests per second, the
+50th, 95th and 99th percentile latencies and the error rate, where any response but
+200 OK and any connection error is an error. The results are printed and written as
+JSON, so a run can be compared with a run of another commit or configuration with
+`--baseline`. The client threads share the interpreter of an in-process API, which
+adds a little latency of their own; drive an API started apart with `--url` for
+absolute numbers.
+
+Run it from the repository root:
+
+    python benchmark/load_benchmark.py --concurrency 1 4 16 --output load.json
+    python benchmark/load_benchmark.py --mix performance=3 aderencia=1 --baseline load.json
+
+Classes:
+----------
+- Payload:
+    A request of the load test.
+
+- LocalServer:
+    The API served by uvicorn in a thread of this process.
+
+Functions:
+----------
+- parse_mix(items: Sequence[str]) -> Dict[str, float]:
+    Parses the `endpoint=weight` items of the request mix.
+
+- build_payloads(sizes: Sequence[int], bodies: int, mix: Dict[str, float], data_dir: str,
+                 adherence_cache: bool, seed: int) -> List[Payload]:
+    Generates the requests of the load test from the batch records.
+
+- run_level(url: str, payloads: Sequence[Payload], weights: Sequence[float],
+            concurrency: int, duration: float, warmup: float,
+            seed: int) -> List[Tuple[str, int, float, bool]]:
+    Sends requests from concurrent clients for a given duration.
+
+- summarize(samples: Sequence[Tuple[str, int, float, bool]], concurrency: int,
+            duration: float) -> List[Dict[str, object]]:
+    Calculates the throughput, latency percentiles and error rate of the samples.
+
+- run_benchmarks(url: str, concurrency_levels: Sequence[int], payloads: Sequence[Payload],
+                 mix: Dict[str, float], duration: float, warmup: float,
+                 seed: int) -> List[Dict[str, object]]:
+    Runs the load test at each concurrency level.
+
+- result_key(result: Dict[str, object]) -> Tuple[object, ...]:
+    Returns the concurrency level, endpoint and size of a result.
+
+- compare_result(result: Dict[str, object], previous: Dict[str, object],
+                 tolerance: float) -> List[str]:
+    Compares a result with the result of a baseline run.
+'''
+
+import argparse
+import http.client
+import json
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+from urllib.parse import urlsplit
+
+import numpy as np
+
+from common import APP_DIR, BATCH_RECORDS_PATH, add_result_arguments, report_results
+
+
+ENDPOINT_PATHS = {'performance': '/v1/performance', 'aderencia': '/v1/aderencia'}
+DEFAULT_MIX = ('performance=1',)
+DEFAULT_SIZES = (200,)
+DEFAULT_CONCURRENCY = (1, 4, 16)
+
+# Seconds a client waits for a response before counting it as an error.
+REQUEST_TIMEOUT = 300
+
+# Throughputs of the baseline lower than this are too noisy to report as regressions.
+MIN_COMPARED_REQUESTS_PER_SECOND = 1.0
+
+
+class Payload(NamedTuple):
+    '''
+    A request of the load test.
+
+    Attributes:
+        endpoint (str): The key of the endpoint in ENDPOINT_PATHS.
+        size (int): The number of records of the body or file.
+        body (bytes): The JSON request body.
+    '''
+    endpoint: str
+    size: int
+    body: bytes
+
+
+class LocalServer:
+    '''
+    The API served by uvicorn in a thread of this process, on a free local port. The
+    application is imported from `app`, whose relative paths it resolves.
+    '''
+
+    def __init__(self):
+        self.url = ''
+        self._server = None
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self, timeout: float = 120):
+        '''
+        Starts the API and waits for its startup to finish.
+
+        Parameters
+        ----------
+        timeout : float
+            The seconds the startup may take.
+
+        Raises
+        ----------
+        RuntimeError
+            If the API doesn't start in time.
+        '''
+        # The API modules are imported from, and resolve their relative paths against, `app`.
+        sys.path.insert(0, APP_DIR)
+        os.chdir(APP_DIR)
+        import uvicorn  # pylint: disable=import-outside-toplevel
+        from main import app  # pylint: disable=import-outside-toplevel
+
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind(('127.0.0.1', 0))
+        self.url = f'http://127.0.0.1:{listener.getsockname()[1]}'
+
+        self._server = uvicorn.Server(uvicorn.Config(
+            app, log_level='warning', access_log=False, lifespan='on'))
+        # The signals are handled by the main thread of the benchmark.
+        self._server.install_signal_handlers = lambda: None
+        self._thread = threading.Thread(
+            target=self._server.run, kwargs={'sockets': [listener]}, daemon=True)
+        self._thread.start()
+
+        deadline = time.monotonic() + timeout
+        while not self._server.started:
+            if not self._thread.is_alive() or time.monotonic() > deadline:
+                raise RuntimeError('The API did not start.')
+            time.sleep(0.05)
+
+    def stop(self):
+        '''Stops the API and waits for its open requests to finish.'''
+        if self._thread is not None:
+            self._server.should_exit = True
+            self._thread.join()
+
+
+def parse_mix(items: Sequence[str]) -> Dict[str, float]:
+    '''
+    Parses the `endpoint=weight` items of the request mix. An item without a weight
+    has weight 1.
+
+    Parameters
+    ----------
+    items : Sequence[str]
+        The items of the mix.
+
+    Raises
+    ----------
+    ValueError
+        If an endpoint is unknown or a weight is not a positive number.
+
+    Returns
+    ----------
+    Dict[str, float]
+        The weight of each endpoint.
+    '''
+    mix = {}
+
+    for item in items:
+        endpoint, _, weight = item.partition('=')
+        if endpoint not in ENDPOINT_PATHS:
+            raise ValueError(
+                f'Unknown endpoint: {endpoint}. Must be one of: {", ".join(ENDPOINT_PATHS)}.')
+        mix[endpoint] = float(weight or 1)
+        if mix[endpoint] <= 0:
+            raise ValueError(f'The weight of {endpoint} must be positive, not {weight}.')
+
+    return mix
+
+
+def build_payloads(sizes: Sequence[int], bodies: int, mix: Dict[str, float], data_dir: str,
+                   adherence_cache: bool = False, seed: int = 0) -> List[Payload]:
+    '''
+    Generates the requests of the load test: `bodies` distinct payloads of each size
+    for each endpoint of the mix, whose records are the batch records resampled with
+    replacement.
+
+    Parameters
+    ----------
+    sizes : Sequence[int]
+        The number of records of the bodies and files.
+    bodies : int
+        The number of distinct payloads of each endpoint and size.
+    mix : Dict[str, float]
+        The weight of each endpoint.
+    data_dir : str
+        The directory the CSV files of the /aderencia requests are written to.
+    adherence_cache : bool
+        Whether the /aderencia requests may be answered from the result cache.
+    seed : int
+        The seed of the random generator.
+
+    Returns
+    ----------
+    List[Payload]
+        The requests, by endpoint and size.
+    '''
+    import pandas as pd  # pylint: disable=import-outside-toplevel
+
+    with open(BATCH_RECORDS_PATH) as file:
+        records = json.load(file)
+
+    rng = np.random.default_rng(seed)
+    payloads = []
+
+    for endpoint in mix:
+        for size in sizes:
+            for index in range(bodies):
+                sample = [records[row] for row in rng.integers(0, len(records), size)]
+
+                if endpoint == 'performance':
+                    payloads.append(Payload(endpoint, size, json.dumps(sample).encode()))
+                else:
+                    path = os.path.join(data_dir, f'records-{size}-{index}.csv')
+                    pd.DataFrame.from_records(sample).to_csv(path, index=False)
+                    payloads.append(Payload(endpoint, size, json.dumps(
+                        {'path': path, 'cache': adherence_cache}).encode()))
+
+    return payloads
+
+
+def run_level(url: str, payloads: Sequence[Payload], weights: Sequence[float],
+              concurrency: int, duration: float, warmup: float = 0,
+              seed: int = 0) -> List[Tuple[str, int, float, bool]]:
+    '''
+    Sends requests from concurrent clients for a given duration. Each client draws
+    its requests from the payloads with the given weights and sends them one after
+    the other on its own keep-alive connection.
+
+    Parameters
+    ----------
+    url : str
+        The base URL of the API.
+    payloads : Sequence[Payload]
+        The requests.
+    weights : Sequence[float]
+        The probability of each request.
+    concurrency : int
+        The number of clients.
+    duration : float
+        The seconds the requests are measured for.
+    warmup : float
+        The seconds requests are sent for before they are measured.
+    seed : int
+        The seed of the random generators of the clients.
+
+    Returns
+    ----------
+    List[Tuple[str, int, float, bool]]
+        The endpoint, size, latency in seconds and error flag of each measured request.
+    '''
+    address = urlsplit(url)
+    samples: List[Tuple[str, int, float, bool]] = []
+    samples_lock = threading.Lock()
+    start_time = time.perf_counter() + warmup
+    end_time = start_time + duration
+    client_seeds = np.random.SeedSequence(seed).spawn(concurrency)
+
+    def client(client_seed: np.random.SeedSequence):
+        rng = np.random.default_rng(client_seed)
+        connection = http.client.HTTPConnection(
+            address.hostname, address.port, timeout=REQUEST_TIMEOUT)
+        client_samples = []
+
+        while True:
+            payload = payloads[rng.choice(len(payloads), p=weights)]
+            sent = time.perf_counter()
+            if sent >= end_time:
+                break
+
+            try:
+                connection.request('POST', ENDPOINT_PATHS[payload.endpoint], body=payload.body,
+                                   headers={'Content-Type': 'application/json'})
+                response = connection.getresponse()
+                response.read()
+                error = response.status != 200
+            except (OSError, http.client.HTTPException):
+                error = True
+                connection.close()
+
+            if sent >= start_time:
+                client_samples.append(
+                    (payload.endpoint, payload.size, time.perf_counter() - sent, error))
+
+        connection.close()
+        with samples_lock:
+            samples.extend(client_samples)
+
+    clients = [threading.Thread(target=client, args=(client_seed,))
+               for client_seed in client_seeds]
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+
+    return samples
+
+
+def summarize(samples: Sequence[Tuple[str, int, float, bool]], concurrency: int,
+              duration: float) -> List[Dict[str, object]]:
+    '''
+    Calculates the throughput, latency percentiles and error rate of the requests of
+    a concurrency level, for each endpoint and size and for all of them together,
+    with the endpoint 'all' and the size 0.
+
+    Parameters
+    ----------
+    samples : Sequence[Tuple[str, int, float, bool]]
+        The endpoint, size, latency in seconds and error flag of each request.
+    concurrency : int
+        The number of clients.
+    duration : float
+        The seconds the requests were measured for.
+
+    Returns
+    ----------
+    List[Dict[str, object]]
+        The statistics of each group of requests.
+    '''
+    groups: Dict[Tuple[str, int], List[Tuple[float, bool]]] = {('all', 0): []}
+    for endpoint, size, latency, error in samples:
+        groups.setdefault((endpoint, size), []).append((latency, error))
+        groups[('all', 0)].append((latency, error))
+
+    results = []
+    for endpoint, size in sorted(groups, key=lambda group: (group[0] != 'all', group)):
+        group = groups[(endpoint, size)]
+        latencies = np.array([latency for latency, _ in group])
+        errors = sum(error for _, error in group)
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) if group else (np.nan,) * 3
+
+        results.append({
+            'concurrency': concurrency,
+            'endpoint': endpoint,
+            'size': size,
+            'requests': len(group),
+            'requests_per_second': len(group) / duration,
+            'p50_seconds': float(p50),
+            'p95_seconds': float(p95),
+            'p99_seconds': float(p99),
+            'error_rate': errors / len(group) if group else 0.0
+        })
+
+    return results
+
+
+def run_benchmarks(url: str, concurrency_levels: Sequence[int], payloads: Sequence[Payload],
+                   mix: Dict[str, float], duration: float = 10, warmup: float = 2,
+                   seed: int = 0) -> List[Dict[str, object]]:
+    '''
+    Runs the load test at each concurrency level. The weight of each endpoint is
+    shared evenly by its payloads.
+
+    Parameters
+    ----------
+    url : str
+        The base URL of the API.
+    concurrency_levels : Sequence[int]
+        The number of clients of each level.
+    payloads : Sequence[Payload]
+        The requests.
+    mix : Dict[str, float]
+        The weight of each endpoint.
+    duration : float
+        The seconds the requests of each level are measured for.
+    warmup : float
+        The seconds requests are sent for before each level is measured.
+    seed : int
+        The seed of the random generators of the clients.
+
+    Returns
+    ----------
+    List[Dict[str, object]]
+        The statistics of each concurrency level, endpoint and size.
+    '''
+    payload_counts = {endpoint: sum(payload.endpoint == endpoint for payload in payloads)
+                      for endpoint in mix}
+    weights = np.array([mix[payload.endpoint] / payload_counts[payload.endpoint]
+                        for payload in payloads])
+    weights /= weights.sum()
+
+    results = []
+    for concurrency in concurrency_levels:
+        samples = run_level(url, payloads, weights, concurrency, duration, warmup, seed)
+
+        for result in summarize(samples, concurrency, duration):
+            results.append(result)
+            print(f"{result['concurrency']:>4} clients {result['endpoint']:<12} "
+                  f"{result['size']:>7} rows {result['requests_per_second']:>9.1f} req/s "
+                  f"p50 {result['p50_seconds'] * 1000:>9.2f} ms "
+                  f"p95 {result['p95_seconds'] * 1000:>9.2f} ms "
+                  f"p99 {result['p99_seconds'] * 1000:>9.2f} ms "
+                  f"errors {result['error_rate']:>7.2%}", flush=True)
+
+    return results
+
+
+def result_key(result: Dict[str, object]) -> Tuple[object, ...]:
+    '''Returns the concurrency level, endpoint and size of a result.'''
+    return result['concurrency'], result['endpoint'], result['size']
+
+
+def compare_result(result: Dict[str, object], previous: Dict[str, object],
+                   tolerance: float = 0.2) -> List[str]:
+    '''
+    Compares a result with the result of a baseline run, printing the ratio of its
+    throughput and 95th percentile latency.
+
+    Parameters
+    ----------
+    result : Dict[str, object]
+        The result of this run.
+    previous : Dict[str, object]
+        The result of the baseline run with the same concurrency, endpoint and size.
+    tolerance : float
+        The relative decrease of a throughput, or increase of a latency, reported as
+        a regression.
+
+    Returns
+    ----------
+    List[str]
+        The description of every regression.
+    '''
+    if previous['requests_per_second'] < MIN_COMPARED_REQUESTS_PER_SECOND:
+        return []
+
+    name = f"{result['concurrency']} clients {result['endpoint']} {result['size']} rows"
+    throughput_ratio = result['requests_per_second'] / previous['requests_per_second']
+    latency_ratio = result['p95_seconds'] / max(previous['p95_seconds'], 1e-9)
+    print(f'{name:<40} req/s x{throughput_ratio:>6.2f} p95 x{latency_ratio:>6.2f}')
+
+    regressions = []
+    if throughput_ratio < 1 - tolerance:
+        regressions.append(f'{name}: req/s x{throughput_ratio:.2f}')
+    if latency_ratio > 1 + tolerance:
+        regressions.append(f'{name}: p95 x{latency_ratio:.2f}')
+    if result['error_rate'] > previous['error_rate']:
+        regressions.append(
+            f"{name}: error rate {previous['error_rate']:.2%} -> {result['error_rate']:.2%}")
+
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Measures the throughput and latency of the API under concurrent load.')
+    parser.add_argument('--url', default='',
+                        help='base URL of a running API to drive, instead of starting it here')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=list(DEFAULT_CONCURRENCY),
+                        help='numbers of concurrent clients (default: %(default)s)')
+    parser.add_argument('--mix', nargs='+', default=list(DEFAULT_MIX),
+                        help='endpoint=weight items of the request mix (default: %(default)s)')
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES),
+                        help='records of each body or file (default: %(default)s)')
+    parser.add_argument('--bodies', type=int, default=8,
+                        help='distinct payloads of each endpoint and size (default: %(default)s)')
+    parser.add_argument('--adherence-cache', action='store_true',
+                        help='let the /aderencia requests be answered from the result cache')
+    parser.add_argument('--duration', type=float, default=10,
+                        help='seconds measured at each concurrency level (default: %(default)s)')
+    parser.add_argument('--warmup', type=float, default=2,
+                        help='seconds of requests before each level (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed of the random generators (default: %(default)s)')
+    add_result_arguments(parser)
+    arguments = parser.parse_args()
+
+    request_mix = parse_mix(arguments.mix)
+
+    with tempfile.TemporaryDirectory() as payload_dir:
+        load_payloads = build_payloads(arguments.sizes, arguments.bodies, request_mix,
+                                       payload_dir, arguments.adherence_cache, arguments.seed)
+
+        server = LocalServer()
+        if not arguments.url:
+            server.start()
+
+        try:
+            benchmark_results = run_benchmarks(
+                arguments.url or server.url, arguments.concurrency, load_payloads, request_mix,
+                arguments.duration, arguments.warmup, arguments.seed)
+        finally:
+            server.stop()
+
+    report_results(arguments, benchmark_results, {
+        'url': arguments.url,
+        'mix': request_mix,
+        'sizes': arguments.sizes,
+        'bodies': arguments.bodies,
+        'adherence_cache': arguments.adherence_cache,
+        'duration': arguments.duration
+    }, result_key, compare_result)
@@ -0,0 +1,220 @@
+'''
+Cold start report of the models monitoring API.
+
+Each run starts a fresh interpreter in `app`, as a new container of the API does, which
+imports `main` under `python -X importtime`, runs the startup of the API in the given
+mode (see `api.endpoints.startup`) and then the /performance computation of the sample
+body once, as the first request would. The report holds the best of `--repeat` runs of:
+
+- `import main`: the time to import the application.
+- `startup <step>`: the time of each step of the startup (none in the lazy mode).
+- `first request`: the time of the first /performance computation.
+- `package <name>`: the cumulative import time of each top-level package, where it was
+    first imported, for the `--top` heaviest ones.
+
+The results are printed and written as JSON, so a release can be compared with a run
+of another commit with `--baseline`. The import times include the small overhead of
+`-X importtime`.
+
+Run it from the repository root:
+
+    python benchmark/startup_benchmark.py --output startup.json
+    python benchmark/startup_benchmark.py --mode lazy --baseline startup.json
+
+Functions:
+----------
+- parse_import_times(report: str) -> Dict[str, float]:
+    Parses the output of `-X importtime` into the cumulative time of each top-level package.
+
+- run_startup(mode: str) -> Dict[str, float]:
+    Measures one cold start of the API in a fresh interpreter.
+
+- run_benchmarks(mode: str, repeat: int, top: int) -> List[Dict[str, object]]:
+    Measures the best cold start of the API over several runs.
+
+- result_key(result: Dict[str, object]) -> Tuple[object, ...]:
+    Returns the measure of a result.
+
+- compare_result(result: Dict[str, object], previous: Dict[str, object],
+                 tolerance: float) -> List[str]:
+    Compares a result with the result of a baseline run.
+'''
+
+import argparse
+import json
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+from common import APP_DIR, add_result_arguments, report_results
+
+
+# Measures whose baseline is shorter than this are too noisy to report as regressions.
+MIN_COMPARED_SECONDS = 0.01
+
+# Run in `app` by a fresh interpreter: prints the durations of the cold start as JSON.
+STARTUP_SCRIPT = '''
+import json, sys, time
+start = time.perf_counter()
+import main
+durations = {'import main': time.perf_counter() - start}
+
+from api.endpoints.startup import Startup, SAMPLE_BODY_PATH
+from api.endpoints.performance import evaluate_performance
+startup = Startup(mode=sys.argv[1])
+startup.run()
+durations.update({'startup ' + step: seconds for step, seconds in startup.durations.items()})
+
+with open(SAMPLE_BODY_PATH, 'rb') as file:
+    body = file.read()
+start = time.perf_counter()
+evaluate_performance(body, None)
+durations['first request'] = time.perf_counter() - start
+
+print(json.dumps(durations))
+'''
+
+
+def parse_import_times(report: str) -> Dict[str, float]:
+    '''
+    Parses the output of `-X importtime` into the cumulative import time of each
+    top-level package, taken where the package was first imported.
+
+    Parameters
+    ----------
+    report : str
+        The standard error of an interpreter run with `-X importtime`.
+
+    Returns
+    ----------
+    Dict[str, float]
+        The cumulative import time in seconds by top-level package name.
+    '''
+    packages: Dict[str, float] = {}
+
+    for line in report.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        package = name.strip().split('.')[0]
+        packages[package] = max(packages.get(package, 0.0), int(cumulative) / 1e6)
+
+    return packages
+
+
+def run_startup(mode: str = 'eager') -> Dict[str, float]:
+    '''
+    Measures one cold start of the API in a fresh interpreter.
+
+    Parameters
+    ----------
+    mode : str
+        The startup mode: 'eager' or 'lazy'.
+
+    Raises
+    ----------
+    subprocess.CalledProcessError
+        If the interpreter fails.
+
+    Returns
+    ----------
+    Dict[str, float]
+        The duration in seconds of each measure.
+    '''
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', STARTUP_SCRIPT, mode], cwd=APP_DIR,
+        capture_output=True, text=True, check=True)
+
+    durations = json.loads(process.stdout.strip().splitlines()[-1])
+    packages = parse_import_times(process.stderr)
+    # The application module itself is reported as `import main`.
+    packages.pop('main', None)
+    durations.update({f'package {package}': seconds for package, seconds in packages.items()})
+
+    return durations
+
+
+def run_benchmarks(mode: str = 'eager', repeat: int = 5, top: int = 15) -> List[Dict[str, object]]:
+    '''
+    Measures the best cold start of the API over several runs.
+
+    Parameters
+    ----------
+    mode : str
+        The startup mode: 'eager' or 'lazy'.
+    repeat : int
+        The number of runs.
+    top : int
+        The number of heaviest top-level packages reported.
+
+    Returns
+    ----------
+    List[Dict[str, object]]
+        The measure and best duration in seconds of each measurement.
+    '''
+    best: Dict[str, float] = {}
+    for _ in range(repeat):
+        for measure, seconds in run_startup(mode).items():
+            best[measure] = min(best.get(measure, seconds), seconds)
+
+    packages = sorted((measure for measure in best if measure.startswith('package ')),
+                      key=best.get, reverse=True)[:top]
+    measures = [measure for measure in best if not measure.startswith('package ')] + packages
+
+    results = []
+    for measure in measures:
+        results.append({'measure': measure, 'seconds': best[measure]})
+        print(f'{measure:<40} {best[measure] * 1000:>11.2f} ms', flush=True)
+
+    return results
+
+
+def result_key(result: Dict[str, object]) -> Tuple[object, ...]:
+    '''Returns the measure of a result.'''
+    return (result['measure'],)
+
+
+def compare_result(result: Dict[str, object], previous: Dict[str, object],
+                   tolerance: float = 0.2) -> List[str]:
+    '''
+    Compares a result with the result of a baseline run, printing the ratio of its
+    duration.
+
+    Parameters
+    ----------
+    result : Dict[str, object]
+        The result of this run.
+    previous : Dict[str, object]
+        The result of the baseline run with the same measure.
+    tolerance : float
+        The relative increase of a duration reported as a regression.
+
+    Returns
+    ----------
+    List[str]
+        The description of every regression.
+    '''
+    ratio = result['seconds'] / max(previous['seconds'], 1e-9)
+    print(f"{result['measure']:<40} time x{ratio:>6.2f}")
+
+    if ratio > 1 + tolerance and previous['seconds'] >= MIN_COMPARED_SECONDS:
+        return [f"{result['measure']}: time x{ratio:.2f}"]
+
+    return []
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Measures the cold start of the API: import, startup and first request.')
+    parser.add_argument('--mode', choices=('eager', 'lazy'), default='eager',
+                        help='startup mode of the API (default: %(default)s)')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='cold starts measured (default: %(default)s)')
+    parser.add_argument('--top', type=int, default=15,
+                        help='heaviest top-level packages reported (default: %(default)s)')
+    add_result_arguments(parser)
+    arguments = parser.parse_args()
+
+    benchmark_results = run_benchmarks(arguments.mode, arguments.repeat, arguments.top)
+    report_results(arguments, benchmark_results, {'mode': arguments.mode},
+                   result_key, compare_result)
@@ -0,0 +1,235 @@
+'''
+Microbenchmarks of the hot paths of the models monitoring API.
+
+The stages are run in-process, without the HTTP server, on synthetic batches that
+resample the records of `app/datasets/batch_records.json` to the requested sizes.
+Each stage is timed (best of `--repeat` runs) and run once more under `tracemalloc`
+to measure its peak memory. The results are printed and written as JSON, so a run
+can be compared with a run of another commit with `--baseline`.
+
+Run it from the repository root:
+
+    python benchmark/utils_benchmark.py --sizes 1000 10000 100000 --output results.json
+    python benchmark/utils_benchmark.py --baseline results.json
+
+Functions:
+----------
+- resample_records(records: List[dict], size: int, seed: int) -> List[dict]:
+    Resamples batch records with replacement to a synthetic batch of the given size.
+
+- measure(stage: Callable[[], object], repeat: int) -> Tuple[float, int]:
+    Measures the best time and the peak memory of a stage.
+
+- run_benchmarks(sizes: Sequence[int], repeat: int, seed: int) -> List[Dict[str, object]]:
+    Runs every stage on a synthetic batch of each size.
+
+- result_key(result: Dict[str, object]) -> Tuple[object, ...]:
+    Returns the stage and the number of rows of a result.
+
+- compare_result(result: Dict[str, object], previous: Dict[str, object],
+                 tolerance: float) -> List[str]:
+    Compares a result with the result of a baseline run.
+'''
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from common import APP_DIR, BATCH_RECORDS_PATH, add_result_arguments, report_results
+
+# The API modules are imported from, and resolve their relative paths against, `app`.
+sys.path.insert(0, APP_DIR)
+os.chdir(APP_DIR)
+
+# pylint: disable=wrong-import-position
+from api.endpoints.registry import MODEL_REGISTRY
+from api.endpoints.reference import REFERENCE_STORE
+from api.endpoints.validators import validate_performance_body
+from api.endpoints.utils import (
+    format_input_records, count_records_by_month, calculate_aucroc, calculate_ks,
+    calculate_js, get_pre_trained_model)
+
+
+DEFAULT_SIZES = (1000, 10000, 100000)
+
+
+def resample_records(records: List[dict], size: int, seed: int = 0) -> List[dict]:
+    '''
+    Resamples batch records with replacement to a synthetic batch of the given size.
+    The sampled records are shared, not copied, so the batch only costs its list.
+
+    Parameters
+    ----------
+    records : List[dict]
+        The batch records.
+    size : int
+        The number of records of the synthetic batch.
+    seed : int
+        The seed of the random generator.
+
+    Returns
+    ----------
+    List[dict]
+        The synthetic batch.
+    '''
+    indices = np.random.default_rng(seed).integers(0, len(records), size)
+
+    return [records[index] for index in indices]
+
+
+def measure(stage: Callable[[], object], repeat: int = 3) -> Tuple[float, int]:
+    '''
+    Measures the best time of a stage over `repeat` runs and its peak memory over one
+    more run under `tracemalloc`, which would slow the timed runs down.
+
+    Parameters
+    ----------
+    stage : Callable[[], object]
+        The stage.
+    repeat : int
+        The number of timed runs.
+
+    Returns
+    ----------
+    Tuple[float, int]
+        The best time in seconds and the peak of the memory allocated in bytes.
+    '''
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        stage()
+        best = min(best, time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        stage()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return best, peak
+
+
+def run_benchmarks(sizes: Sequence[int] = DEFAULT_SIZES, repeat: int = 3,
+                   seed: int = 0) -> List[Dict[str, object]]:
+    '''
+    Runs every stage on a synthetic batch of each size. The file-based stages
+    (`calculate_ks`, `calculate_js`) read the batch from a temporary CSV file and
+    use the reference profile of the model, as the /aderencia endpoint does.
+
+    Parameters
+    ----------
+    sizes : Sequence[int]
+        The number of records of each synthetic batch.
+    repeat : int
+        The number of timed runs of each stage.
+    seed : int
+        The seed of the random generator.
+
+    Returns
+    ----------
+    List[Dict[str, object]]
+        The stage, number of rows, best time in seconds and peak memory in bytes of
+        each measurement.
+    '''
+    with open(BATCH_RECORDS_PATH) as file:
+        records = json.load(file)
+
+    model_entry = MODEL_REGISTRY.get()
+    model = model_entry.scorer
+    reference = REFERENCE_STORE.get(model_entry)
+    results = []
+
+    def record(stage: str, rows: int, stage_function: Callable[[], object]):
+        seconds, peak_memory = measure(stage_function, repeat)
+        results.append({
+            'stage': stage, 'rows': rows, 'seconds': seconds, 'peak_memory_bytes': peak_memory})
+        print(f'{stage:<28} {rows:>9} rows {seconds * 1000:>11.2f} ms '
+              f'{peak_memory / 2 ** 20:>10.1f} MiB', flush=True)
+
+    record('get_pre_trained_model', 0, get_pre_trained_model)
+
+    with tempfile.TemporaryDirectory() as temporary_dir:
+        for size in sizes:
+            body = resample_records(records, size, seed)
+            data_frame = format_input_records(body)
+            path = os.path.join(temporary_dir, f'batch-{size}.csv')
+            data_frame.to_csv(path, index=False)
+
+            record('validate_performance_body', size, lambda: validate_performance_body(body))
+            record('format_input_records', size, lambda: format_input_records(body))
+            record('count_records_by_month', size, lambda: count_records_by_month(data_frame))
+            x_input = data_frame.drop(['TARGET'], axis=1)
+            record('sklearn_predict_proba', size, lambda: model_entry.model.predict_proba(x_input))
+            record('scorer_predict_proba', size, lambda: model.predict_proba(x_input))
+            record('calculate_aucroc', size, lambda: calculate_aucroc(data_frame, model))
+            record('calculate_ks', size,
+                   lambda: calculate_ks(path, model, reference.sorted_scores))
+            record('calculate_js', size,
+                   lambda: calculate_js(path, model, reference.histogram))
+
+            del body, data_frame, x_input
+            os.remove(path)
+
+    return results
+
+
+def result_key(result: Dict[str, object]) -> Tuple[object, ...]:
+    '''Returns the stage and the number of rows of a result.'''
+    return result['stage'], result['rows']
+
+
+def compare_result(result: Dict[str, object], previous: Dict[str, object],
+                   tolerance: float = 0.2) -> List[str]:
+    '''
+    Compares a result with the result of a baseline run, printing the ratio of its
+    time and peak memory.
+
+    Parameters
+    ----------
+    result : Dict[str, object]
+        The result of this run.
+    previous : Dict[str, object]
+        The result of the baseline run with the same stage and number of rows.
+    tolerance : float
+        The relative increase of time or peak memory reported as a regression.
+
+    Returns
+    ----------
+    List[str]
+        The description of every regression.
+    '''
+    time_ratio = result['seconds'] / max(previous['seconds'], 1e-9)
+    memory_ratio = result['peak_memory_bytes'] / max(previous['peak_memory_bytes'], 1)
+    print(f"{result['stage']:<28} {result['rows']:>9} rows "
+          f'time x{time_ratio:>6.2f}  memory x{memory_ratio:>6.2f}')
+
+    return [f"{result['stage']} ({result['rows']} rows): {metric} x{ratio:.2f}"
+            for metric, ratio in (('time', time_ratio), ('memory', memory_ratio))
+            if ratio > 1 + tolerance]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Benchmarks the hot paths of the API on synthetic batches.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES),
+                        help='numbers of records of the synthetic batches (default: %(default)s)')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='timed runs of each stage (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed of the synthetic batches (default: %(default)s)')
+    add_result_arguments(parser)
+    arguments = parser.parse_args()
+
+    benchmark_results = run_benchmarks(arguments.sizes, arguments.repeat, arguments.seed)
+    report_results(arguments, benchmark_results,
+                   {'numpy': np.__version__, 'pandas': pd.__version__},
+                   result_key, compare_result)
@@ -14,10 +14,44 @@ test_invalid_body_schema():
 test_successful():
     Tests the successful behavior of the endpoint when a valid request body is sent.
 
+test_selected_statistics():
+    Tests the behavior of the endpoint when the statistics are selected in the request body.
+
+test_unknown_statistic():
+    Tests the behavior of the endpoint when an unknown statistic is requested.
+
+test_chunked():
+    Tests that reading the input file in chunks gives the same statistics.
+
+test_job():
+    Tests that an adherence job returns the same statistics as the synchronous endpoint.
+
+test_job_errors():
+    Tests the behavior of the job endpoints for a failed job and an unknown job.
+
+test_cache():
+    Tests that repeated requests are answered from the result cache unless bypassed.
+    Skipped when the API runs the process pool, whose caches are per process.
+
+test_batch():
+    Tests that a batch request streams the statistics or the error of each file.
+
+test_feature_drift():
+    Tests that the feature drift endpoint returns the drift of every model input.
+
+test_confidence_intervals():
+    Tests that the bootstrap confidence interval of each statistic brackets the statistic.
+
+wait_for_job(job_url: str, timeout: float = 60):
+    Helper function that polls the status of a job until it finishes.
+
 get_testing_body(path: str = './../batch_records.json'):
     Helper function that returns a testing batch records body.
 '''
 
+import json
+import time
+import pytest
 import requests
 
 
@@ -64,3 +98,243 @@ def test_successful():
     response_body = response.json()
     assert isinstance(response_body['ks_test'], dict)
     assert isinstance(response_body['js_divergence'], float)
+
+
+def test_selected_statistics():
+    '''
+    Test that the API returns only the statistics selected in the request body.
+    '''
+    url = base + '/v1/aderencia'
+    body = {
+        'path': './../app/datasets/credit_01/train.gz',
+        'statistics': ['psi', 'ks_test']
+    }
+
+    response = requests.post(url, json=body, headers=headers)
+
+    assert response.status_code == 200
+
+    response_body = response.json()
+    assert set(response_body) == {'psi', 'ks_test'}
+    assert isinstance(response_body['psi'], float)
+    assert isinstance(response_body['ks_test'], dict)
+
+
+def test_unknown_statistic():
+    '''
+    Test that the API returns a 400 error when an unknown statistic is requested.
+    '''
+    url = base + '/v1/aderencia'
+    body = {
+        'path': './../app/datasets/credit_01/train.gz',
+        'statistics': ['auc']
+    }
+
+    response = requests.post(url, json=body, headers=headers)
+
+    assert response.status_code == 400
+    assert response.json()['error'].startswith('Body schema is invalid')
+
+
+def test_chunked():
+    '''
+    Test that the API returns the same statistics when the input file is read in chunks.
+    '''
+    url = base + '/v1/aderencia'
+    body = {'path': './../app/datasets/credit_01/train.gz'}
+
+    response = requests.post(url, json=body, headers=headers)
+    chunked_response = requests.post(
+        url, json={**body, 'chunk_size': 1000}, headers=headers)
+
+    assert chunked_response.status_code == 200
+    assert chunked_response.json() == response.json()
+
+
+def test_job():
+    '''
+    Test that an adherence job returns the same statistics as the synchronous endpoint.
+    '''
+    url = base + '/v1/aderencia'
+    body = {'path': './../app/datasets/credit_01/train.gz'}
+
+    response = requests.post(url, json=body, headers=headers)
+    job_response = requests.post(url + '/jobs', json=body, headers=headers)
+
+    assert job_response.status_code == 202
+    assert job_response.json()['status'] in ('queued', 'running')
+
+    job_url = base + job_response.headers['Location']
+    status = wait_for_job(job_url)
+
+    assert status['status'] == 'succeeded'
+
+    result_response = requests.get(job_url + '/result')
+
+    assert result_response.status_code == 200
+    assert result_response.json() == response.json()
+
+
+def test_job_errors():
+    '''
+    Test that a job with an invalid path fails with a 404 result and that an unknown
+    job returns a 404 error.
+    '''
+    url = base + '/v1/aderencia/jobs'
+
+    job_response = requests.post(url, json={'path': './missing.gz'}, headers=headers)
+    job_url = base + job_response.headers['Location']
+    status = wait_for_job(job_url)
+
+    assert status['status'] == 'failed'
+    assert status['error'] == 'No such file or directory in the provide path.'
+    assert requests.get(job_url + '/result').status_code == 404
+
+    response = requests.get(url + '/missing')
+
+    assert response.status_code == 404
+    assert response.json()['error'].startswith('No such job: missing.')
+
+
+def test_cache():
+    '''
+    Test that a repeated request is answered from the result cache with the same
+    statistics, and that the cache flag set to false bypasses it.
+    '''
+    if requests.get(base + '/ready').json()['executor'] == 'process':
+        pytest.skip('Each worker process of the process pool has a cache and counts of its own.')
+    url = base + '/v1/aderencia'
+    body = {'path': './../app/datasets/credit_01/train.gz', 'statistics': ['psi']}
+
+    response = requests.post(url, json=body, headers=headers)
+    statistics = requests.get(url + '/cache').json()
+    cached_response = requests.post(url, json=body, headers=headers)
+    cached_statistics = requests.get(url + '/cache').json()
+
+    assert cached_response.json() == response.json()
+    assert cached_statistics['hits'] == statistics['hits'] + 1
+
+    bypass_response = requests.post(url, json={**body, 'cache': False}, headers=headers)
+    bypass_statistics = requests.get(url + '/cache').json()
+
+    assert bypass_response.json() == response.json()
+    assert bypass_statistics['hits'] == cached_statistics['hits']
+    assert bypass_statistics['misses'] == cached_statistics['misses']
+
+
+def test_batch():
+    '''
+    Test that a batch request streams one NDJSON line per file, with the statistics
+    of each file or its error, that a glob pattern selects the regular files only and
+    that a batch of too many files is rejected.
+    '''
+    url = base + '/v1/aderencia'
+    path = './../app/datasets/credit_01/train.gz'
+
+    response = requests.post(url, json={'path': path}, headers=headers)
+    batch_response = requests.post(
+        url + '/batch', json={'paths': [path, './missing.gz']}, headers=headers)
+
+    assert batch_response.status_code == 200
+
+    lines = {line['path']: line for line in map(json.loads, batch_response.iter_lines())}
+
+    assert lines[path]['result'] == response.json()
+    assert lines['./missing.gz']['status'] == 404
+    assert lines['./missing.gz']['error'] == 'No such file or directory in the provide path.'
+
+    glob_response = requests.post(
+        url + '/batch', json={'glob': './../app/datasets/credit_01/t*.gz'}, headers=headers)
+    paths = [json.loads(line)['path'] for line in glob_response.iter_lines()]
+
+    assert sorted(paths) == ['./../app/datasets/credit_01/test.gz', path]
+
+    directory_response = requests.post(
+        url + '/batch', json={'glob': './../app/datasets/*'}, headers=headers)
+    assert directory_response.status_code == 200
+    assert './../app/datasets/credit_01' not in [
+        json.loads(line)['path'] for line in directory_response.iter_lines()]
+
+    too_many_response = requests.post(
+        url + '/batch', json={'paths': [path] * 101}, headers=headers)
+    assert too_many_response.status_code == 400
+
+
+def test_feature_drift():
+    '''
+    Test that the API returns the drift of every model input, with the KS test of the
+    numeric ones, and the same drift when the input file is read in chunks.
+    '''
+    url = base + '/v1/aderencia/features'
+    body = {'path': './../app/datasets/credit_01/train.gz', 'cache': False}
+
+    response = requests.post(url, json=body, headers=headers)
+
+    assert response.status_code == 200
+
+    features = response.json()['features']
+    assert features['IDADE']['type'] == 'numeric'
+    assert isinstance(features['IDADE']['ks_test'], dict)
+    assert features['VAR2']['type'] == 'categorical'
+    assert isinstance(features['VAR2']['psi'], float)
+    assert isinstance(features['VAR2']['js_divergence'], float)
+
+    chunked_response = requests.post(
+        url, json={**body, 'chunk_size': 1000}, headers=headers)
+    assert chunked_response.json()['features'] == features
+
+    response = requests.post(url, json={'path': './../missing.csv'}, headers=headers)
+    assert response.status_code == 404
+
+
+def test_confidence_intervals():
+    '''
+    Test that the API returns the bootstrap confidence interval of each requested
+    statistic, which brackets the statistic, and the statistics without them otherwise.
+    '''
+    url = base + '/v1/aderencia'
+    body = {
+        'path': './../app/datasets/credit_01/train.gz',
+        'statistics': ['ks_test', 'js_divergence', 'psi']
+    }
+
+    response = requests.post(url, json={**body, 'confidence_intervals': True}, headers=headers)
+
+    assert response.status_code == 200
+
+    response_body = response.json()
+    intervals = response_body['confidence_intervals']
+    assert set(intervals) == {'confidence', 'resamples', 'ks_statistic', 'js_divergence', 'psi'}
+    assert intervals['ks_statistic']['lower'] <= response_body['ks_test']['ks_statistic'] \
+        <= intervals['ks_statistic']['upper']
+    assert intervals['js_divergence']['lower'] <= response_body['js_divergence'] \
+        <= intervals['js_divergence']['upper']
+    assert intervals['psi']['lower'] <= response_body['psi'] <= intervals['psi']['upper']
+
+    response = requests.post(url, json=body, headers=headers)
+    assert 'confidence_intervals' not in response.json()
+
+
+def wait_for_job(job_url: str, timeout: float = 60):
+    '''
+    Helper function that polls the status of a job until it finishes.
+
+    Parameters:
+    -----------
+    job_url: str
+        The URL of the job.
+    timeout: float
+        The maximum number of seconds to wait.
+
+    Returns:
+    --------
+    The last status of the job.
+    '''
+    deadline = time.time() + timeout
+    status = requests.get(job_url).json()
+
+    while status['status'] in ('queued', 'running') and time.time() < deadline:
+        time.sleep(0.1)
+        status = requests.get(job_url).json()
+
+    return status
@@ -0,0 +1,93 @@
+'''
+This module contains tests for the request instrumentation of the API.
+
+Every request returns the duration of its stages in the Server-Timing header, and
+the /metrics endpoint exposes the request, stage, record and error metrics in the
+Prometheus text format.
+
+Functions:
+----------
+test_server_timing():
+    Tests that a request returns the duration of its stages in the Server-Timing header.
+
+test_metrics():
+    Tests that the /metrics endpoint counts the requests, stages, records and errors.
+
+get_testing_body(path: str = './../app/datasets/batch_records.json'):
+    Helper function that returns a testing batch records body.
+'''
+
+import json
+import random
+
+import requests
+
+
+base = 'http://127.0.0.1:8000'
+headers = {'Content-Type': 'application/json; charset=utf-8'}
+
+
+def test_server_timing():
+    '''
+    Test that a performance request returns the duration of its stages, including the
+    ones run in the compute executor, in the Server-Timing header. One record is given
+    an age no request has sent before, so that the score cache misses it and the
+    model is called.
+    '''
+    url = base + '/v1/performance'
+
+    body = get_testing_body()
+    body[0]['IDADE'] = random.uniform(18, 90)
+    response = requests.post(url, json=body, headers=headers)
+
+    assert response.status_code == 200
+
+    stages = {
+        metric.split(';')[0].strip(): float(metric.split('dur=')[1])
+        for metric in response.headers['Server-Timing'].split(',')
+    }
+    assert {'read_body', 'decode', 'validate', 'predict', 'auc', 'total'} <= set(stages)
+    assert all(duration >= 0 for duration in stages.values())
+
+
+def test_metrics():
+    '''
+    Test that the /metrics endpoint counts the requests by route and status, the
+    duration of the stages, the processed records and the errors by exception type.
+    '''
+    url = base + '/v1/performance'
+
+    body = get_testing_body()
+    requests.post(url, json=body, headers=headers)
+    requests.post(url, json={}, headers=headers)
+
+    response = requests.get(base + '/metrics')
+
+    assert response.status_code == 200
+    assert response.headers['Content-Type'].startswith('text/plain')
+
+    metrics = response.text
+    assert 'api_requests_total{method="POST",route="/v1/performance",status="200"}' in metrics
+    assert 'api_stage_duration_seconds_count{stage="validate"}' in metrics
+    assert 'api_records_total{route="/v1/performance"}' in metrics
+    assert ('api_errors_total{route="/v1/performance",exception="InvalidRequestError"}'
+            in metrics)
+
+
+def get_testing_body(path: str = './../app/datasets/batch_records.json'):
+    '''
+    Helper function that returns a testing batch records body.
+
+    Parameters:
+    -----------
+    path: str
+        The path of the file containing the batch records body.
+
+    Returns:
+    --------
+    The batch records body in JSON format.
+    '''
+    with open(path) as f:
+        body = json.load(f)
+
+    return body
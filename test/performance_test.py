@@ -11,15 +11,60 @@ test_invalid_body_request():
 test_invalid_body_schema():
     Tests the behavior of the endpoint when an invalid body schema is sent.
 
+test_invalid_ref_date():
+    Tests the behavior of the endpoint when a REF_DATE is not a date-time.
+
 test_successful():
     Tests the successful behavior of the endpoint when a valid request body is sent.
 
+test_model_version():
+    Tests the behavior of the endpoint when a model version is selected.
+
+test_unknown_model_version():
+    Tests the behavior of the endpoint when an unknown model version is selected.
+
+test_granularity():
+    Tests the volumetry of the endpoint by day and by week.
+
+test_unknown_granularity():
+    Tests the behavior of the endpoint when an unknown granularity is selected.
+
+test_input_formats():
+    Tests that NDJSON, Arrow and Parquet bodies give the same result as a JSON body.
+
+test_unsupported_content_type():
+    Tests the behavior of the endpoint when the body format is not supported.
+
+test_session():
+    Tests that batches appended to a session give the metrics of the whole body.
+
+test_auc_by_period():
+    Tests that the AUC-ROC of each period is the AUC-ROC of the records of that period.
+
+test_score_cache():
+    Tests that records already scored, in the same body or an earlier one, are not scored again.
+    Skipped when the API runs the process pool, whose caches are per process.
+
+test_confidence_intervals():
+    Tests that the bootstrap confidence interval of the AUC-ROC brackets the AUC-ROC.
+
+test_micro_batching():
+    Tests that concurrent requests, scored together in micro-batches, get the results
+    of requests sent one at a time.
+
 get_testing_body(path: str = './../app/datasets/batch_records.json'):
     Helper function that returns a testing batch records body.
 '''
 
+import io
+import pytest
+import random
 import requests
 import json
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 
 
 base = 'http://127.0.0.1:8000'
@@ -40,7 +85,8 @@ def test_invalid_body_request():
 
 def test_invalid_body_schema():
     '''
-    Test the behavior of the performance endpoint when an invalid body schema is sent.
+    Test the behavior of the performance endpoint when an invalid body schema is sent,
+    alone or to a session.
     '''
     url = base + '/v1/performance'
 
@@ -52,6 +98,33 @@ def test_invalid_body_schema():
     assert response.status_code == 400
     assert response.json()['error'].startswith('Body schema is invalid')
 
+    response = requests.post(url, json=[dict(first_record, IDADE='x')], headers=headers)
+
+    assert response.status_code == 400
+    assert response.json()['error'].startswith('Body schema is invalid')
+
+    session = requests.post(url + '/sessions').json()
+    response = requests.post(url, json=first_record, headers=headers,
+                             params={'session_id': session['session_id']})
+
+    assert response.status_code == 400
+    assert response.json()['error'].startswith('Body schema is invalid')
+
+
+def test_invalid_ref_date():
+    '''
+    Test that the API returns a 400 error when a REF_DATE is not a date-time.
+    '''
+    url = base + '/v1/performance'
+
+    body = get_testing_body()
+    body[1]['REF_DATE'] = 'yesterday'
+
+    response = requests.post(url, json=body, headers=headers)
+
+    assert response.status_code == 400
+    assert response.json()['error'] == "Body schema is invalid: 'yesterday' is not a 'date-time'."
+
 
 def test_successful():
     '''
@@ -69,6 +142,262 @@ def test_successful():
     assert isinstance(response_body['auc_roc'], float)
 
 
+def test_model_version():
+    '''
+    Test that selecting the default model version explicitly gives the same result.
+    '''
+    url = base + '/v1/performance'
+
+    body = get_testing_body()
+    response = requests.post(url, json=body, headers=headers)
+    versioned_response = requests.post(
+        url, json=body, headers=headers, params={'model_version': 'model'})
+
+    assert versioned_response.status_code == 200
+    assert versioned_response.json() == response.json()
+
+
+def test_unknown_model_version():
+    '''
+    Test that the API returns a 400 error when an unknown model version is selected.
+    '''
+    url = base + '/v1/performance'
+
+    body = get_testing_body()
+    response = requests.post(
+        url, json=body, headers=headers, params={'model_version': 'missing'})
+
+    assert response.status_code == 400
+    assert response.json()['error'] == 'Unknown model version: missing.'
+
+
+def test_granularity():
+    '''
+    Test that the volumetry by day and by week counts every record of the body.
+    '''
+    url = base + '/v1/performance'
+
+    body = get_testing_body()
+
+    for granularity, key_length in (('day', len('YYYY-MM-DD')), ('week', len('YYYY-Www'))):
+        response = requests.post(
+            url, json=body, headers=headers, params={'granularity': granularity})
+
+        assert response.status_code == 200
+
+        volumetry = response.json()['volumetry']
+        assert sum(volumetry.values()) == len(body)
+        assert all(len(key) == key_length for key in volumetry)
+
+
+def test_unknown_granularity():
+    '''
+    Test that the API returns a 400 error when an unknown granularity is selected.
+    '''
+    url = base + '/v1/performance'
+
+    body = get_testing_body()
+    response = requests.post(
+        url, json=body, headers=headers, params={'granularity': 'year'})
+
+    assert response.status_code == 400
+    assert response.json()['error'].startswith('Unknown granularity: year.')
+
+
+def test_input_formats():
+    '''
+    Test that NDJSON, Arrow IPC and Parquet bodies give the same result as a JSON body.
+    '''
+    url = base + '/v1/performance'
+
+    body = get_testing_body()
+    expected = requests.post(url, json=body, headers=headers).json()
+
+    table = pa.Table.from_pandas(pd.DataFrame(body), preserve_index=False)
+    arrow_stream = pa.BufferOutputStream()
+    with pa.ipc.new_stream(arrow_stream, table.schema) as writer:
+        writer.write_table(table)
+    parquet_file = io.BytesIO()
+    pq.write_table(table, parquet_file)
+
+    bodies = {
+        'application/x-ndjson': '\n'.join(json.dumps(record) for record in body).encode(),
+        'application/vnd.apache.arrow.stream': arrow_stream.getvalue().to_pybytes(),
+        'application/vnd.apache.parquet': parquet_file.getvalue()
+    }
+
+    for content_type, data in bodies.items():
+        response = requests.post(url, data=data, headers={'Content-Type': content_type})
+
+        assert response.status_code == 200
+        assert response.json() == expected
+
+
+def test_unsupported_content_type():
+    '''
+    Test that the API returns a 415 error when the body format is not supported.
+    '''
+    url = base + '/v1/performance'
+
+    response = requests.post(url, data=b'VAR2,IDADE', headers={'Content-Type': 'text/csv'})
+
+    assert response.status_code == 415
+    assert response.json()['error'].startswith('Unsupported Content-Type: text/csv.')
+
+
+def test_session():
+    '''
+    Test that the running metrics of a session the body is appended to in batches
+    are the metrics of the whole body.
+    '''
+    url = base + '/v1/performance'
+
+    body = get_testing_body()
+    expected = requests.post(url, json=body, headers=headers).json()
+
+    response = requests.post(url + '/sessions')
+
+    assert response.status_code == 201
+
+    session_url = base + response.headers['Location']
+    session_id = response.json()['session_id']
+
+    for start in range(0, len(body), 100):
+        response = requests.post(
+            url, json=body[start:start + 100], headers=headers, params={'session_id': session_id})
+
+        assert response.status_code == 200
+
+    session = requests.get(session_url).json()
+
+    assert session['records'] == len(body)
+    assert session['volumetry'] == expected['volumetry']
+    assert abs(session['auc_roc'] - expected['auc_roc']) < 1e-12
+
+    assert requests.delete(session_url).status_code == 200
+    assert requests.get(session_url).status_code == 404
+
+
+def test_auc_by_period():
+    '''
+    Test that the AUC-ROC of each period is the AUC-ROC of the records of that period
+    alone, and that a period with a single class gets a null AUC-ROC with its counts.
+    '''
+    url = base + '/v1/performance'
+
+    body = get_testing_body()
+    body = [
+        record for record in body
+        if not record['REF_DATE'].startswith('2017-01') or record['TARGET'] == 1
+    ]
+
+    response = requests.post(url, json=body, headers=headers, params={'auc_by_period': True})
+
+    assert response.status_code == 200
+
+    performance = response.json()
+    assert set(performance['auc_roc_by_period']) == set(performance['volumetry'])
+    assert performance['auc_roc_by_period']['2017-01'] == {
+        'auc_roc': None, 'positives': performance['volumetry']['2017-01'], 'negatives': 0}
+
+    period_body = [record for record in body if record['REF_DATE'].startswith('2017-02')]
+    expected = requests.post(url, json=period_body, headers=headers).json()
+
+    assert abs(performance['auc_roc_by_period']['2017-02']['auc_roc'] - expected['auc_roc']) < 1e-12
+
+
+def test_score_cache():
+    '''
+    Test that a repeated body and the duplicate records of a body are answered from the
+    score cache, with the same AUC-ROC.
+    '''
+    if requests.get(base + '/ready').json()['executor'] == 'process':
+        pytest.skip('Each worker process of the process pool has a cache and counts of its own.')
+    url = base + '/v1/performance'
+
+    body = get_testing_body()
+    body = body + body[:100]
+    distinct_records = len({json.dumps(record, sort_keys=True) for record in body})
+
+    before = requests.get(url + '/cache').json()
+    first = requests.post(url, json=body, headers=headers)
+    middle = requests.get(url + '/cache').json()
+    second = requests.post(url, json=body, headers=headers)
+    after = requests.get(url + '/cache').json()
+
+    assert first.status_code == 200 and second.status_code == 200
+    assert first.json()['auc_roc'] == second.json()['auc_roc']
+    assert middle['duplicates'] - before['duplicates'] == len(body) - distinct_records
+    assert middle['hits'] + middle['misses'] - before['hits'] - before['misses'] == distinct_records
+    assert after['misses'] == middle['misses']
+    assert after['hits'] - middle['hits'] == distinct_records
+    assert 0 < after['entries'] <= after['max_entries']
+
+
+def test_confidence_intervals():
+    '''
+    Test that the bootstrap confidence interval of the AUC-ROC brackets the AUC-ROC,
+    is the same for the same body and is rejected for a session.
+    '''
+    url = base + '/v1/performance'
+    body = get_testing_body()
+    params = {'confidence_intervals': True}
+
+    response = requests.post(url, json=body, headers=headers, params=params)
+
+    assert response.status_code == 200
+
+    performance = response.json()
+    intervals = performance['confidence_intervals']
+    assert intervals['confidence'] == 0.95
+    assert intervals['resamples'] == 1000
+    assert intervals['auc_roc']['lower'] <= performance['auc_roc'] <= intervals['auc_roc']['upper']
+    assert intervals['auc_roc']['lower'] < intervals['auc_roc']['upper']
+
+    repeated = requests.post(url, json=body, headers=headers, params=params)
+    assert repeated.json()['confidence_intervals'] == intervals
+
+    session = requests.post(url + '/sessions').json()
+    response = requests.post(url, json=body, headers=headers,
+                             params={**params, 'session_id': session['session_id']})
+    assert response.status_code == 400
+
+
+def test_micro_batching():
+    '''
+    Test that concurrent requests get the results of the same bodies sent one at a time.
+    When the model is scored by scikit-learn in a thread pool of several workers, as
+    with `make testing-sklearn`, their records are scored together in micro-batches.
+    Each body holds a different part of the records, with their ages shifted by an
+    amount that misses the score cache without crossing a split of the decision tree,
+    whose splits on the ages, given with three decimals, lie on half-thousandths.
+    '''
+    url = base + '/v1/performance'
+    readiness = requests.get(base + '/ready').json()
+    batched = (readiness['executor'] == 'thread'
+               and not readiness['components']['models']['compiled'])
+
+    records = get_testing_body()
+    bodies = [records[index * 40:] for index in range(8)]
+    expected = [requests.post(url, json=body, headers=headers).json() for body in bodies]
+
+    shifted_bodies = []
+    for body in bodies:
+        shift = random.uniform(1e-5, 3e-4)
+        shifted_bodies.append([
+            record if record['IDADE'] is None else dict(record, IDADE=record['IDADE'] + shift)
+            for record in body])
+
+    with ThreadPoolExecutor(len(shifted_bodies)) as executor:
+        responses = list(executor.map(
+            lambda body: requests.post(url, json=body, headers=headers), shifted_bodies))
+
+    assert all(response.status_code == 200 for response in responses)
+    assert [response.json() for response in responses] == expected
+    if batched:
+        assert any('batch_wait' in response.headers['Server-Timing'] for response in responses)
+
+
 def get_testing_body(path: str = './../app/datasets/batch_records.json'):
     '''
     Helper function that returns a testing batch records body.
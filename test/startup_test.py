@@ -0,0 +1,50 @@
+'''
+This module contains tests for the startup of the API.
+
+The /ready endpoint reports whether the API started up and which of its components
+are warm. The API under test runs in the default eager startup mode, with either
+compute executor.
+
+Functions:
+----------
+test_readiness():
+    Tests that the /ready endpoint reports every component warm after an eager startup.
+'''
+
+import os
+
+import requests
+
+
+base = 'http://127.0.0.1:8000'
+
+
+def test_readiness():
+    '''
+    Test that, after an eager startup, the /ready endpoint reports the API ready with
+    the models, their profiles, the warm-up inference and every deferred import warm,
+    whatever requests were served before, and the model scored by its compiled scorer
+    unless the tests run with COMPILED_SCORER=false, as with `make testing-sklearn`.
+    '''
+    url = base + '/ready'
+
+    response = requests.get(url)
+
+    assert response.status_code == 200
+
+    readiness = response.json()
+    assert readiness['ready'] is True
+    assert readiness['mode'] == 'eager'
+    assert readiness['executor'] in ('thread', 'process')
+
+    components = readiness['components']
+    assert set(components) == {
+        'models', 'reference_profiles', 'feature_profiles', 'warm_up', 'imports'}
+    assert all(component['warm'] for component in components.values())
+    assert 'model' in components['models']['versions']
+    compiled = os.environ.get('COMPILED_SCORER', 'true').lower() in ('1', 'true', 'yes')
+    assert components['models']['compiled'] == (['model'] if compiled else [])
+    assert components['warm_up']['versions'] == components['models']['versions']
+    assert components['models']['seconds'] >= 0
+    assert all(components['imports']['modules'].values())
+    assert components['imports']['seconds'] >= 0